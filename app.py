@@ -1,14 +1,20 @@
 import streamlit as st
 import os
 import logging
-import base64
+import re
+import time
+import uuid
+from collections import deque
+from concurrent.futures import Future
 from datetime import datetime
 from dotenv import load_dotenv
-from streamlit_mic_recorder import speech_to_text
 
 # Import HelpBuddy components
 from src.agents.helpbuddy_agent import HelpBuddyAgent
+from src.config import settings
 from src.config.logging_config import setup_logging
+from src.utils.image_processor import encode_image_stream, hash_image_stream
+from src.utils.ttl_cache import TTLCache
 
 # Load environment variables
 load_dotenv()
@@ -17,12 +23,13 @@ load_dotenv()
 setup_logging()
 logger = logging.getLogger(__name__)
 
-# Verify PDF file exists
+@st.cache_data(show_spinner=False)
+def pdf_exists(path: str) -> bool:
+    """Check for the textbook PDF once per process"""
+    return os.path.exists(path)
+
+# Textbook PDF; its presence is verified at the top of main()
 pdf_path = os.path.join("data", "ncert_science_class8.pdf")
-if not os.path.exists(pdf_path):
-    logger.error(f"Required PDF file not found: {pdf_path}")
-    st.error("Error: Required textbook PDF file not found. Please make sure the NCERT Science Class 8 PDF is in the data folder.")
-    st.stop()
 
 # Page configuration
 st.set_page_config(
@@ -32,8 +39,8 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Custom CSS
-st.markdown("""
+# Static page blocks, built once at import and reused on every rerun
+CUSTOM_CSS = """
 <style>
     .main-header {
         text-align: center;
@@ -43,72 +50,276 @@ st.markdown("""
         border-radius: 10px;
         margin-bottom: 2rem;
     }
-    .chat-message {
-        padding: 1rem;
-        border-radius: 10px;
-        margin: 1rem 0;
-        border-left: 4px solid #667eea;
-        color: #000000;
-    }
-    .user-message {
-        background-color: #f0f2f6;
-        border-left-color: #667eea;
-        color: #000000;
-    }
-    .bot-message {
-        background-color: #e8f4fd;
-        border-left-color: #1f77b4;
-        color: #000000;
-    }
     .sidebar-content {
         background-color: #f8f9fa;
         padding: 1rem;
         border-radius: 10px;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+HEADER_HTML = """
+<div class="main-header">
+    <h1>HelpBuddy AI</h1>
+    <p>Your study Assistant</p>
+</div>
+"""
 
+ABOUT_MARKDOWN = """
+**HelpBuddy AI** is powered by:
+- Google Gemini 2.5+
+- NCERT Science class 8
+- Advanced Guardrails
+- LangChain Agent Framework
+- LangSmith Monitoring (Optional)
+"""
+
+# Custom CSS
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
+
+@st.cache_resource(show_spinner=False)
 def initialize_helpbuddy():
-    """Initialize HelpBuddy AI agent"""
-    return HelpBuddyAgent()
+    """Initialize HelpBuddy AI agent once and share it across reruns and sessions"""
+    return HelpBuddyAgent(embed_dim=settings.EMBED_DIM)
+
+@st.cache_resource(show_spinner=False)
+def knowledge_base_ready(_helpbuddy) -> bool:
+    """Check the vector store once per process; cleared when a background index build finishes"""
+    return _helpbuddy.vector_store.is_initialized()
+
+@st.cache_resource(show_spinner=False)
+def load_knowledge_base(_helpbuddy, pdf_path: str, mtime: float) -> Future:
+    """Start indexing the textbook in the background, once per PDF revision; the index itself is persisted by ChromaDB"""
+    if _helpbuddy.vector_store.is_initialized():
+        # Another session may have finished indexing since this process cached "not ready"
+        done = Future()
+        done.set_result(True)
+        return done
+    return _helpbuddy.initialize_knowledge_base_async(pdf_path)
+
+@st.cache_resource(show_spinner=False)
+def answer_cache() -> TTLCache:
+    """Process-wide cache of standalone answers, shared by all sessions"""
+    return TTLCache(max_entries=1024, ttl_seconds=3600)
+
+@st.cache_data(max_entries=512, show_spinner=False)
+def embed_query(query: str) -> list:
+    """Memoize query embeddings process-wide so a repeated question skips the embedding API call"""
+    return initialize_helpbuddy().vector_store.embed_query(query)
+
+# Queries queued within this window of each other are flushed together
+QUEUE_DEBOUNCE_SECONDS = 0.2
+
+# Session ids carried in the ?sid= URL parameter
+_SESSION_ID_RE = re.compile(r"[0-9a-f]{32}")
+
+# Markdown/LaTeX control characters that should show literally in user messages
+_MARKDOWN_SPECIAL = re.compile(r"([\\`*_{}\[\]()#+\-!|<>~$])")
+
+def escape_markdown(text: str) -> str:
+    """Escape user text once so the chat renders it verbatim instead of as markdown"""
+    return _MARKDOWN_SPECIAL.sub(r"\\\1", text).replace("\n", "  \n")
+
+# Conversation pairs replayed into a fresh memory manager
+SYNC_WINDOW = 20
+
+@st.cache_data(max_entries=16, show_spinner=False)
+def encode_image(image_hash: str, _image_stream) -> str:
+    """Base64-encode an uploaded image once per content hash, however often it is resubmitted"""
+    return encode_image_stream(_image_stream)
+
+def answer_cache_key(query: str, image_hash: str = None) -> tuple:
+    """Key an answer by knowledge-base revision, normalized query text and image content"""
+    kb_version = os.path.getmtime(pdf_path)
+    return (kb_version, " ".join(query.lower().split()), image_hash)
+
+def enqueue_query(query: str, image=None, source: str = "text", image_hash: str = None):
+    """Queue a query for the next flush, ignoring repeats of the last or an already queued query"""
+    queue = st.session_state.pending_queries
+    if query == st.session_state.last_processed_query or any(item["query"] == query for item in queue):
+        return
+    queue.append({"query": query, "image": image, "source": source, "image_hash": image_hash})
+    st.session_state.last_enqueued_at = time.monotonic()
+
+def is_shareable_answer(metadata: dict) -> bool:
+    """Check if an answer was built without any session memory, so other sessions may reuse it"""
+    return (metadata.get("route") == "answer" and "error" not in metadata
+            and metadata.get("has_history") is False)
+
+def answer_query(helpbuddy, item: dict) -> str:
+    """Answer one queued query, streaming the response into the page as it is generated"""
+    query = item["query"]
+    image_stream = item["image"]
+    if image_stream is not None:
+        logger.info(f"Processing image query: '{query}' with image size: {image_stream.size} bytes")
+    else:
+        logger.info(f"Processing {item['source']} query: {query}")
+    
+    image_hash = item.get("image_hash")
+    if image_stream is not None and image_hash is None:
+        image_hash = hash_image_stream(image_stream)
+    cache_key = answer_cache_key(query, image_hash)
+    # A session with history routes follow-ups and history questions first, so only fresh sessions look up
+    response = None if helpbuddy.has_session_history() else answer_cache().get(cache_key)
+    
+    if response is not None:
+        # Repeat question: reuse the answer but still record it in this session's memory
+        logger.info("Answer cache hit")
+        helpbuddy.memory_manager.add_interaction(
+            user_query=query,
+            bot_response=response,
+            metadata={"has_image": image_stream is not None, "cached": True}
+        )
+        return response
+    
+    # Stream the agent's answer as it is generated; the finished turn is rendered in the history below
+    result = {}
+    query_embedding = embed_query(query) if image_stream is None else None
+    image_data = encode_image(image_hash, image_stream) if image_stream is not None else None
+    response_placeholder = st.empty()
+    with response_placeholder.container(), st.chat_message("assistant"):
+        response = st.write_stream(
+            helpbuddy.process_query_stream(
+                query=query,
+                has_image=(image_stream is not None),
+                image_data=image_data,
+                query_embedding=query_embedding,
+                state=result
+            )
+        )
+    response_placeholder.empty()
+    response = response or "Sorry, I couldn't process your question."
+    
+    if is_shareable_answer(result.get("metadata", {})):
+        answer_cache().set(cache_key, response)
+    return response
+
+def answer_text_batch(helpbuddy, items: list):
+    """Answer several text queries with one batched agent call, storing each response on its item"""
+    cache_keys = [answer_cache_key(item["query"]) for item in items]
+    use_cache = not helpbuddy.has_session_history()
+    misses = []
+    for item, cache_key in zip(items, cache_keys):
+        response = answer_cache().get(cache_key) if use_cache else None
+        if response is None:
+            misses.append((item, cache_key))
+            continue
+        logger.info("Answer cache hit")
+        helpbuddy.memory_manager.add_interaction(
+            user_query=item["query"],
+            bot_response=response,
+            metadata={"has_image": False, "cached": True}
+        )
+        item["response"] = response
+    if not misses:
+        return
+    
+    logger.info(f"Processing {len(misses)} queued text queries in one batch")
+    queries = [item["query"] for item, _ in misses]
+    query_embeddings = [embed_query(query) for query in queries]
+    with st.spinner("Answering your questions..."):
+        results = helpbuddy.process_queries(queries, query_embeddings=query_embeddings)
+    for (item, cache_key), result in zip(misses, results):
+        item["response"] = result["response"] or "Sorry, I couldn't process your question."
+        if is_shareable_answer(result["metadata"]):
+            answer_cache().set(cache_key, item["response"])
+
+def flush_queries(helpbuddy, batch: list):
+    """Answer queued queries in order, batching text queries into one LLM call when several are waiting"""
+    text_items = [item for item in batch if item["image"] is None]
+    if len(text_items) > 1:
+        try:
+            answer_text_batch(helpbuddy, text_items)
+        except Exception as e:
+            # Unanswered items fall through to one-by-one processing below
+            logger.error(f"Batched query processing error: {str(e)}")
+    
+    for item in batch:
+        try:
+            response = item.get("response") or answer_query(helpbuddy, item)
+            
+            # Update conversation history with timestamps
+            current_time = datetime.now().strftime("%H:%M")
+            st.session_state.conversation_pairs.append((
+                {"role": "user", "content": item["query"], "content_md": escape_markdown(item["query"]),
+                 "timestamp": current_time},
+                {"role": "assistant", "content": response, "timestamp": current_time}
+            ))
+            
+            # Mark this query as processed
+            st.session_state.last_processed_query = item["query"]
+        except Exception as e:
+            if item["source"] == "audio":
+                st.error("I'm having trouble processing your voice input. Please try again or use text input.")
+            else:
+                st.error("Sorry, I'm having trouble processing your question right now. Please try again.")
+            logger.error(f"Query processing error: {str(e)}")
+        finally:
+            # Release the upload buffer as soon as the agent is done with it
+            if item["image"] is not None:
+                item["image"].close()
 
 def main():
+    # Verify PDF file exists
+    if not pdf_exists(pdf_path):
+        logger.error(f"Required PDF file not found: {pdf_path}")
+        st.error("Error: Required textbook PDF file not found. Please make sure the NCERT Science Class 8 PDF is in the data folder.")
+        st.stop()
+
     # Header
-    st.markdown("""
-    <div class="main-header">
-        <h1>HelpBuddy AI</h1>
-        <p>Your study Assistant</p>
-    </div>
-    """, unsafe_allow_html=True)
+    st.markdown(HEADER_HTML, unsafe_allow_html=True)
 
     # Initialize components
     try:
         helpbuddy = initialize_helpbuddy()
         
+        # The agent is shared, so route its conversation memory to this session. The id lives in
+        # the URL, so a reload or a return after a server restart finds its stored memory again
+        if "session_id" not in st.session_state:
+            session_id = st.query_params.get("sid", "")
+            if not _SESSION_ID_RE.fullmatch(session_id):
+                session_id = uuid.uuid4().hex
+                st.query_params["sid"] = session_id
+            st.session_state.session_id = session_id
+        helpbuddy.use_session(st.session_state.session_id)
+        
         # Check if vector store is ready
-        vectorstore_ready = helpbuddy.vector_store.is_initialized()
+        vectorstore_ready = knowledge_base_ready(helpbuddy)
         if not vectorstore_ready:
-            st.info("Initializing knowledge base from NCERT Science Class 8 PDF...")
-            with st.spinner("Loading and indexing PDF content..."):
-                success = helpbuddy.initialize_knowledge_base()
-                vectorstore_ready = success
-                if success:
-                    st.success("Knowledge base initialized successfully!")
-                else:
-                    st.error("Failed to initialize knowledge base. Please check the PDF file.")
-                    st.stop()
+            # Indexing runs off the script thread; inputs stay disabled and the page polls until it finishes
+            indexing = load_knowledge_base(helpbuddy, pdf_path, os.path.getmtime(pdf_path))
+            if not indexing.done():
+                st.info("Initializing knowledge base from NCERT Science Class 8 PDF... This page updates when it's ready.")
+            elif indexing.result():
+                vectorstore_ready = True
+                knowledge_base_ready.clear()
+                answer_cache().clear()
+                helpbuddy.semantic_cache.clear()
+                st.success("Knowledge base initialized successfully!")
+            else:
+                # Don't keep a failed attempt cached, so the next rerun retries
+                load_knowledge_base.clear()
+                st.error("Failed to initialize knowledge base. Please check the PDF file.")
+                st.stop()
         
         # Initialize session state
-        if "conversation_history" not in st.session_state:
-            st.session_state.conversation_history = []
+        if "conversation_pairs" not in st.session_state:
+            st.session_state.conversation_pairs = []
         if "last_processed_query" not in st.session_state:
             st.session_state.last_processed_query = ""
+        if "render_limit" not in st.session_state:
+            st.session_state.render_limit = 50
+        if "pending_queries" not in st.session_state:
+            st.session_state.pending_queries = deque()
+            st.session_state.last_enqueued_at = 0.0
         
-        # Synchronize existing conversation history with memory manager
-        if st.session_state.conversation_history and len(helpbuddy.memory_manager.conversations) == 0:
-            success = helpbuddy.sync_conversation_history(st.session_state.conversation_history)
+        # Synchronize recent conversation history with memory manager; older turns only survive as its summary
+        if st.session_state.conversation_pairs and len(helpbuddy.memory_manager.conversations) == 0:
+            recent_pairs = st.session_state.conversation_pairs[-SYNC_WINDOW:]
+            older_queries = [user_msg["content"] for user_msg, _ in st.session_state.conversation_pairs[:-SYNC_WINDOW]]
+            success = helpbuddy.sync_conversation_history(recent_pairs, older_queries=older_queries)
             if success:
-                logger.info(f"Synchronized {len(st.session_state.conversation_history) // 2} conversation pairs with memory manager")
+                logger.info(f"Synchronized {len(recent_pairs)} conversation pairs with memory manager")
             else:
                 logger.error("Failed to synchronize conversation history with memory manager")
             
@@ -129,24 +340,18 @@ def main():
             )
             st.session_state.active_tab = selected_tab
 
-            # Initialize variables for later use
-            text_input = ""
-            text_submit = False
-            audio_text = ""
-            uploaded_file = None
-            image_question = ""
-            image_submit = False
-
+            # Tabs only queue the query; the queue is flushed once after all input UI is drawn
             if selected_tab == "💬 Text":
-                text_input = st.text_area("Type your question about NCERT Science Class 8:", 
-                                        key="text_input", 
-                                        height=100,
-                                        disabled=not vectorstore_ready)
-                text_submit = st.button("Ask Question", key="text_submit", disabled=not vectorstore_ready)
+                if text_input := st.chat_input("Type your question about NCERT Science Class 8...",
+                                               key="text_input",
+                                               disabled=not vectorstore_ready):
+                    enqueue_query(text_input, source="text")
             elif selected_tab == "🎤 Audio":
                 st.markdown("##### Speak your question about NCERT Science Class 8")
                 st.markdown("Click the microphone icon and speak your question")
                 if vectorstore_ready:
+                    # Imported on first use so sessions that never open the audio tab don't load it
+                    from streamlit_mic_recorder import speech_to_text
                     audio_text = speech_to_text(
                         language='en',
                         key="audio_input",
@@ -157,36 +362,28 @@ def main():
                     audio_text = None
                 if audio_text and vectorstore_ready:
                     st.info("Recorded Text: " + audio_text)
-                    try:
-                        # Check if this audio query was already processed
-                        if audio_text != st.session_state.last_processed_query:
-                            result = helpbuddy.process_query(audio_text, has_image=False, image_data=None)
-                            response = result.get("response", "Sorry, I couldn't process your question.")
-                            current_time = datetime.now().strftime("%H:%M")
-                            st.session_state.conversation_history.append({
-                                "role": "user", 
-                                "content": audio_text,
-                                "timestamp": current_time
-                            })
-                            st.session_state.conversation_history.append({
-                                "role": "assistant", 
-                                "content": response,
-                                "timestamp": current_time
-                            })
-                            st.session_state.last_processed_query = audio_text
-                    except Exception as e:
-                        st.error("I'm having trouble processing your voice input. Please try again or use text input.")
-                        logger.error(f"Audio processing error: {str(e)}")
+                    enqueue_query(audio_text, source="audio")
             elif selected_tab == "📷 Image":
                 uploaded_file = st.file_uploader("Upload an image:", type=["png", "jpg", "jpeg"], disabled=not vectorstore_ready)
                 if uploaded_file:
                     st.image(uploaded_file, caption="Uploaded Image")
                     st.session_state.current_image = uploaded_file
+                    # Hash each upload once; resubmitting the same image reuses its answers and encoding
+                    if st.session_state.get("current_image_id") != uploaded_file.file_id:
+                        st.session_state.current_image_id = uploaded_file.file_id
+                        st.session_state.current_image_hash = hash_image_stream(uploaded_file)
+                        # Describe the image while the question is being typed
+                        helpbuddy.image_processor.prefetch_description(
+                            encode_image(st.session_state.current_image_hash, uploaded_file)
+                        )
                 image_question = st.text_area("Ask a question about the image:", 
                                             key="image_question", 
                                             height=100,
                                             disabled=not vectorstore_ready)
                 image_submit = st.button("Ask Question", key="image_submit", disabled=not vectorstore_ready)
+                if uploaded_file and image_question and image_submit:  # Handle image input when submit button is clicked
+                    enqueue_query(image_question, image=uploaded_file, source="image",
+                                  image_hash=st.session_state.current_image_hash)
     
     except Exception as e:
         st.error("Unable to initialize HelpBuddy AI. Please check your API keys and try again.")
@@ -199,7 +396,7 @@ def main():
         st.markdown('<div class="sidebar-content">', unsafe_allow_html=True)
         st.header("Session Management")
         if st.button("Clear Conversation"):
-            st.session_state.conversation_history = []
+            st.session_state.conversation_pairs = []
             st.session_state.last_processed_query = ""
             helpbuddy.clear_conversation_memory()
             st.success("Conversation cleared!")
@@ -209,115 +406,53 @@ def main():
 
         # About section
         st.header("About")
-        st.markdown("""
-        **HelpBuddy AI** is powered by:
-        - Google Gemini 2.5+
-        - NCERT Science class 8
-        - Advanced Guardrails
-        - LangChain Agent Framework
-        - LangSmith Monitoring (Optional)
-        """)
+        st.markdown(ABOUT_MARKDOWN)
 
         st.markdown('</div>', unsafe_allow_html=True)
 
-    # Main content area - Handle query submission
-    query = None
-    image_data = None
-    
-    # Check which input is active and has data
-    if text_input and text_submit:  # Only process text when submit button is clicked
-        query = text_input
-        logger.info(f"Processing text query: {query}")
-    elif uploaded_file and image_question and image_submit:  # Handle image input when submit button is clicked
-        query = image_question
-        image_data = base64.b64encode(uploaded_file.getvalue()).decode()
-        logger.info(f"Processing image query: '{query}' with image data length: {len(image_data)}")
-    else:
+    # Main content area - Answer the queued queries, whichever tab they came from
+    queue = st.session_state.pending_queries
+    debounce_remaining = 0.0
+    if not queue:
         logger.info("No active query to process")
-    
-    # Process query if we have one (audio is handled separately in its tab)
-    if query and query != st.session_state.last_processed_query:
-        try:
-            # Process query through agent
-            result = helpbuddy.process_query(query=query, has_image=(image_data is not None), image_data=image_data)
-            
-            # Extract response from result
-            response = result.get("response", "Sorry, I couldn't process your question.")
-            
-            # Update conversation history with timestamps
-            current_time = datetime.now().strftime("%H:%M")
-            st.session_state.conversation_history.append({
-                "role": "user", 
-                "content": query,
-                "timestamp": current_time
-            })
-            st.session_state.conversation_history.append({
-                "role": "assistant", 
-                "content": response,
-                "timestamp": current_time
-            })
-            
-            # Mark this query as processed
-            st.session_state.last_processed_query = query
-            
-            # No need for st.rerun() - Streamlit will automatically rerun when session state changes
-        except Exception as e:
-            st.error("Sorry, I'm having trouble processing your question right now. Please try again.")
-            logger.error(f"Query processing error: {str(e)}")
+    else:
+        # Wait briefly after the latest query so queries arriving together are answered together;
+        # a lone query, by far the common case, is answered right away
+        debounce_remaining = 0.0
+        if len(queue) > 1:
+            debounce_remaining = QUEUE_DEBOUNCE_SECONDS - (time.monotonic() - st.session_state.last_enqueued_at)
+        if debounce_remaining <= 0:
+            flush_queries(helpbuddy, [queue.popleft() for _ in range(len(queue))])
 
     # Main content area - full width
     # Display conversation history
     st.header("Conversation")
     st.caption("💡 Newest messages appear at the top")
         
-    # Chat container
-    chat_container = st.container()
-
-    with chat_container:
-        # Display conversation history in reverse order (newest first)
-        # But group user and assistant messages together
-        conversation_pairs = []
-        i = 0
-        while i < len(st.session_state.conversation_history):
-            if i + 1 < len(st.session_state.conversation_history):
-                user_msg = st.session_state.conversation_history[i]
-                assistant_msg = st.session_state.conversation_history[i + 1]
-                if user_msg["role"] == "user" and assistant_msg["role"] == "assistant":
-                    conversation_pairs.append((user_msg, assistant_msg))
-                    i += 2
-                else:
-                    # Handle orphaned messages
-                    conversation_pairs.append((user_msg, None))
-                    i += 1
-            else:
-                # Handle last message if odd number
-                conversation_pairs.append((st.session_state.conversation_history[i], None))
-                i += 1
-        
-        # Display conversation pairs in reverse order (newest first)
-        for user_msg, assistant_msg in reversed(conversation_pairs):
-            timestamp = user_msg.get("timestamp", "")
-            
-            # Display user message first
-            st.markdown(f"""
-            <div class="chat-message user-message">
-                <strong>You:</strong> <small style="color: #666;">{timestamp}</small><br>
-                {user_msg["content"]}
-            </div>
-            """, unsafe_allow_html=True)
-            
-            # Display assistant response if available
-            if assistant_msg:
-                st.markdown(f"""
-                <div class="chat-message bot-message">
-                    <strong>HelpBuddy:</strong> <small style="color: #666;">{timestamp}</small><br>
-                    {assistant_msg["content"]}
-                </div>
-                """, unsafe_allow_html=True)
+    # Native chat components; the browser only re-renders messages that changed
+    for user_msg, assistant_msg in reversed(st.session_state.conversation_pairs[-st.session_state.render_limit:]):
+        timestamp = user_msg.get("timestamp", "")
+        with st.chat_message("user"):
+            st.caption(timestamp)
+            st.markdown(user_msg.get("content_md") or escape_markdown(user_msg["content"]))
+        if assistant_msg:
+            with st.chat_message("assistant"):
+                st.caption(timestamp)
+                st.markdown(assistant_msg["content"])
             
     st.markdown("---")
 
     # Removed status panel - not needed for user experience
 
+    # Flush the query queue once the debounce window has passed
+    if debounce_remaining > 0:
+        time.sleep(debounce_remaining)
+        st.rerun()
+
+    # Poll the background indexing job without holding the script thread
+    if not vectorstore_ready:
+        time.sleep(1)
+        st.rerun()
+
 if __name__ == "__main__":
     main()
@@ -3,202 +3,658 @@ HelpBuddy AI Agent - LangChain-based chatbot for NCERT Science Class 8
 """
 
 import logging
-from typing import Dict, Any, Optional
-from langchain_core.messages import HumanMessage, AIMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from src.config import Settings
+import re
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import BinaryIO, Dict, Any, Iterator, List, Optional, Sequence, Tuple
+from langchain_core.messages import AIMessage, BaseMessage, HumanMessage, SystemMessage
+from src.config import get_llm, settings
 from src.guardrails.content_filter import ContentFilter
 from src.vectorstore.chroma_store import ChromaStore
-from src.utils.image_processor import ImageProcessor
+from src.utils.image_processor import ImageProcessor, encode_image_stream
 from src.utils.memory_manager import MemoryManager
+from src.utils.memory_store import MemoryStore
+from src.utils.semantic_cache import SemanticCache
+from src.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Session the calling thread is serving; one agent instance is shared by all sessions
+_current_session: ContextVar[str] = ContextVar("helpbuddy_session", default="default")
+
+# Static instructions sent as the system message, ahead of the per-query context, so the
+# provider sees an identical prompt prefix on every call
+SYSTEM_PREFIX_TEXT = """You are HelpBuddy AI, a helpful assistant for NCERT Science Class 8 students.
+
+RESPONSE FORMAT REQUIREMENTS:
+- Start your answer directly with the information requested
+- DO NOT include phrases like "Okay, I understand!", "Based on the textbook", or "Student's question:"
+- DO NOT mention any context references like "[Context 1 - Page 5]" in your answer
+- DO NOT cite sources or page numbers
+- Provide a clear, direct, and educational answer suitable for Class 8 students
+- Keep it simple and engaging
+- If the previous conversation is related, build upon it naturally but don't reference it explicitly"""
+
+SYSTEM_PREFIX_IMAGE = """You are HelpBuddy AI, a helpful assistant for NCERT Science Class 8 students.
+
+RESPONSE FORMAT REQUIREMENTS:
+- Start your answer directly with the information about the image
+- DO NOT include phrases like "Okay, I understand!", "Based on the textbook", or "Student's question:"
+- DO NOT mention any context references like "[Context 1 - Page 5]" in your answer
+- DO NOT cite sources or page numbers
+- Provide a clear, direct, and educational answer suitable for Class 8 students
+- Keep it simple and engaging
+- If the previous conversation is related, build upon it naturally but don't reference it explicitly"""
+
+SYSTEM_PREFIX_FOLLOW_UP = """You are HelpBuddy AI, a helpful assistant for NCERT Science Class 8 students.
+
+RESPONSE FORMAT REQUIREMENTS:
+- Start your answer directly with the information requested
+- DO NOT include phrases like "Okay, I understand!", "Based on the textbook", or "Student's question:"
+- DO NOT mention any context references like "[Context 1 - Page 5]" in your answer
+- DO NOT cite sources or page numbers
+- Provide a clear, direct, and educational answer suitable for Class 8 students
+- Keep it simple and engaging
+- This is a follow-up question, so build upon our previous conversation naturally"""
+
+ERROR_RESPONSE = "I apologize, but I encountered an error while processing your question. Please try again."
+FOLLOW_UP_ERROR_RESPONSE = "I'm having trouble understanding your follow-up question. Could you please rephrase it or provide more context?"
+
+# Most concurrent sessions whose conversation memory is kept in process
+MAX_MEMORY_SESSIONS = 256
+# Age after which interactions expire, and idle sessions are dropped
+MEMORY_HISTORY_MAX_AGE_HOURS = 24
+
+# Output token budget of one answer; a batched call gets one budget per answer
+ANSWER_MAX_OUTPUT_TOKENS = 2048
+# Token budget shared by the context, conversation and related sections of one prompt
+PROMPT_CONTEXT_TOKEN_BUDGET = 1500
+# Share of the budget reserved for the retrieved context, conversation and related sections
+ANSWER_PROMPT_SHARES = (0.6, 0.25, 0.15)
+# Tokens a "[Context n - Page p]" header and separator add to each retrieved chunk
+CONTEXT_CHUNK_OVERHEAD_TOKENS = 10
+# Chunks retrieved per query: as many as fit the answer prompt's context share
+RETRIEVAL_MAX_CHUNKS = max(
+    1, int(PROMPT_CONTEXT_TOKEN_BUDGET * ANSWER_PROMPT_SHARES[0]) // (settings.CHUNK_SIZE + CONTEXT_CHUNK_OVERHEAD_TOKENS)
+)
+# Sentences whose word 5-gram Jaccard similarity to an included one exceeds this are dropped
+DUPLICATE_SENTENCE_JACCARD = 0.6
+# Sentence ends, except after list numbering such as "1." or "12."
+_SENTENCE_SPLIT_RE = re.compile(r"(?<=[.!?])(?<!\b\d\.)(?<!\b\d\d\.)\s+")
+# Chunk headers written by the vector store; dropped with their chunk when none of it fits
+_CONTEXT_HEADER_RE = re.compile(r"^\[Context \d+[^\]]*\]$")
+_WORD_RE = re.compile(r"\w+")
+
+# Upper bound on prompts answered by one batched LLM call
+MAX_BATCH_SIZE = 3
+_ANSWER_MARKER = re.compile(r"^\s*=== ANSWER (\d+) ===\s*$", re.MULTILINE)
+
+
+def _keyword_regex(keywords: List[str]) -> re.Pattern:
+    """Compile keywords into one whole-word alternation"""
+    return re.compile(r"\b(?:" + "|".join(map(re.escape, keywords)) + r")\b")
+
+
+# Keyword detectors for the routing steps, matched against the lowercased query
+HISTORY_RE = _keyword_regex(["first", "last", "previous", "before", "how many", "what did", "what was", "all questions"])
+FOLLOWUP_RE = _keyword_regex(["it", "that", "this", "the", "those", "these", "above", "mentioned", "said", "explained", "discussed", "talked about", "also", "too", "as well", "in addition", "furthermore", "moreover"])
+
+@lru_cache(maxsize=1)
+def _token_encoding():
+    """tiktoken encoding used to approximate Gemini token counts, or None if unavailable"""
+    try:
+        import tiktoken
+        return tiktoken.get_encoding("cl100k_base")
+    except Exception as e:
+        logger.warning("tiktoken unavailable, estimating tokens from length: %s", e)
+        return None
+
+
+def _count_tokens(text: str) -> int:
+    """Approximate the number of tokens in a text"""
+    encoding = _token_encoding()
+    return len(encoding.encode(text)) if encoding is not None else len(text) // 4 + 1
+
+
+def _shingles(sentence: str) -> frozenset:
+    """Word 5-grams of a sentence (the whole sentence if shorter)"""
+    words = _WORD_RE.findall(sentence.lower())
+    return frozenset(tuple(words[i:i + 5]) for i in range(max(len(words) - 4, 1)))
+
+
+def _pack_prompt(
+        sections: List[str],
+        budget: int = PROMPT_CONTEXT_TOKEN_BUDGET,
+        shares: Optional[Sequence[float]] = None
+) -> List[str]:
+    """
+    Trim prompt sections to a shared token budget, dropping near-duplicate sentences
+    
+    Each section gets its share of the budget, plus whatever earlier sections
+    left unused. Sentences are added in order until one doesn't fit, which ends
+    the section. Line structure within a section is kept; a ``[Context n]``
+    chunk, or a section's leading label line, is dropped when none of the
+    sentences under it fit.
+    
+    Args:
+        sections: Prompt sections, most important first
+        budget: Maximum total tokens across all sections
+        shares: Fraction of the budget reserved for each section (defaults to equal shares)
+        
+    Returns:
+        The packed sections, in the same order
+    """
+    if shares is None:
+        shares = [1 / len(sections)] * len(sections) if sections else []
+    seen: List[frozenset] = []
+    carry = 0
+    packed_sections = []
+    for section, share in zip(sections, shares):
+        remaining = int(budget * share) + carry
+        packed, remaining = _pack_section(section, remaining, seen)
+        packed_sections.append(packed)
+        carry = remaining
+    return packed_sections
+
+
+def _pack_section(section: str, remaining: int, seen: List[frozenset]) -> Tuple[str, int]:
+    """Pack one section of ``_pack_prompt`` into ``remaining`` tokens; returns the text and the tokens left"""
+    lines = section.split("\n")
+    # A leading "Heading:" line only stays if something under it does
+    label = lines[0] if len(lines) > 1 and lines[0].rstrip().endswith(":") else None
+    if label is not None:
+        lines = lines[1:]
+        remaining -= _count_tokens(label)
+    
+    packed_lines: List[str] = []
+    # Index in packed_lines of the pending chunk header, and its token cost
+    header_at, header_tokens = None, 0
+    kept_any = False
+    full = remaining <= 0
+    for line in lines:
+        if full:
+            break
+        if _CONTEXT_HEADER_RE.match(line.strip()):
+            if header_at is not None:
+                # The previous chunk kept nothing: drop its header
+                del packed_lines[header_at:]
+                remaining += header_tokens
+            header_at, header_tokens = len(packed_lines), _count_tokens(line)
+            if header_tokens > remaining:
+                header_at = None
+                break
+            remaining -= header_tokens
+            packed_lines.append(line)
+            continue
+        
+        kept = []
+        for sentence in _SENTENCE_SPLIT_RE.split(line):
+            if not sentence.strip():
+                continue
+            shingles = _shingles(sentence)
+            if any(len(shingles & other) / len(shingles | other) > DUPLICATE_SENTENCE_JACCARD for other in seen):
+                continue
+            tokens = _count_tokens(sentence)
+            if tokens > remaining:
+                full = True
+                break
+            remaining -= tokens
+            seen.append(shingles)
+            kept.append(sentence)
+        if kept:
+            packed_lines.append(" ".join(kept))
+            header_at = None
+            kept_any = True
+        elif not line.strip():
+            packed_lines.append("")
+    
+    if header_at is not None:
+        del packed_lines[header_at:]
+        remaining += header_tokens
+    if not kept_any:
+        if label is not None:
+            remaining += _count_tokens(label)
+        return "", remaining
+    if label is not None:
+        packed_lines.insert(0, label)
+    return "\n".join(packed_lines).strip(), remaining
+
+
+# Follow-up signals in one tagged scan: the named group that matched tells the category
+_FOLLOW_UP_SIGNALS = {
+    "starts": ["what about", "how about", "and", "but", "so", "then"],
+    "pronoun": ["it", "that", "this", "the", "those", "these", "they", "them", "their"],
+    "context": ["above", "mentioned", "said", "explained", "discussed", "talked about", "earlier", "before"],
+}
+FOLLOW_UP_SIGNALS_RE = re.compile(
+    r"(?P<starts>^" + _keyword_regex(_FOLLOW_UP_SIGNALS["starts"]).pattern + ")"
+    + "".join(
+        f"|(?P<{category}>" + _keyword_regex(keywords).pattern + ")"
+        for category, keywords in _FOLLOW_UP_SIGNALS.items() if category != "starts"
+    )
+)
+
 class HelpBuddyAgent:
     """Simplified HelpBuddy AI agent for NCERT Science Class 8"""
     
-    def __init__(self):
-        """Initialize the agent"""
-        self.settings = Settings()
-        self.llm = ChatGoogleGenerativeAI(
-            model=self.settings.GEMINI_MODEL,
-            temperature=0.7,
-            max_output_tokens=2048
-        )
+    def __init__(self, embed_dim: Optional[int] = None):
+        """
+        Initialize the agent
+        
+        Args:
+            embed_dim: Embedding dimensionality for the knowledge base (defaults to EMBED_DIM setting)
+        """
+        self.settings = settings
+        self.llm = get_llm(temperature=0.7, max_output_tokens=ANSWER_MAX_OUTPUT_TOKENS)
         
-        self.content_filter = ContentFilter()
-        self.vector_store = ChromaStore()
+        self.vector_store = self._create_vector_store(embed_dim)
+        self.content_filter = ContentFilter(embeddings=self.vector_store.embeddings)
         self.image_processor = ImageProcessor()
-        self.memory_manager = MemoryManager(max_history=10, max_age_hours=24)
+        # Answers to standalone questions, shared by all sessions and matched by query embedding
+        self.semantic_cache = SemanticCache(threshold=self.settings.SEMANTIC_CACHE_THRESHOLD)
+        
+        # Conversation memory is kept per session so a shared agent never mixes histories
+        # Bounded so abandoned Streamlit sessions don't pile up; idle sessions expire with their history
+        self._memory_managers = TTLCache(
+            max_entries=MAX_MEMORY_SESSIONS,
+            ttl_seconds=MEMORY_HISTORY_MAX_AGE_HOURS * 3600
+        )
+        self._memory_lock = threading.Lock()
+        self.memory_store = self._open_memory_store()
+        
+        # Workers for the scope check and retrieval, which run side by side
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="helpbuddy")
         
         logger.info("HelpBuddy Agent initialized with memory management")
     
-    def initialize_knowledge_base(self) -> bool:
+    def use_session(self, session_id: str):
+        """Bind the calling thread to the conversation memory of a session"""
+        _current_session.set(session_id)
+    
+    @property
+    def memory_manager(self) -> MemoryManager:
+        """Conversation memory for the current session"""
+        session_id = _current_session.get()
+        with self._memory_lock:
+            memory_manager = self._memory_managers.get(session_id)
+            if memory_manager is None:
+                memory_manager = MemoryManager(
+                    max_history=10,
+                    max_age_hours=MEMORY_HISTORY_MAX_AGE_HOURS,
+                    store=self.memory_store,
+                    session_id=session_id
+                )
+            # Re-set on every access so the expiry counts from the session's last use
+            self._memory_managers.set(session_id, memory_manager)
+        return memory_manager
+    
+    def _open_memory_store(self) -> Optional[MemoryStore]:
+        """Open the SQLite memory store when MEMORY_DB_PATH is set"""
+        if not self.settings.MEMORY_DB_PATH:
+            return None
+        try:
+            store = MemoryStore(self.settings.MEMORY_DB_PATH)
+            logger.info("Persisting conversation memory to %s", self.settings.MEMORY_DB_PATH)
+            return store
+        except Exception as e:
+            logger.error("Error opening memory store, keeping memory in process only: %s", e)
+            return None
+    
+    def _create_vector_store(self, embed_dim: Optional[int]) -> ChromaStore:
+        """Create the vector store for the configured backend"""
+        if self.settings.VECTOR_BACKEND == "faiss":
+            # Optional dependency, only imported when selected
+            from src.vectorstore.faiss_store import FaissStore
+            return FaissStore(embed_dim=embed_dim)
+        return ChromaStore(embed_dim=embed_dim)
+
+    def initialize_knowledge_base(self, pdf_path: Optional[str] = None) -> bool:
         """Initialize the knowledge base from PDF"""
         try:
-            return self.vector_store.index_pdf()
+            return self.vector_store.index_pdf(pdf_path)
         except Exception as e:
-            logger.error(f"Error initializing knowledge base: {str(e)}")
+            logger.error("Error initializing knowledge base: %s", e)
             return False
+
+    def initialize_knowledge_base_async(self, pdf_path: Optional[str] = None) -> Future:
+        """Start initializing the knowledge base in the background; the future resolves to the success status"""
+        return self.vector_store.index_pdf_async(pdf_path)
     
-    def process_query(self, query: str, has_image: bool = False, image_data: Optional[str] = None) -> Dict[str, Any]:
-        """Process a user query through the agent workflow"""
+    def process_query(
+            self,
+            query: str,
+            has_image: bool = False,
+            image_data: Optional[str] = None,
+            image_stream: Optional[BinaryIO] = None,
+            query_embedding: Optional[List[float]] = None
+    ) -> Dict[str, Any]:
+        """Process a user query through the agent workflow
+        
+        The image can be given either as base64 ``image_data`` or as a binary
+        ``image_stream`` (e.g. an uploaded file), which is encoded here in chunks.
+        A precomputed ``query_embedding`` of a text-only query is reused for retrieval.
+        """
+        state: Dict[str, Any] = {}
+        for _ in self.process_query_stream(query, has_image, image_data, image_stream, query_embedding, state=state):
+            pass
+        return state
+    
+    def process_query_stream(
+            self,
+            query: str,
+            has_image: bool = False,
+            image_data: Optional[str] = None,
+            image_stream: Optional[BinaryIO] = None,
+            query_embedding: Optional[List[float]] = None,
+            state: Optional[Dict[str, Any]] = None
+    ) -> Iterator[str]:
+        """Process a user query, yielding the response text as it is generated
+        
+        Pass a dict as ``state`` to read the final response and metadata once
+        the generator is exhausted. ``metadata["route"]`` tells which branch
+        answered: "history", "follow_up", "cached", "out_of_scope" or "answer".
+        """
+        if state is None:
+            state = {}
+        state.update(self._new_state(query, has_image or image_stream is not None))
+        state["query_embedding"] = query_embedding
         try:
-            logger.info(f"Processing query: '{query}' (has_image: {has_image})")
+            if image_stream is not None and image_data is None:
+                image_data = encode_image_stream(image_stream)
+                has_image = True
             
-            # Initialize state
-            state = {
-                "query": query,
-                "processed_query": query,
-                "context": "",
-                "response": "",
-                "messages": [],
-                "metadata": {
-                    "has_image": has_image,
-                    "context_retrieved": False,
-                    "scope_checked": False
-                }
-            }
-            
-            # Step 1: Check if this is a conversation history question or follow-up question
-            query_lower = query.lower()
-            history_keywords = ["first", "last", "previous", "before", "how many", "what did", "what was", "all questions"]
-            follow_up_keywords = ["it", "that", "this", "the", "those", "these", "above", "mentioned", "said", "explained", "discussed", "talked about", "also", "too", "as well", "in addition", "furthermore", "moreover"]
+            prompt = self._prepare_query(state, query, has_image, image_data)
+            if prompt is None:
+                yield state["response"]
+                return
             
-            is_history_question = any(keyword in query_lower for keyword in history_keywords)
-            is_follow_up_question = any(keyword in query_lower for keyword in follow_up_keywords)
-            
-            # Priority 1: Handle history questions first
-            if is_history_question:
-                logger.info("Detected conversation history question")
-                history_info = self.memory_manager.get_conversation_history_info(query)
-                state["response"] = history_info
-                return state
-            
-            # Priority 2: If there's an image, process it first (don't treat as follow-up)
-            if has_image and image_data:
-                logger.info("Image detected - processing image first, not treating as follow-up")
-                # Skip follow-up detection for image queries
-                pass
+            # Step 5: Generate response with conversation context (Step 4: Add previous questions & context to generate answer)
+            logger.debug("Step 4: Generating answer with previous conversation context...")
+            if state["metadata"]["route"] == "follow_up":
+                yield from self._generate_response(state, prompt, error_response=FOLLOW_UP_ERROR_RESPONSE)
             else:
-                # Priority 3: Check if it's a follow-up question (only for text queries)
-                if is_follow_up_question or self._is_follow_up_question(query):
-                    logger.info("Detected follow-up question")
-                    # Get conversation context and generate contextual response
-                    conversation_context = self.memory_manager.get_conversation_context(last_n=5)
-                    related_context = self.memory_manager.get_related_context(query)
-                    
-                    if conversation_context and conversation_context != "No previous conversation histroy":
-                        # Generate response using conversation context
-                        state["response"] = self._generate_follow_up_response(query, conversation_context, related_context)
-                        return state
+                yield from self._generate_response(state, prompt)
+                self._complete_query(state, query)
+            
+        except Exception as e:
+            logger.error("Error processing query: %s", e)
+            state["context"] = ""
+            state["response"] = ERROR_RESPONSE
+            state["metadata"]["error"] = str(e)
+            yield state["response"]
+    
+    def process_queries(
+            self,
+            queries: List[str],
+            query_embeddings: Optional[List[List[float]]] = None
+    ) -> List[Dict[str, Any]]:
+        """Process several text queries, generating their answers with one LLM call
+        
+        Each query runs its own history, follow-up and scope checks; the ones that
+        need an answer are combined into a single prompt. Returns one state per
+        query, in the same order as ``queries``.
+        """
+        states = [self._new_state(query, False) for query in queries]
+        if query_embeddings is None and queries:
+            # One embedding request for the whole batch instead of one per query
+            try:
+                query_embeddings = self.vector_store.embed_queries(queries)
+            except Exception as e:
+                logger.error("Error embedding queries in one batch, each query will be embedded while it is prepared: %s", e)
+        pending = []
+        for i, state in enumerate(states):
+            state["query_embedding"] = query_embeddings[i] if query_embeddings else None
+            try:
+                prompt = self._prepare_query(state, state["query"], False, None)
+                if prompt is not None:
+                    pending.append((state, prompt))
+            except Exception as e:
+                logger.error("Error processing query: %s", e)
+                state["response"] = ERROR_RESPONSE
+                state["metadata"]["error"] = str(e)
+        
+        # Follow-ups have their own instructions, so only plain answers share a batch
+        answers = [(state, prompt) for state, prompt in pending if state["metadata"]["route"] == "answer"]
+        for state, prompt in pending:
+            if state["metadata"]["route"] == "follow_up":
+                for _ in self._generate_response(state, prompt, error_response=FOLLOW_UP_ERROR_RESPONSE):
+                    pass
+        
+        # Answers share max_output_tokens, so keep each combined call small
+        for start in range(0, len(answers), MAX_BATCH_SIZE):
+            self._generate_batch_responses(answers[start:start + MAX_BATCH_SIZE])
+        
+        for state, _ in answers:
+            if "error" not in state["metadata"]:
+                self._complete_query(state, state["query"])
+        
+        return states
+    
+    def _prepare_query(
+            self,
+            state: Dict[str, Any],
+            query: str,
+            has_image: bool,
+            image_data: Optional[str]
+    ) -> Optional[List[BaseMessage]]:
+        """Run the workflow up to answer generation
+        
+        Returns the LLM prompt messages for the answer, or None when ``state["response"]``
+        is already final (history, cached or out-of-scope replies).
+        """
+        # Image handling needs both the flag and the data; decided once for every branch below
+        has_img = bool(has_image and image_data)
+        logger.info("Processing query: '%s' (has_image: %s)", query, has_img)
+        
+        # Step 1: Check if this is a conversation history question or follow-up question
+        query_lower = query.lower()
+        is_history_question = bool(HISTORY_RE.search(query_lower))
+        is_follow_up_question = bool(FOLLOWUP_RE.search(query_lower))
+        
+        # Priority 1: Handle history questions first
+        if is_history_question:
+            logger.info("Detected conversation history question")
+            history_info = self.memory_manager.get_conversation_history_info(query)
+            state["metadata"]["route"] = "history"
+            state["response"] = history_info
+            return None
+        
+        # A first text question has no memory to fetch or follow up on, and gets the lean answer prompt
+        has_history = self.has_session_history()
+        cold_start = not has_img and not has_history
+        state["metadata"]["has_history"] = has_history
+        state["metadata"]["cold_start"] = cold_start
+        if not cold_start:
+            # Recent and related conversation context, fetched once for the follow-up and answer prompts
+            state["memory_context"] = self.memory_manager.fetch_bundle(query, last_n=5)
+        
+        # Priority 2: If there's an image, process it first (don't treat as follow-up)
+        if has_img:
+            logger.debug("Image detected - processing image first, not treating as follow-up")
             
             # Step 2: Process image if present (Step 1: Image to description generation)
-            if has_image and image_data:
-                logger.info("Step 1: Processing image to generate description...")
-                logger.info(f"Original query: '{query}'")
-                logger.info(f"Image data length: {len(image_data)} characters")
-                
-                image_description = self.image_processor.describe_image(image_data, query)
-                if image_description:
-                    # Combine original query with image description for better context
-                    combined_query = f"{query} - Image shows: {image_description}"
-                    state["processed_query"] = combined_query
-                    logger.info(f"Image processed successfully. Combined query: '{combined_query[:100]}...'")
-                    logger.info(f"Full image description: '{image_description}'")
-                else:
-                    # If image processing fails, use original query
-                    state["processed_query"] = query
-                    logger.warning("Image processing failed, using original query")
+            logger.debug("Step 1: Processing image to generate description...")
+            logger.debug("Original query: '%s'", query)
+            
+            image_description = self.image_processor.describe_image(image_data, query)
+            if image_description:
+                # Combine original query with image description for better context
+                combined_query = f"{query} - Image shows: {image_description}"
+                state["processed_query"] = combined_query
+                logger.debug("Image processed successfully. Combined query: '%.100s...'", combined_query)
+                logger.debug("Full image description: '%s'", image_description)
             else:
-                # For text-only queries, use the original query
+                # If image processing fails, use original query
                 state["processed_query"] = query
-                logger.info(f"Text-only query: '{query}'")
-            
-            # Step 3: Check scope relevance using LLM (Step 2: Check scope through LLM)
-            logger.info("Step 2: Checking scope relevance through LLM...")
-            scope_check = self.content_filter.check_scope_relevance(state["processed_query"])
+                logger.warning("Image processing failed, using original query")
+        else:
+            # Priority 3: Check if it's a follow-up question (only for text queries)
+            if not cold_start and (is_follow_up_question or self._is_follow_up_question(query)):
+                logger.debug("Detected follow-up question")
+                # Get conversation context and generate contextual response
+                conversation_context, related_context = state["memory_context"]
+                
+                if conversation_context and conversation_context != "No previous conversation histroy":
+                    # Generate response using conversation context
+                    state["metadata"]["route"] = "follow_up"
+                    return self._build_follow_up_prompt(query, conversation_context, related_context)
+            
+            # Priority 4: Reuse the answer to a near-identical earlier text question
+            if state.get("query_embedding") is None:
+                state["query_embedding"] = self.vector_store.embed_query(query)
+            match = self.semantic_cache.search(state["query_embedding"])
+            if match is not None:
+                similarity, cached_response = match
+                state["metadata"]["cache_similarity"] = similarity
+                if similarity >= self.semantic_cache.threshold:
+                    logger.info("Semantic cache hit (similarity %.3f)", similarity)
+                    state["metadata"]["route"] = "cached"
+                    state["response"] = cached_response
+                    self._complete_query(state, query)
+                    return None
+                if similarity >= self.settings.SEMANTIC_NEAR_HIT_THRESHOLD:
+                    state["prior_response"] = cached_response
+            
+            # For text-only queries, use the original query
+            state["processed_query"] = query
+            logger.debug("Text-only query: '%s'", query)
+        
+        # An embedding of the raw query also describes the processed query unless an image description was added
+        if state["processed_query"] == query:
+            state["processed_query_embedding"] = state.get("query_embedding")
+        if state.get("processed_query_embedding") is None:
+            # Embed once up front so the scope check and retrieval below share the vector
+            try:
+                state["processed_query_embedding"] = self.vector_store.embed_query(state["processed_query"])
+            except Exception as e:
+                logger.error("Error embedding query: %s", e)
+        
+        # A keyword-scoped near-duplicate of an earlier question is answered from that answer, skipping retrieval
+        keyword = self.content_filter.match_scope_keyword(state["processed_query"]) if state.get("prior_response") else None
+        if keyword is not None:
+            logger.info("Near-duplicate of a cached question with NCERT keyword '%s', skipping retrieval", keyword)
             state["metadata"]["scope_checked"] = True
-            
-            if not scope_check["is_relevant"]:
-                logger.info(f"Query marked as out of scope: {scope_check.get('reason', 'Unknown')}")
-                state["response"] = self.content_filter.generate_scope_response(query)
-                return state
-            
-            logger.info("Query passed scope check, proceeding to context retrieval")
-            
-            # Step 4: Retrieve context from vector store (Step 3: Retrieve details from vector DB)
-            logger.info("Step 3: Retrieving details from vector database...")
-            state = self._retrieve_context(state)
-            
-            # Step 5: Generate response with conversation context (Step 4: Add previous questions & context to generate answer)
-            logger.info("Step 4: Generating answer with previous conversation context...")
-            state = self._generate_response(state, query, image_data)
-            
-            # Step 6: Add interaction to memory
-            self.memory_manager.add_interaction(
-                user_query=query,
-                bot_response=state["response"],
-                metadata=state["metadata"]
-            )
-            
-            logger.info("Query processed successfully and added to memory")
-            return state
-            
-        except Exception as e:
-            logger.error(f"Error processing query: {str(e)}")
-            return {
-                "query": query,
-                "processed_query": query,
-                "context": "",
-                "response": "I apologize, but I encountered an error while processing your question. Please try again.",
-                "messages": [],
-                "metadata": {
-                    "has_image": has_image,
-                    "error": str(e)
-                }
+            state = self._retrieve_context(state, prior_response=state["prior_response"])
+            state["metadata"]["route"] = "answer"
+            return self._build_response_prompt(state, query, image_data)
+        
+        # Steps 2 and 3 are independent given the processed query, so they run concurrently
+        logger.debug("Step 2: Checking scope relevance through LLM...")
+        logger.debug("Step 3: Retrieving details from vector database...")
+        scope_future = self._executor.submit(
+            self.content_filter.check_scope_relevance,
+            state["processed_query"],
+            query_embedding=state.get("processed_query_embedding")
+        )
+        retrieval_future = self._executor.submit(self._retrieve_context, state)
+        
+        # Step 3: Check scope relevance using LLM (Step 2: Check scope through LLM)
+        scope_check = scope_future.result()
+        state["metadata"]["scope_checked"] = True
+        
+        # Step 4: Retrieve context from vector store (Step 3: Retrieve details from vector DB)
+        # Always joined, even when out of scope, so the worker never writes to a state that was handed back
+        state = retrieval_future.result()
+        
+        if not scope_check["is_relevant"]:
+            logger.info("Query marked as out of scope: %s", scope_check.get('reason', 'Unknown'))
+            state["metadata"]["route"] = "out_of_scope"
+            state["response"] = self.content_filter.generate_scope_response(query)
+            return None
+        
+        logger.info("Query passed scope check, using retrieved context")
+        
+        state["metadata"]["route"] = "answer"
+        return self._build_response_prompt(state, query, image_data if has_img else None)
+    
+    def _complete_query(self, state: Dict[str, Any], query: str):
+        """Record an answer in conversation memory and, if standalone, in the semantic cache"""
+        metadata = state["metadata"]
+        # Only cold-start answers are free of this session's history, so only they may be shared
+        if (metadata.get("route") == "answer" and "error" not in metadata
+                and metadata.get("cold_start") and state.get("query_embedding") is not None):
+            self.semantic_cache.add(state["query_embedding"], query, state["response"])
+        
+        # Step 6: Add interaction to memory
+        self.memory_manager.add_interaction(
+            user_query=query,
+            bot_response=state["response"],
+            metadata=state["metadata"]
+        )
+        
+        logger.info("Query processed successfully and added to memory")
+    
+    def _new_state(self, query: str, has_image: bool) -> Dict[str, Any]:
+        """Create the initial workflow state for a query"""
+        return {
+            "query": query,
+            "processed_query": query,
+            "context": "",
+            "response": "",
+            "messages": [],
+            "metadata": {
+                "has_image": has_image,
+                "context_retrieved": False,
+                "scope_checked": False
             }
+        }
     
-    def _retrieve_context(self, state: Dict[str, Any]) -> Dict[str, Any]:
-        """Retrieve relevant context from vector store"""
+    def _retrieve_context(self, state: Dict[str, Any], prior_response: Optional[str] = None) -> Dict[str, Any]:
+        """Retrieve relevant context from vector store, or use ``prior_response`` as the context instead"""
+        if prior_response is not None:
+            state["context"] = prior_response
+            state["metadata"]["context_retrieved"] = False
+            state["metadata"]["context_source"] = "semantic_cache"
+            return state
+        
         try:
             query = state["processed_query"]
-            logger.info(f"Retrieving context for query: '{query}'")
+            logger.debug("Retrieving context for query: '%s'", query)
+            
+            # Reuse the embedding computed for the cache or scope check, if any
+            query_embedding = state.get("processed_query_embedding")
             
             # Get context from vector store - no relevance filtering
-            context = self.vector_store.get_relevant_context(query, max_chunks=5)
+            context = self.vector_store.get_relevant_context(query, max_chunks=RETRIEVAL_MAX_CHUNKS, query_embedding=query_embedding)
             
             state["context"] = context
             state["metadata"]["context_retrieved"] = True
+            state["metadata"]["retrieval_mode"] = "hybrid" if self.settings.HYBRID_SEARCH else "dense"
             
             # Count the number of context chunks retrieved
             context_chunks = context.count("[Context")
-            logger.info(f"Retrieved {context_chunks} document chunks from vector store")
+            logger.info("Retrieved %d document chunks from vector store", context_chunks)
             
             return state
             
         except Exception as e:
-            logger.error(f"Error retrieving context: {str(e)}")
+            logger.error("Error retrieving context: %s", e)
             state["context"] = "No information found in NCERT Science Class 8."
             state["metadata"]["context_retrieved"] = False
             return state
     
-    def _generate_response(self, state: Dict[str, Any], query: str, image_data: Optional[str] = None) -> Dict[str, Any]:
-        """Generate response using LLM with conversation context"""
-        try:
-            processed_query = state["processed_query"]
-            context = state["context"]
-            
-            # Get conversation context from memory (previous questions & context)
-            conversation_context = self.memory_manager.get_conversation_context(last_n=5)
-            related_context = self.memory_manager.get_related_context(query)
-            
-            # Create prompt with context and conversation history
-            if image_data:
-                # For image queries, use original query and image description
-                prompt = f"""You are HelpBuddy AI, a helpful assistant for NCERT Science Class 8 students.
-
-Context from NCERT Science Class 8 textbook:
+    def _build_response_prompt(self, state: Dict[str, Any], query: str, image_data: Optional[str] = None) -> List[BaseMessage]:
+        """Build the answer prompt from retrieved context and conversation memory"""
+        if state["metadata"].get("cold_start"):
+            return self._build_fast_response_prompt(state, query)
+        
+        processed_query = state["processed_query"]
+        context = state["context"]
+        
+        # Get conversation context from memory (previous questions & context)
+        conversation_context, related_context = state.get("memory_context") or self.memory_manager.fetch_bundle(query, last_n=5)
+        context, conversation_context, related_context = _pack_prompt(
+            [context, conversation_context, related_context], shares=ANSWER_PROMPT_SHARES
+        )
+        
+        # Static instructions go first as the system message so the provider can reuse the cached prefix
+        if image_data:
+            # For image queries, use original query and image description
+            prompt = [
+                SystemMessage(content=SYSTEM_PREFIX_IMAGE),
+                HumanMessage(content=f"""Context from NCERT Science Class 8 textbook:
 {context}
 
 Previous conversation context (this will help provide better answers):
@@ -210,21 +666,13 @@ Related previous discussions:
 Student's question about the image: {query}
 Image description and analysis: {processed_query}
 
-RESPONSE FORMAT REQUIREMENTS:
-- Start your answer directly with the information about the image
-- DO NOT include phrases like "Okay, I understand!", "Based on the textbook", or "Student's question:"
-- DO NOT mention any context references like "[Context 1 - Page 5]" in your answer
-- DO NOT cite sources or page numbers
-- Provide a clear, direct, and educational answer suitable for Class 8 students
-- Keep it simple and engaging
-- If the previous conversation is related, build upon it naturally but don't reference it explicitly
-
-Answer the question about the image directly:"""
-            else:
-                # For text queries
-                prompt = f"""You are HelpBuddy AI, a helpful assistant for NCERT Science Class 8 students.
-
-Context from NCERT Science Class 8 textbook:
+Answer the question about the image directly:""")
+            ]
+        else:
+            # For text queries
+            prompt = [
+                SystemMessage(content=SYSTEM_PREFIX_TEXT),
+                HumanMessage(content=f"""Context from NCERT Science Class 8 textbook:
 {context}
 
 Previous conversation context (this will help provide better answers):
@@ -235,30 +683,113 @@ Related previous discussions:
 
 Student's question: {query}
 
-RESPONSE FORMAT REQUIREMENTS:
-- Start your answer directly with the information requested
-- DO NOT include phrases like "Okay, I understand!", "Based on the textbook", or "Student's question:"
-- DO NOT mention any context references like "[Context 1 - Page 5]" in your answer
-- DO NOT cite sources or page numbers
-- Provide a clear, direct, and educational answer suitable for Class 8 students
-- Keep it simple and engaging
-- If the previous conversation is related, build upon it naturally but don't reference it explicitly
+Answer the question directly:""")
+            ]
+        
+        return prompt
+    
+    def _build_fast_response_prompt(self, state: Dict[str, Any], query: str) -> List[BaseMessage]:
+        """Build the answer prompt for a text query with no conversation memory"""
+        context, = _pack_prompt([state["context"]])
+        
+        return [
+            SystemMessage(content=SYSTEM_PREFIX_TEXT),
+            HumanMessage(content=f"""Context from NCERT Science Class 8 textbook:
+{context}
 
-Answer the question directly:"""
+Student's question: {query}
 
-            # Generate response
-            response = self.llm.invoke(prompt)
-            state["response"] = response.content
+Answer the question directly:""")
+        ]
+    
+    def has_session_history(self) -> bool:
+        """Check if the current session has any conversation memory yet"""
+        memory = self.memory_manager
+        return bool(memory.conversations or memory.summary_queries)
+    
+    def _generate_response(
+            self,
+            state: Dict[str, Any],
+            prompt: List[BaseMessage],
+            error_response: str = ERROR_RESPONSE
+    ) -> Iterator[str]:
+        """Generate response using LLM, yielding text as it streams in
+        
+        Closing the generator early (e.g. the client went away) closes the LLM
+        stream too, so the rest of the answer is not generated.
+        """
+        stream = self.llm.stream(prompt)
+        try:
+            # Stream the response, keeping the full text on the state
+            response_parts = []
+            for chunk in stream:
+                if chunk.content:
+                    response_parts.append(chunk.content)
+                    yield chunk.content
+            state["response"] = "".join(response_parts)
             
             # Add to conversation history
             state["messages"].append(AIMessage(content=state["response"]))
             
-            return state
-            
+        except GeneratorExit:
+            logger.info("Response generation cancelled by the caller")
+            raise
         except Exception as e:
-            state["response"] = "I apologize, but I encountered an error while processing your question. Please try again."
+            logger.error("Error generating response: %s", e)
+            state["metadata"]["error"] = str(e)
+            state["response"] = error_response
             state["messages"].append(AIMessage(content=state["response"]))
-            return state
+            yield state["response"]
+        finally:
+            stream.close()
+    
+    def _generate_batch_responses(self, batch: List[Tuple[Dict[str, Any], List[BaseMessage]]]):
+        """Answer several prepared prompts with a single LLM call"""
+        if len(batch) == 1:
+            state, prompt = batch[0]
+            for _ in self._generate_response(state, prompt):
+                pass
+            return
+        
+        # Batched queries are text-only, so they share one system prefix
+        system_message = batch[0][1][0]
+        requests = "\n\n".join(
+            f"=== REQUEST {i} ===\n{prompt[-1].content}" for i, (_, prompt) in enumerate(batch, start=1)
+        )
+        combined_prompt = [
+            system_message,
+            HumanMessage(content=f"""The following {len(batch)} requests come from different students and are independent of each other.
+
+{requests}
+
+Answer every request in order. Begin each answer with a line containing only "=== ANSWER <number> ===" using the request's number, and do not write anything else outside the answers.""")
+        ]
+        
+        try:
+            response = get_llm(
+                temperature=0.7, max_output_tokens=ANSWER_MAX_OUTPUT_TOKENS * len(batch)
+            ).invoke(combined_prompt)
+            # A cut-off reply still has every marker, but its last answer is incomplete
+            finish_reason = str(getattr(response, "response_metadata", {}).get("finish_reason", ""))
+            if "MAX_TOKENS" in finish_reason:
+                raise ValueError("batched reply hit the output token limit")
+            parts = _ANSWER_MARKER.split(response.content)
+            answers = {int(number): text.strip() for number, text in zip(parts[1::2], parts[2::2])}
+            if sorted(answers) != list(range(1, len(batch) + 1)) or not all(answers.values()):
+                raise ValueError(f"expected {len(batch)} answers, got {sorted(answers)}")
+        except Exception as e:
+            # Fall back to one call per prompt rather than failing the whole batch
+            logger.warning("Batched generation failed, answering individually: %s", e)
+            for state, prompt in batch:
+                for _ in self._generate_response(state, prompt):
+                    pass
+            return
+        
+        for i, (state, _) in enumerate(batch, start=1):
+            state["response"] = answers[i]
+            state["messages"].append(AIMessage(content=state["response"]))
+        
+        logger.info("Generated %d answers with one batched call", len(batch))
     
     def clear_conversation_memory(self):
         """Clear the conversation memory"""
@@ -266,14 +797,14 @@ Answer the question directly:"""
             self.memory_manager.clear_memory()
             logger.info("Conversation memory cleared")
         except Exception as e:
-            logger.error(f"Error clearing conversation memory: {str(e)}")
+            logger.error("Error clearing conversation memory: %s", e)
     
     def get_conversation_summary(self) -> Dict[str, Any]:
         """Get summary of the conversation"""
         try:
             return self.memory_manager.get_conversation_summary()
         except Exception as e:
-            logger.error(f"Error getting conversation summary: {str(e)}")
+            logger.error("Error getting conversation summary: %s", e)
             return {"error": str(e)}
     
     def get_conversation_history_info(self, query: str) -> str:
@@ -281,37 +812,37 @@ Answer the question directly:"""
         try:
             return self.memory_manager.get_conversation_history_info(query)
         except Exception as e:
-            logger.error(f"Error getting conversation history info: {str(e)}")
+            logger.error("Error getting conversation history info: %s", e)
             return "Error retrieving conversation history information."
     
-    def sync_conversation_history(self, conversation_history: list) -> bool:
-        """Sync conversation history from external source to memory manager"""
+    def sync_conversation_history(self, conversation_pairs: list, older_queries: Optional[List[str]] = None) -> bool:
+        """Sync (user, assistant) message pairs from external source to memory manager
+        
+        ``older_queries`` are the questions of turns before those pairs; only they reach the summary.
+        """
         try:
-            if not conversation_history:
+            if not conversation_pairs:
                 return True
             
             # Clear existing conversations if any
             if self.memory_manager.conversations:
                 self.memory_manager.clear_memory()
             
-            # Convert conversation history to memory manager format
-            for i in range(0, len(conversation_history), 2):
-                if i + 1 < len(conversation_history):
-                    user_msg = conversation_history[i]
-                    assistant_msg = conversation_history[i + 1]
-                    
-                    if user_msg.get("role") == "user" and assistant_msg.get("role") == "assistant":
-                        self.memory_manager.add_interaction(
-                            user_query=user_msg.get("content", ""),
-                            bot_response=assistant_msg.get("content", ""),
-                            metadata={"timestamp": user_msg.get("timestamp", "")}
-                        )
+            if older_queries:
+                self.memory_manager.add_summary_queries(older_queries)
             
-            logger.info(f"Synced {len(conversation_history) // 2} conversation pairs to memory manager")
+            # Convert conversation pairs to memory manager format and add them in one go
+            self.memory_manager.add_interactions_bulk([
+                (user_msg.get("content", ""), assistant_msg.get("content", ""), {"timestamp": user_msg.get("timestamp", "")})
+                for user_msg, assistant_msg in conversation_pairs
+                if assistant_msg is not None
+            ])
+            
+            logger.info("Synced %d conversation pairs to memory manager", len(conversation_pairs))
             return True
             
         except Exception as e:
-            logger.error(f"Error syncing conversation history: {str(e)}")
+            logger.error("Error syncing conversation history: %s", e)
             return False
     
     def _is_follow_up_question(self, query: str) -> bool:
@@ -319,62 +850,42 @@ Answer the question directly:"""
         try:
             query_lower = query.lower()
             
-            # Check for pronouns that indicate reference to previous context
-            pronouns = ["it", "that", "this", "the", "those", "these", "they", "them", "their"]
-            has_pronouns = any(pronoun in query_lower for pronoun in pronouns)
-            
-            # Check for context words
-            context_words = ["above", "mentioned", "said", "explained", "discussed", "talked about", "earlier", "before"]
-            has_context_words = any(word in query_lower for word in context_words)
+            # One pass reports pronouns referring to previous context, context words and context-indicating starts
+            signals = {match.lastgroup for match in FOLLOW_UP_SIGNALS_RE.finditer(query_lower)}
+            has_pronouns = "pronoun" in signals
+            has_context_words = "context" in signals
+            starts_with_context = "starts" in signals
             
             # Check for short questions that likely refer to previous context
             is_short_question = len(query.split()) <= 5
             
-            # Check for questions that start with context indicators
-            starts_with_context = any(query_lower.startswith(word) for word in ["what about", "how about", "and", "but", "so", "then"])
-            
             # Check if there's conversation history to refer to
             has_history = len(self.memory_manager.conversations) > 0
             
             # Determine if it's a follow-up question
             is_follow_up = (has_pronouns or has_context_words or is_short_question or starts_with_context) and has_history
             
-            logger.info(f"Follow-up detection: pronouns={has_pronouns}, context={has_context_words}, short={is_short_question}, starts_with_context={starts_with_context}, has_history={has_history}, is_follow_up={is_follow_up}")
+            logger.debug("Follow-up detection: pronouns=%s, context=%s, short=%s, starts_with_context=%s, has_history=%s, is_follow_up=%s", has_pronouns, has_context_words, is_short_question, starts_with_context, has_history, is_follow_up)
             
             return is_follow_up
             
         except Exception as e:
-            logger.error(f"Error detecting follow-up question: {str(e)}")
+            logger.error("Error detecting follow-up question: %s", e)
             return False
     
-    def _generate_follow_up_response(self, query: str, conversation_context: str, related_context: str) -> str:
-        """Generate a response for follow-up questions using conversation context"""
-        try:
-            # Create a prompt for follow-up questions
-            prompt = f"""You are HelpBuddy AI, a helpful assistant for NCERT Science Class 8 students.
-
-Previous conversation context:
+    def _build_follow_up_prompt(self, query: str, conversation_context: str, related_context: str) -> List[BaseMessage]:
+        """Build the prompt for follow-up questions from conversation context"""
+        conversation_context, related_context = _pack_prompt([conversation_context, related_context])
+        
+        # Create a prompt for follow-up questions
+        return [
+            SystemMessage(content=SYSTEM_PREFIX_FOLLOW_UP),
+            HumanMessage(content=f"""Previous conversation context:
 {conversation_context}
 
 {related_context}
 
 Student's follow-up question: {query}
 
-RESPONSE FORMAT REQUIREMENTS:
-- Start your answer directly with the information requested
-- DO NOT include phrases like "Okay, I understand!", "Based on the textbook", or "Student's question:"
-- DO NOT mention any context references like "[Context 1 - Page 5]" in your answer
-- DO NOT cite sources or page numbers
-- Provide a clear, direct, and educational answer suitable for Class 8 students
-- Keep it simple and engaging
-- This is a follow-up question, so build upon our previous conversation naturally
-
-Answer the follow-up question directly:"""
-
-            # Generate response
-            response = self.llm.invoke(prompt)
-            return response.content
-            
-        except Exception as e:
-            logger.error(f"Error generating follow-up response: {str(e)}")
-            return "I'm having trouble understanding your follow-up question. Could you please rephrase it or provide more context?"
+Answer the follow-up question directly:""")
+        ]
@@ -1,7 +1,9 @@
 import os
 import ssl
+from functools import lru_cache
 import certifi
 from dotenv import load_dotenv
+from langchain_google_genai import ChatGoogleGenerativeAI
 
 # Load Environment variables
 load_dotenv()
@@ -17,9 +19,14 @@ except Exception:
 class Settings:
     """Application settings and configuration"""
 
+    # Values are read from the environment once, at import; instances carry no state of their own
+    __slots__ = ()
+
     # API Keys
     GOOGLE_API_KEY = os.getenv("GOOGLE_API_KEY")
     LANGCHAIN_API_KEY = os.getenv("LANGCHAIN_API_KEY")
+    # Google Web Speech API key; unset falls back to the speech_recognition library's default key
+    WEB_SPEECH_API_KEY = os.getenv("WEB_SPEECH_API_KEY")
 
     # LangSmith Configuration
     LANGCHAIN_TRACING_V2 = os.getenv("LANGCHAIN_TRACING_V2", "true")
@@ -31,21 +38,45 @@ class Settings:
     
     # ChromaDB Configuration
     CHROMA_PERSIST_DIR = os.getenv("CHROMA_PERSIST_DIR", "./chroma_db")
+    # Vector index backend: "chroma", or "faiss" (IVF-PQ, needs faiss-cpu) for large corpora
+    VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma").lower()
+    FAISS_INDEX_DIR = os.getenv("FAISS_INDEX_DIR", "./faiss_index")
+    # Stored vector encoding for the FAISS backend: "pq" (smallest) or "sq8" (int8, near-exact)
+    FAISS_QUANTIZER = os.getenv("FAISS_QUANTIZER", "pq").lower()
+    # Fuse BM25 keyword results with dense results when retrieving context
+    HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "true").lower() == "true"
+
+    # SQLite file conversation memory is written through to; empty keeps memory in process only
+    MEMORY_DB_PATH = os.getenv("MEMORY_DB_PATH", "")
 
     # Application Settings
     MAX_AUDIO_DURATION = int(os.getenv("MAX_AUDIO_DURATION", "60"))
     MAX_IMAGE_SIZE_MB = int(os.getenv("MAX_IMAGE_SIZE_MB", "10"))
-    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
-    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+    # Indexed chunk length and overlap, in tokens; changing them requires re-indexing.
+    # Sized so the retrieved chunks fit the answer prompt's share of the context budget
+    CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "160"))
+    CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "20"))
 
     # Model Configuration
     GEMINI_MODEL ="gemini-2.0-flash-exp"
     EMBEDDING_MODEL = "models/text-embedding-004"
+    # Matryoshka truncation of stored embeddings; changing it requires re-indexing
+    EMBED_DIM = int(os.getenv("EMBED_DIM", "768"))
+    # Chunks sent per embedding request while indexing
+    EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "100"))
+    # Cosine similarity above which an earlier answer is reused for a new question
+    SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+    # Below the cache threshold but above this, an earlier answer stands in for retrieved context
+    SEMANTIC_NEAR_HIT_THRESHOLD = float(os.getenv("SEMANTIC_NEAR_HIT_THRESHOLD", "0.85"))
     TEMPERATURE = 0.1
     MAX_TOKENS = 1000
 
     # Guardrail Settings
     TOXIC_THRESHOLD = 0.9  # Much higher threshold - only block very toxic content
+    # Minimum cosine similarity to the scope references for a query to count as in scope
+    SCOPE_SIMILARITY_THRESHOLD = float(os.getenv("SCOPE_SIMILARITY_THRESHOLD", "0.35"))
+    # Ask the LLM before rejecting a query that the similarity check marks out of scope
+    SCOPE_LLM_FALLBACK = os.getenv("SCOPE_LLM_FALLBACK", "false").lower() == "true"
     SCOPE_KEYWORDS = [
         "science", "physics", "chemistry", "biology", "ncert", "class 8",
         "experiment", "theory", "concept", "lesson", "chapter", "textbook",
@@ -57,6 +88,7 @@ class Settings:
         "fertilizer", "pesticide", "irrigation", "harvest", "grain", "wheat",
         "rice", "maize", "pulse", "vegetable", "fruit", "flower"
     ]
+    SCOPE_KEYWORDS_LOWER = tuple(keyword.lower() for keyword in SCOPE_KEYWORDS)
 
     # Data Directory
     DATA_DIR = "./data"
@@ -70,3 +102,30 @@ class Settings:
             raise ValueError("Missing required environment variable: GOOGLE_API_KEY")
         # LANGCHAIN_API_KEY (LangSmith) is optional; monitoring is enabled only if present
         return True
+
+
+
+# Shared settings instance; import this rather than constructing Settings()
+settings = Settings()
+
+
+@lru_cache(maxsize=None)
+def get_llm(temperature: float = 0.7, max_output_tokens: int = 2048) -> ChatGoogleGenerativeAI:
+    """
+    Get the shared Gemini chat client for a generation preset
+
+    Clients are created once per (temperature, max_output_tokens) pair, so all
+    components using the same preset share one connection pool.
+
+    Args:
+        temperature: Sampling temperature
+        max_output_tokens: Maximum number of tokens to generate
+
+    Returns:
+        Chat model client
+    """
+    return ChatGoogleGenerativeAI(
+        model=settings.GEMINI_MODEL,
+        temperature=temperature,
+        max_output_tokens=max_output_tokens
+    )
@@ -1,32 +1,54 @@
+import atexit
 import logging
-import os
+import queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from pathlib import Path
 
+LOG_FORMAT = '%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+
+# Background thread writing queued records to the log file
+_listener = None
+
 
 def setup_logging():
     """Setup logging configuration for HelpBuddy AI"""
 
+    global _listener
+    if _listener is not None:
+        return
+
     # Create logs directory using absolute path
-    from datetime import datetime
-    
     base_dir = Path(__file__).parent.parent.parent
     log_dir = base_dir / "logs"
     log_dir.mkdir(exist_ok=True)
 
-    # Generate timestamp for the log file
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_filename = f"helpbuddy_{timestamp}.log"
+    # Rotate a single log file instead of creating a new one per run
+    file_handler = RotatingFileHandler(
+        log_dir / "helpbuddy.log",
+        maxBytes=10_000_000,
+        backupCount=10,
+        encoding='utf-8'
+    )
+    file_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    # Request threads only enqueue records; the listener thread does the disk I/O
+    log_queue = queue.Queue(-1)
+    queue_handler = QueueHandler(log_queue)
+    queue_handler.setFormatter(logging.Formatter('%(message)s'))
 
-    # Configure logging with absolute path and timestamp
     logging.basicConfig(
         level=logging.INFO,
-        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
+        format=LOG_FORMAT,
         handlers=[
-            logging.FileHandler(log_dir / log_filename, encoding='utf-8'),
+            queue_handler,
             logging.StreamHandler()
         ]
     )
 
+    _listener = QueueListener(log_queue, file_handler)
+    _listener.start()
+    atexit.register(_listener.stop)
+
     # Set specific logger levels
     logging.getLogger("chromadb").setLevel(logging.WARNING)
     logging.getLogger("httpx").setLevel(logging.WARNING)
@@ -1,32 +1,80 @@
 import re
 import logging
-from typing import Dict, Any, List
-from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from src.config import Settings
+import threading
+from typing import Dict, Any, List, Optional, Tuple
+import numpy as np
+from langchain_core.embeddings import Embeddings
+from langchain_core.messages import HumanMessage, SystemMessage
+from src.config import get_llm, settings
+from src.utils.vector_utils import int8_inner_product, l2_normalize, quantize_int8
 
 logger = logging.getLogger(__name__)
 
+# Static instructions of the LLM scope check, sent as the system message ahead of the question
+SCOPE_CHECK_PREFIX = """You are a helpful assistant checking if a student's question is relevant to NCERT Science Class 8 curriculum.
+
+IMPORTANT: Be very permissive. If the question could be related to any science topic, mark it as relevant.
+
+Is the student's question relevant to NCERT Science Class 8 Science curriculum? 
+Consider topics like: physics, chemistry, biology, force, pressure, friction, sound, light, electricity, magnets, cells, reproduction, adolescence, crops, microorganisms, fibers, plastics, metals, coal, petroleum, combustion, conservation, pollution, solar system, stars, natural phenomena, agriculture, plants, soil, etc."""
+
 class ContentFilter:
     """Content filtering and guardrails for user queries"""
     
-    def __init__(self):
-        self.settings = Settings()
-        self.llm = ChatGoogleGenerativeAI(
-            model=self.settings.GEMINI_MODEL,
-            temperature=0.1,
-            max_output_tokens=100
-        )
+    # Toxic patterns for age-appropriateness and vulgarity
+    TOXIC_PATTERNS = [
+        r'\b(kill\s+yourself|suicide|self\s*harm)\b',
+        r'\b(fuck|shit|bitch|asshole|dick|pussy)\b',
+        r'\b(nazi|hitler|white\s+supremacy)\b',
+        r'\b(drugs?|cocaine|heroin|meth)\b',
+        r'\b(porn|pornography|sex\s+video)\b',
+        r'\b(hate\s+speech|racist|sexist)\b'
+    ]
+    # All patterns combined, so a check is a single regex scan
+    TOXIC_RE = re.compile("|".join(TOXIC_PATTERNS), re.IGNORECASE)
+    
+    # All scope keywords in one substring alternation, longest first so the most specific keyword is reported
+    _SCOPE_KEYWORDS_BY_LOWER = dict(zip(settings.SCOPE_KEYWORDS_LOWER, settings.SCOPE_KEYWORDS))
+    SCOPE_KEYWORD_RE = re.compile(
+        "|".join(map(re.escape, sorted(settings.SCOPE_KEYWORDS_LOWER, key=len, reverse=True)))
+    )
+    
+    # Chapter-level descriptions embedded alongside SCOPE_KEYWORDS for the similarity check
+    SCOPE_REFERENCE_TEXTS = [
+        "Crop production and management in agriculture",
+        "Microorganisms: friend and foe",
+        "Synthetic fibres and plastics",
+        "Materials: metals and non-metals",
+        "Coal and petroleum as natural resources",
+        "Combustion and flame",
+        "Conservation of plants and animals",
+        "Cell structure and functions",
+        "Reproduction in animals",
+        "Reaching the age of adolescence",
+        "Force and pressure",
+        "Friction",
+        "Sound and how it is produced",
+        "Chemical effects of electric current",
+        "Some natural phenomena like lightning and earthquakes",
+        "Light, reflection and the human eye",
+        "Stars and the solar system",
+        "Pollution of air and water"
+    ]
+    
+    def __init__(self, embeddings: Optional[Embeddings] = None):
+        """
+        Initialize the content filter
+        
+        Args:
+            embeddings: Embedding model for the local scope check; without it the LLM check is used
+        """
+        self.settings = settings
+        self.llm = get_llm(temperature=0.1, max_output_tokens=100)
         
-        # Toxic patterns for age-appropriateness and vulgarity
-        self.toxic_patterns = [
-            r'\b(kill\s+yourself|suicide|self\s*harm)\b',
-            r'\b(fuck|shit|bitch|asshole|dick|pussy)\b',
-            r'\b(nazi|hitler|white\s+supremacy)\b',
-            r'\b(drugs?|cocaine|heroin|meth)\b',
-            r'\b(porn|pornography|sex\s+video)\b',
-            r'\b(hate\s+speech|racist|sexist)\b'
-        ]
+        # Scope reference embeddings as int8 codes and per-row scales, computed on first use
+        self.embeddings = embeddings
+        self._scope_matrix: Optional[Tuple[np.ndarray, np.ndarray]] = None
+        self._scope_lock = threading.Lock()
         
     def check_content_safety(self, content: str) -> Dict[str, Any]:
         """
@@ -39,16 +87,13 @@ class ContentFilter:
             Dict with safety information
         """
         try:
-            content_lower = content.lower()
-            
             # Check for toxic patterns
-            for pattern in self.toxic_patterns:
-                if re.search(pattern, content_lower):
-                    return {
-                        "is_safe": False,
-                        "reason": f"Content contains inappropriate language or topics",
-                        "confidence": 0.9
-                    }
+            if self.TOXIC_RE.search(content):
+                return {
+                    "is_safe": False,
+                    "reason": f"Content contains inappropriate language or topics",
+                    "confidence": 0.9
+                }
             
             # Default to safe
             return {
@@ -66,29 +111,42 @@ class ContentFilter:
                 "confidence": 0.5
             }
     
-    def check_scope_relevance(self, query: str) -> Dict[str, Any]:
-        """Check if query is relevant to NCERT Science Class 8 scope using LLM"""
+    def check_scope_relevance(self, query: str, query_embedding: Optional[List[float]] = None) -> Dict[str, Any]:
+        """
+        Check if query is relevant to NCERT Science Class 8 scope
+        
+        Keywords are checked first, then the query embedding is compared with the
+        scope reference embeddings. The LLM is only asked when no embeddings are
+        available or, with SCOPE_LLM_FALLBACK enabled, when the similarity is low.
+        
+        Args:
+            query: User query
+            query_embedding: Precomputed embedding of ``query``
+            
+        Returns:
+            Dict with relevance information; includes the ``query_embedding`` used, if any
+        """
         try:
             # First check for NCERT keywords
-            query_lower = query.lower()
-            for keyword in self.settings.SCOPE_KEYWORDS:
-                if keyword.lower() in query_lower:
-                    logger.info(f"Query matched NCERT keyword: '{keyword}'")
-                    return {"is_relevant": True, "reason": f"Contains NCERT keyword: {keyword}"}
+            keyword = self.match_scope_keyword(query)
+            if keyword is not None:
+                logger.info(f"Query matched NCERT keyword: '{keyword}'")
+                return {"is_relevant": True, "reason": f"Contains NCERT keyword: {keyword}"}
+            
+            if self.embeddings is not None:
+                result = self._check_scope_similarity(query, query_embedding)
+                if result is not None and (result["is_relevant"] or not self.settings.SCOPE_LLM_FALLBACK):
+                    return result
             
             logger.info("No keyword match found, using LLM for scope check")
             
             # If no keywords found, use LLM to check
-            prompt = f"""You are a helpful assistant checking if a student's question is relevant to NCERT Science Class 8 curriculum.
+            prompt = [
+                SystemMessage(content=SCOPE_CHECK_PREFIX),
+                HumanMessage(content=f"""Student's question: "{query}"
 
-IMPORTANT: Be very permissive. If the question could be related to any science topic, mark it as relevant.
-
-Student's question: "{query}"
-
-Is this question relevant to NCERT Science Class 8 Science curriculum? 
-Consider topics like: physics, chemistry, biology, force, pressure, friction, sound, light, electricity, magnets, cells, reproduction, adolescence, crops, microorganisms, fibers, plastics, metals, coal, petroleum, combustion, conservation, pollution, solar system, stars, natural phenomena, agriculture, plants, soil, etc.
-
-Respond with ONLY "YES" or "NO"."""
+Respond with ONLY "YES" or "NO".""")
+            ]
 
             response = self.llm.invoke(prompt)
             llm_response = response.content.strip().upper()
@@ -106,6 +164,51 @@ Respond with ONLY "YES" or "NO"."""
             logger.error(f"Error checking scope relevance: {str(e)}")
             return {"is_relevant": True, "reason": "Error occurred, defaulting to relevant"}
     
+    def match_scope_keyword(self, query: str) -> Optional[str]:
+        """
+        Find an NCERT scope keyword contained in a query, in a single regex scan
+        
+        Args:
+            query: User query
+            
+        Returns:
+            Matched keyword or None
+        """
+        match = self.SCOPE_KEYWORD_RE.search(query.lower())
+        if match is None:
+            return None
+        return self._SCOPE_KEYWORDS_BY_LOWER[match.group(0)]
+    
+    def _check_scope_similarity(self, query: str, query_embedding: Optional[List[float]]) -> Optional[Dict[str, Any]]:
+        """Compare the query embedding with the scope reference embeddings; None if embedding fails"""
+        try:
+            codes, scales = self._get_scope_matrix()
+            if query_embedding is None:
+                query_embedding = self.embeddings.embed_query(query)
+            
+            similarity = float(np.max(int8_inner_product(codes, scales, l2_normalize(query_embedding))))
+            is_relevant = similarity > self.settings.SCOPE_SIMILARITY_THRESHOLD
+            logger.info(f"Embedding scope check: similarity={similarity:.3f} (relevant: {is_relevant})")
+            return {
+                "is_relevant": is_relevant,
+                "reason": f"Scope similarity {similarity:.2f}",
+                "similarity": similarity,
+                "query_embedding": query_embedding
+            }
+            
+        except Exception as e:
+            logger.error(f"Error in embedding scope check: {str(e)}")
+            return None
+    
+    def _get_scope_matrix(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Embed the scope keywords and reference texts once"""
+        with self._scope_lock:
+            if self._scope_matrix is None:
+                texts = self.settings.SCOPE_KEYWORDS + self.SCOPE_REFERENCE_TEXTS
+                self._scope_matrix = quantize_int8(l2_normalize(self.embeddings.embed_documents(texts)))
+                logger.info(f"Embedded {len(texts)} scope reference texts")
+            return self._scope_matrix
+    
     def generate_scope_response(self, query: str) -> str:
         """
         Generate a helpful response when query is out of scope
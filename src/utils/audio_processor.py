@@ -1,12 +1,70 @@
 import speech_recognition as sr
+import requests
+from requests.adapters import HTTPAdapter
 from pydub import AudioSegment
+import numpy as np
+import soundfile as sf
+from scipy import signal
 import tempfile
 import os
+import json
 import logging
-from typing import Optional
+from functools import lru_cache
+from typing import Optional, Tuple
+from src.config import settings
 
 logger = logging.getLogger(__name__)
 
+# 200 ms of audio per streaming request
+STREAM_BLOCK_SECONDS = 0.2
+
+# Google Web Speech API, the endpoint behind sr.Recognizer.recognize_google
+WEB_SPEECH_URL = "https://www.google.com/speech-api/v2/recognize"
+WEB_SPEECH_TIMEOUT_SECONDS = 30
+
+# Preprocessing is skipped for clips already in this loudness range (dBFS)...
+CLEAN_DBFS_RANGE = (-25.0, -12.0)
+# ...whose share of spectral energy below the high-pass cutoff is under this ratio
+CLEAN_LOW_FREQ_RATIO = 0.1
+HIGH_PASS_CUTOFF_HZ = 300
+# Samples inspected for low-frequency noise
+NOISE_PROBE_SAMPLES = 8192
+# Peak level after normalization, matching pydub's default headroom (dBFS)
+NORMALIZE_HEADROOM_DB = -0.1
+
+
+@lru_cache(maxsize=1)
+def _http_session() -> requests.Session:
+    """HTTP session shared by all processors so recognition requests reuse open connections"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=4, pool_maxsize=16)
+    session.mount("https://", adapter)
+    return session
+
+
+@lru_cache(maxsize=1)
+def _speech_client():
+    """Google Cloud Speech client, or None when the library or credentials are unavailable"""
+    try:
+        from google.cloud import speech
+        return speech.SpeechClient()
+    except Exception as e:
+        logger.info(f"Streaming speech recognition unavailable, using Web Speech API: {str(e)}")
+        return None
+
+
+@lru_cache(maxsize=8)
+def _high_pass_sos(sample_rate: int) -> np.ndarray:
+    """Fourth-order Butterworth high-pass at HIGH_PASS_CUTOFF_HZ as second-order sections"""
+    return signal.butter(4, HIGH_PASS_CUTOFF_HZ, btype='highpass', fs=sample_rate, output='sos')
+
+
+def _to_mono(samples: np.ndarray) -> np.ndarray:
+    """Mix (frames, channels) int16 samples down to a single channel"""
+    if samples.shape[1] > 1:
+        return samples.mean(axis=1).astype(np.int16)
+    return np.ascontiguousarray(samples[:, 0])
+
 
 class AudioProcessor:
     """Audio processing for speech-to-text conversion"""
@@ -32,30 +90,31 @@ class AudioProcessor:
         try:
             logger.info(f"Processing audio file: {audio_file_path}")
 
-            # Convert audio to WAV format if needed
-            wav_path = self._convert_to_wav(audio_file_path)
-
-            # Use speech recognition
-            with sr.AudioFile(wav_path) as source:
-                # Adjust for ambient noise
-                self.recognizer.adjust_for_ambient_noise(source, duration=0.5)
-
-                # Record the audio
-                audio_data = self.recognizer.record(source)
+            # Upload while decoding when Cloud Speech is available
+            client = _speech_client()
+            if client is not None:
+                try:
+                    text = self._stream_recognize(client, audio_file_path)
+                    if text is None:
+                        logger.warning("Could not understand audio")
+                        return None
+                    logger.info(f"Successfully recognized: {text}")
+                    return text
+                except Exception as e:
+                    logger.warning(f"Streaming recognition failed, falling back to Web Speech API: {str(e)}")
 
-                # Recognize speech using Google Web Speech API
-                text = self.recognizer.recognize_google(
-                    audio_data,
-                    language='en-US'
-                )
+            # Decode straight into PCM samples, no WAV file in between
+            samples, sample_rate = self._load_audio(audio_file_path)
+            audio_data = sr.AudioData(samples.tobytes(), sample_rate=sample_rate, sample_width=2)
 
-                logger.info(f"Successfully recognized: {text}")
+            # Recognize speech using Google Web Speech API
+            text = self._recognize_google(
+                audio_data,
+                language='en-US'
+            )
 
-                # Clean up temporary file if created
-                if wav_path != audio_file_path:
-                    os.unlink(wav_path)
-                
-                return text.strip()
+            logger.info(f"Successfully recognized: {text}")
+            return text.strip()
             
         except sr.UnknownValueError:
             logger.warning("Could not understand audio")
@@ -69,52 +128,118 @@ class AudioProcessor:
             logger.error(f"Error processing audio: {str(e)}")
             return None
         
-    def _convert_to_wav(self, audio_file_path: str) -> str:
+    def _load_audio(self, audio_file_path: str) -> Tuple[np.ndarray, int]:
         """
-        Convert audio file to WAV format
+        Decode audio file into mono 16-bit PCM samples in memory
 
         Args:
             audio_file_path: Input audio file path
 
         Returns:
-            Path to WAV file
+            Tuple of int16 samples and sample rate
         """
         try:
-            file_extension = os.path.splitext(audio_file_path)[1].lower()
+            # libsndfile decodes WAV, FLAC, OGG and MP3 in-process
+            samples, sample_rate = sf.read(audio_file_path, dtype='int16', always_2d=True)
+        except RuntimeError:
+            # Formats libsndfile can't read (e.g. m4a) go through pydub, still without a temp file
+            logger.info(f"Decoding {os.path.splitext(audio_file_path)[1].lower()} with pydub")
+            audio = AudioSegment.from_file(audio_file_path).set_sample_width(2)
+            samples = np.array(audio.get_array_of_samples(), dtype=np.int16).reshape(-1, audio.channels)
+            sample_rate = audio.frame_rate
 
-            if file_extension == '.wav':
-                return audio_file_path
-            
-            logger.info(f"Converting {file_extension} to WAV")
-
-            # Load audio file
-            if file_extension == '.mp3':
-                audio = AudioSegment.from_mp3(audio_file_path)
-            elif file_extension == '.m4a':
-                audio = AudioSegment.from_file(audio_file_path, "m4a")
-            elif file_extension == '.ogg':
-                audio = AudioSegment.from_ogg(audio_file_path)
-            else:
-                # Try generic approach
-                audio = AudioSegment.from_file(audio_file_path)
-            
-            # Create temporary WAV file
-            with tempfile.NamedTemporaryFile(
-                delete=False,
-                suffix='.wav'
-            ) as tmp_file:
-                wav_path = tmp_file.name
-            
-            # Export as WAV
-            audio.export(wav_path, format="wav")
+        # Speech recognition expects a single channel
+        return _to_mono(samples), sample_rate
 
-            logger.info(f"Converted to WAV: {wav_path}")
-            return wav_path
-        
-        except Exception as e:
-            logger.error(f"Error converting audio: {str(e)}")
-            # Return original path if conversion fails
-            return audio_file_path
+    def _recognize_google(self, audio_data: sr.AudioData, language: str = 'en-US') -> str:
+        """
+        Recognize speech with the Google Web Speech API over the shared HTTP session
+
+        Without a configured WEB_SPEECH_API_KEY the request goes through the
+        speech_recognition library instead, which supplies its own default key.
+
+        Args:
+            audio_data: Audio to recognize
+            language: Recognition language tag
+
+        Returns:
+            Most likely transcription
+
+        Raises:
+            sr.UnknownValueError: If the speech is unintelligible
+            sr.RequestError: If the request fails
+        """
+        if not settings.WEB_SPEECH_API_KEY:
+            return self.recognizer.recognize_google(audio_data, language=language)
+
+        # The API expects 16-bit FLAC at 8 kHz or more
+        flac_data = audio_data.get_flac_data(
+            convert_rate=None if audio_data.sample_rate >= 8000 else 8000,
+            convert_width=2
+        )
+        try:
+            response = _http_session().post(
+                WEB_SPEECH_URL,
+                params={"client": "chromium", "lang": language, "key": settings.WEB_SPEECH_API_KEY, "pFilter": 0},
+                data=flac_data,
+                headers={"Content-Type": f"audio/x-flac; rate={max(audio_data.sample_rate, 8000)}"},
+                timeout=WEB_SPEECH_TIMEOUT_SECONDS
+            )
+            response.raise_for_status()
+        except requests.RequestException as e:
+            raise sr.RequestError(f"recognition request failed: {str(e)}")
+
+        # One JSON object per line; the first non-empty result holds the hypotheses
+        for line in response.text.split("\n"):
+            if not line:
+                continue
+            results = json.loads(line)["result"]
+            if results:
+                alternatives = results[0].get("alternative", [])
+                if alternatives and "transcript" in alternatives[0]:
+                    return alternatives[0]["transcript"]
+                break
+        raise sr.UnknownValueError()
+
+    def _stream_recognize(self, client, audio_file_path: str) -> Optional[str]:
+        """
+        Recognize speech with Cloud Speech streaming, uploading blocks as they are decoded
+
+        Args:
+            client: Google Cloud Speech client
+            audio_file_path: Path to audio file readable by libsndfile
+
+        Returns:
+            Recognized text or None if nothing was recognized
+        """
+        from google.cloud import speech
+
+        sample_rate = sf.info(audio_file_path).samplerate
+        config = speech.StreamingRecognitionConfig(
+            config=speech.RecognitionConfig(
+                encoding=speech.RecognitionConfig.AudioEncoding.LINEAR16,
+                sample_rate_hertz=sample_rate,
+                language_code='en-US'
+            )
+        )
+
+        def audio_requests():
+            for block in sf.blocks(
+                    audio_file_path,
+                    blocksize=max(int(sample_rate * STREAM_BLOCK_SECONDS), 1),
+                    dtype='int16',
+                    always_2d=True
+            ):
+                yield speech.StreamingRecognizeRequest(audio_content=_to_mono(block).tobytes())
+
+        responses = client.streaming_recognize(config, audio_requests())
+        text = " ".join(
+            result.alternatives[0].transcript.strip()
+            for response in responses
+            for result in response.results
+            if result.is_final and result.alternatives
+        )
+        return text.strip() or None
     
     def preprocess_audio(self, audio_file_path: str) -> str:
         """
@@ -127,23 +252,31 @@ class AudioProcessor:
             Path to processed audio file
         """
         try:
-            # Load audio
-            audio = AudioSegment.from_file(audio_file_path)
+            # Load audio in-process
+            samples, sample_rate = self._load_audio(audio_file_path)
+            if self._is_clean_audio(samples, sample_rate):
+                logger.info("Audio already clean, skipping preprocessing")
+                return audio_file_path
+
+            audio = samples.astype(np.float32) / 32768.0
 
             # Normalize audio
-            normalized_audio = audio.normalize()
+            peak = np.max(np.abs(audio))
+            if peak > 0:
+                audio *= 10 ** (NORMALIZE_HEADROOM_DB / 20) / peak
 
             # Apply noise reduction (simple high-pass filter)
             # Remove frequencies below 300 Hz (typical noise)
-            filtered_audio = normalized_audio.high_pass_filter(300)
+            filtered_audio = signal.sosfilt(_high_pass_sos(sample_rate), audio)
 
             # Ensure reasonable volume
-            if filtered_audio.dbFS < -30:
+            dbfs = 20 * np.log10(np.sqrt(np.mean(filtered_audio ** 2)) + 1e-9)
+            if dbfs < -30:
                 # Boost quite audio
-                filtered_audio = filtered_audio - (15 - filtered_audio.dbFS)
-            elif filtered_audio.dbFS > -10:
+                filtered_audio *= 10 ** ((-20 - dbfs) / 20)
+            elif dbfs > -10:
                 # Reduce loud audio
-                filtered_audio = filtered_audio - (filtered_audio.dbFS + 10)
+                filtered_audio *= 10 ** ((-10 - dbfs) / 20)
             
             # Create temporary file for processed audio
             with tempfile.NamedTemporaryFile(
@@ -153,7 +286,7 @@ class AudioProcessor:
                 processed_path = tmp_file.name
             
             # Export processed audio
-            filtered_audio.export(processed_path, format="wav")
+            sf.write(processed_path, np.clip(filtered_audio, -1.0, 1.0), sample_rate, subtype='PCM_16')
 
             logger.info("Audio preprocessing completed")
             return processed_path
@@ -162,6 +295,34 @@ class AudioProcessor:
             logger.error(f"Error preprocessing audio: {str(e)}")
             return audio_file_path
         
+    def _is_clean_audio(self, samples: np.ndarray, sample_rate: int) -> bool:
+        """
+        Check if audio is loud enough and free of low-frequency noise, so preprocessing can be skipped
+
+        Args:
+            samples: Mono int16 samples
+            sample_rate: Sample rate in Hz
+
+        Returns:
+            True if the audio needs no preprocessing
+        """
+        if samples.size == 0:
+            return False
+
+        normalized = samples.astype(np.float32) / 32768.0
+        dbfs = 20 * np.log10(np.sqrt(np.mean(normalized ** 2)) + 1e-9)
+        if not CLEAN_DBFS_RANGE[0] < dbfs < CLEAN_DBFS_RANGE[1]:
+            return False
+
+        probe = normalized[:NOISE_PROBE_SAMPLES]
+        spectrum = np.abs(np.fft.rfft(probe)) ** 2
+        frequencies = np.fft.rfftfreq(probe.size, d=1.0 / sample_rate)
+        total_energy = spectrum.sum()
+        if total_energy == 0:
+            return False
+        low_freq_ratio = spectrum[frequencies < HIGH_PASS_CUTOFF_HZ].sum() / total_energy
+        return low_freq_ratio < CLEAN_LOW_FREQ_RATIO
+
     def validate_audio_file(self, audio_file_path: str) -> bool:
         """
         Validate audio file
@@ -183,11 +344,8 @@ class AudioProcessor:
                 logger.error("Audio file too large (>50MB)")
                 return False
             
-            # Try to load audio file
-            audio = AudioSegment.from_file(audio_file_path)
-
             # Check duration (max 5 minutes)
-            duration_seconds = len(audio) / 1000
+            duration_seconds = self._audio_duration(audio_file_path)
             if duration_seconds > 300:
                 logger.error("Audio file too long (>5 minutes)")
                 return False
@@ -203,3 +361,33 @@ class AudioProcessor:
         except Exception as e:
             logger.error(f"Error validating audio file: {str(e)}")
             return False
+
+    def _audio_duration(self, audio_file_path: str) -> float:
+        """
+        Get audio duration from the file header, decoding only as a last resort
+
+        Args:
+            audio_file_path: Path to audio file
+
+        Returns:
+            Duration in seconds
+        """
+        # libsndfile reads the header of WAV, FLAC, OGG and MP3 files
+        try:
+            return sf.info(audio_file_path).duration
+        except RuntimeError:
+            pass
+
+        # mutagen (optional) reads container metadata such as m4a
+        try:
+            import mutagen
+            metadata = mutagen.File(audio_file_path)
+            if metadata is not None and metadata.info is not None:
+                return metadata.info.length
+        except ImportError:
+            pass
+        except Exception as e:
+            logger.warning(f"Could not read audio metadata: {str(e)}")
+
+        audio = AudioSegment.from_file(audio_file_path)
+        return len(audio) / 1000
@@ -1,23 +1,311 @@
 import base64
+import hashlib
 import logging
-from typing import Optional
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from io import BytesIO
+from typing import Any, BinaryIO, Callable, Dict, List, Optional, Tuple
+from PIL import Image
 from langchain_core.messages import HumanMessage
-from langchain_google_genai import ChatGoogleGenerativeAI
-from src.config import Settings
+from src.config import get_llm, settings
+from src.utils.ttl_cache import TTLCache
 
 logger = logging.getLogger(__name__)
 
+# Read size for streamed encoding; a multiple of 3 so chunks encode without padding
+_B64_CHUNK_SIZE = 3 * 64 * 1024
+
+# Base64 prefixes of the JPEG, PNG, GIF and WebP file signatures
+_IMAGE_MAGIC = ("/9j/", "iVBORw0KGgo", "R0lGOD", "UklGR")
+
+# Descriptions kept for re-asked images
+DESCRIPTION_CACHE_SIZE = 512
+DESCRIPTION_CACHE_TTL_SECONDS = 3600
+
+# Questions the prefetched general description already answers
+GENERIC_IMAGE_QUERY_RE = re.compile(
+    r"^\s*(?:please\s+)?(?:"
+    r"(?:what\s+is|what's|what\s+does)\s+(?:this|that|it)(?:\s+(?:image|picture|photo|diagram|figure))?(?:\s+show)?"
+    r"|(?:describe|explain)\s+(?:this|the|that)\s+(?:image|picture|photo|diagram|figure)"
+    r"|what\s+is\s+(?:in|shown\s+in)\s+(?:this|the)\s+(?:image|picture|photo|diagram|figure)"
+    r")?\W*$",
+    re.IGNORECASE
+)
+
+# Output budget of one image description; a batched call gets this much per image
+DESCRIPTION_MAX_OUTPUT_TOKENS = 500
+
+# Description requests arriving within this window share one vision-model call
+BATCH_WINDOW_SECONDS = 0.03
+MAX_IMAGE_BATCH_SIZE = 4
+_DESCRIPTION_MARKER = re.compile(r"^\s*=== DESCRIPTION (\d+) ===\s*$", re.MULTILINE)
+
+# Images sent to the vision model are shrunk to this longest edge and re-encoded as JPEG
+MAX_IMAGE_EDGE = 768
+JPEG_QUALITY = 80
+
+
+def encode_image_stream(image_stream: BinaryIO) -> str:
+    """
+    Base64-encode an image stream chunk by chunk
+    
+    Args:
+        image_stream: Binary file-like object positioned anywhere
+        
+    Returns:
+        Base64 encoded image data
+    """
+    image_stream.seek(0)
+    encoded_parts = []
+    leftover = b""
+    for chunk in iter(lambda: image_stream.read(_B64_CHUNK_SIZE), b""):
+        chunk = leftover + chunk
+        cut = len(chunk) - len(chunk) % 3
+        encoded_parts.append(base64.b64encode(chunk[:cut]))
+        leftover = chunk[cut:]
+    encoded_parts.append(base64.b64encode(leftover))
+    return b"".join(encoded_parts).decode("ascii")
+
+
+def hash_image_stream(image_stream: BinaryIO) -> str:
+    """
+    Compute a short content hash of an image stream
+    
+    Args:
+        image_stream: Binary file-like object positioned anywhere
+        
+    Returns:
+        Hex digest identifying the image content
+    """
+    image_stream.seek(0)
+    digest = hashlib.blake2b(digest_size=16)
+    for chunk in iter(lambda: image_stream.read(_B64_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    image_stream.seek(0)
+    return digest.hexdigest()
+
+
+def _image_key(image_data: str) -> str:
+    """Hash the base64 text, which identifies the image without decoding it"""
+    return hashlib.blake2b(image_data.encode("ascii"), digest_size=16).hexdigest()
+
+
+def _query_key(user_query: str) -> str:
+    return hashlib.blake2s(user_query.encode("utf-8")).hexdigest()
+
+
+def downscale_image(image_data: str) -> str:
+    """
+    Shrink and recompress a base64 image to cut upload size and vision tokens
+    
+    Args:
+        image_data: Base64 encoded image data
+        
+    Returns:
+        Base64 encoded JPEG, or the original data if it can't be decoded or isn't made smaller
+    """
+    try:
+        with Image.open(BytesIO(base64.b64decode(image_data))) as img:
+            img.thumbnail((MAX_IMAGE_EDGE, MAX_IMAGE_EDGE), Image.LANCZOS)
+            buffer = BytesIO()
+            img.convert("RGB").save(buffer, "JPEG", quality=JPEG_QUALITY, optimize=True)
+        
+        downscaled = base64.b64encode(buffer.getvalue()).decode("ascii")
+        if len(downscaled) >= len(image_data):
+            return image_data
+        
+        logger.info(f"Downscaled image from {len(image_data)} to {len(downscaled)} characters")
+        return downscaled
+    except Exception as e:
+        logger.error(f"Error downscaling image, sending original: {str(e)}")
+        return image_data
+
+
+def _image_part(image_data: str) -> Dict[str, Any]:
+    return {
+        "type": "image_url",
+        "image_url": {
+            "url": f"data:image/jpeg;base64,{image_data}"
+        }
+    }
+
+
+class DescriptionBatcher:
+    """Collects concurrent image description requests and answers them with one vision-model call"""
+    
+    def __init__(
+            self,
+            llm: Any,
+            window_seconds: float = BATCH_WINDOW_SECONDS,
+            max_batch_size: int = MAX_IMAGE_BATCH_SIZE,
+            batch_llm: Optional[Callable[[int], Any]] = None
+    ):
+        """
+        Initialize batcher and start its collector thread
+        
+        Args:
+            llm: Vision-capable chat model for single images
+            window_seconds: How long to wait for more requests after the first one arrives
+            max_batch_size: Maximum number of images per call
+            batch_llm: Returns the model for a batch of the given size, so its output
+                budget can grow with the batch (defaults to ``llm``)
+        """
+        self.llm = llm
+        self.batch_llm = batch_llm or (lambda size: llm)
+        self.window_seconds = window_seconds
+        self.max_batch_size = max_batch_size
+        self._requests: "queue.Queue[Tuple[str, str, Future]]" = queue.Queue()
+        # Batches are sent from a pool so a slow call doesn't hold up collecting the next batch
+        self._executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="image-batch")
+        self._collector = threading.Thread(target=self._collect, name="image-batcher", daemon=True)
+        self._collector.start()
+    
+    def submit(self, prompt: str, image_data: str) -> Future:
+        """
+        Queue a description request
+        
+        Args:
+            prompt: Instructions for describing the image
+            image_data: Base64 encoded JPEG image data
+            
+        Returns:
+            Future resolving to the description text
+        """
+        future: Future = Future()
+        self._requests.put((prompt, image_data, future))
+        return future
+    
+    def _collect(self):
+        while True:
+            batch = [self._requests.get()]
+            deadline = time.monotonic() + self.window_seconds
+            while len(batch) < self.max_batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            self._executor.submit(self._describe_batch, batch)
+    
+    def _describe_batch(self, batch: List[Tuple[str, str, Future]]):
+        if len(batch) > 1:
+            try:
+                descriptions = self._invoke_batch(batch)
+                for (_, _, future), description in zip(batch, descriptions):
+                    future.set_result(description)
+                logger.info(f"Described {len(batch)} images with one batched call")
+                return
+            except Exception as e:
+                # Fall back to one call per image rather than failing the whole batch
+                logger.warning(f"Batched image description failed, describing individually: {str(e)}")
+        
+        for prompt, image_data, future in batch:
+            try:
+                response = self.llm.invoke([HumanMessage(content=[
+                    {"type": "text", "text": prompt},
+                    _image_part(image_data)
+                ])])
+                future.set_result(response.content.strip())
+            except Exception as e:
+                future.set_exception(e)
+    
+    def _invoke_batch(self, batch: List[Tuple[str, str, Future]]) -> List[str]:
+        content: List[Dict[str, Any]] = [{
+            "type": "text",
+            "text": f"The following {len(batch)} images come from different students and are independent of each other."
+        }]
+        for i, (prompt, image_data, _) in enumerate(batch, start=1):
+            content.append({"type": "text", "text": f"=== IMAGE {i} ===\n{prompt}"})
+            content.append(_image_part(image_data))
+        content.append({
+            "type": "text",
+            "text": f'Describe every image in order. Begin each description with a line containing only "=== DESCRIPTION <number> ===" using the image\'s number, and do not write anything else outside the descriptions.'
+        })
+        
+        response = self.batch_llm(len(batch)).invoke([HumanMessage(content=content)])
+        # A cut-off reply still has every marker, but its last description is incomplete
+        finish_reason = str(getattr(response, "response_metadata", {}).get("finish_reason", ""))
+        if "MAX_TOKENS" in finish_reason:
+            raise ValueError("batched reply hit the output token limit")
+        parts = _DESCRIPTION_MARKER.split(response.content)
+        descriptions = {int(number): text.strip() for number, text in zip(parts[1::2], parts[2::2])}
+        if sorted(descriptions) != list(range(1, len(batch) + 1)) or not all(descriptions.values()):
+            raise ValueError(f"expected {len(batch)} descriptions, got {sorted(descriptions)}")
+        return [descriptions[i] for i in range(1, len(batch) + 1)]
+
+
 class ImageProcessor:
     """Simple image processor for HelpBuddy AI"""
     
-    def __init__(self):
-        """Initialize image processor"""
-        self.settings = Settings()
-        self.llm = ChatGoogleGenerativeAI(
-            model=self.settings.GEMINI_MODEL,
-            temperature=0.3,
-            max_output_tokens=500
+    def __init__(self, llm: Optional[Any] = None):
+        """
+        Initialize image processor
+        
+        Args:
+            llm: Vision-capable chat model (defaults to the shared Gemini client for image descriptions)
+        """
+        self.settings = settings
+        self.llm = llm if llm is not None else get_llm(temperature=0.3, max_output_tokens=DESCRIPTION_MAX_OUTPUT_TOKENS)
+        # Concurrent requests from different sessions share vision-model calls; a batched
+        # call on the shared client gets the output budget of one description per image
+        batch_llm = None
+        if llm is None:
+            batch_llm = lambda size: get_llm(temperature=0.3, max_output_tokens=DESCRIPTION_MAX_OUTPUT_TOKENS * size)
+        self.batcher = DescriptionBatcher(self.llm, batch_llm=batch_llm)
+        # Descriptions by (image hash, question hash)
+        self.description_cache = TTLCache(
+            max_entries=DESCRIPTION_CACHE_SIZE,
+            ttl_seconds=DESCRIPTION_CACHE_TTL_SECONDS
         )
+        # General descriptions requested on upload, by image hash, until they finish
+        self._prefetches: Dict[str, Future] = {}
+        self._prefetch_lock = threading.Lock()
+        self._prefetch_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="image-prefetch")
+    
+    def prefetch_description(self, image_data: Optional[str]):
+        """
+        Start describing an image in the background while the user is still typing the question
+        
+        Args:
+            image_data: Base64 encoded image data
+        """
+        if not image_data:
+            return
+        image_key = _image_key(image_data)
+        if self.description_cache.get((image_key, _query_key(""))) is not None:
+            return
+        
+        with self._prefetch_lock:
+            if image_key in self._prefetches:
+                return
+            future = self._prefetch_executor.submit(self.describe_image, image_data, "")
+            self._prefetches[image_key] = future
+        future.add_done_callback(lambda _: self._forget_prefetch(image_key))
+        logger.info("Prefetching image description")
+    
+    def _forget_prefetch(self, image_key: str):
+        with self._prefetch_lock:
+            self._prefetches.pop(image_key, None)
+    
+    def _prefetched_description(self, image_key: str) -> Optional[str]:
+        """Get the general description of an image, waiting for its prefetch if one is running"""
+        description = self.description_cache.get((image_key, _query_key("")))
+        if description is not None:
+            return description
+        with self._prefetch_lock:
+            future = self._prefetches.get(image_key)
+        if future is None:
+            return None
+        try:
+            return future.result()
+        except Exception as e:
+            logger.error(f"Image description prefetch failed: {str(e)}")
+            return None
     
     def describe_image(self, image_data: Optional[str], user_query: str = "") -> Optional[str]:
         """
@@ -43,16 +331,25 @@ class ImageProcessor:
                 logger.error(f"Image data too small: {len(image_data)} characters")
                 return None
                 
-            # Check if it looks like base64
-            try:
-                import base64
-                # Try to decode a small portion to validate base64
-                test_decode = base64.b64decode(image_data[:100] + "==")
-                logger.info("Base64 validation passed")
-            except Exception as e:
-                logger.error(f"Image data is not valid base64: {str(e)}")
+            # Check it is a base64 encoded JPEG, PNG, GIF or WebP by its header
+            if not image_data.startswith(_IMAGE_MAGIC):
+                logger.error("Image data is not a base64 encoded JPEG, PNG, GIF or WebP image")
                 return None
             
+            image_key = _image_key(image_data)
+            cache_key = (image_key, _query_key(user_query))
+            cached_description = self.description_cache.get(cache_key)
+            if cached_description is not None:
+                logger.info("Reusing cached image description")
+                return cached_description
+            
+            # A general question is answered by the prefetched description, even if it is still running
+            if user_query and GENERIC_IMAGE_QUERY_RE.match(user_query):
+                prefetched = self._prefetched_description(image_key)
+                if prefetched is not None:
+                    logger.info("Using prefetched image description")
+                    return prefetched
+            
             # Create a message with the image and user query
             if user_query:
                 prompt = f"""Analyze this image and describe what you see that's relevant to the user's question: "{user_query}"
@@ -62,28 +359,13 @@ Provide a detailed description of the image content that relates to NCERT Scienc
             else:
                 prompt = "Please describe this image in detail, focusing on any scientific or educational content that might be relevant to NCERT Science Class 8 curriculum."
             
-            message = HumanMessage(
-                content=[
-                    {
-                        "type": "text",
-                        "text": prompt
-                    },
-                    {
-                        "type": "image_url",
-                        "image_url": {
-                            "url": f"data:image/jpeg;base64,{image_data}"
-                        }
-                    }
-                ]
-            )
-            
             # Get description from LLM
             logger.info("Invoking LLM for image description...")
             try:
-                response = self.llm.invoke([message])
-                description = response.content.strip()
+                description = self.batcher.submit(prompt, downscale_image(image_data)).result()
                 
                 if description:
+                    self.description_cache.set(cache_key, description)
                     logger.info(f"Image description generated successfully ({len(description)} characters)")
                     logger.info(f"Description preview: '{description[:100]}...'")
                 else:
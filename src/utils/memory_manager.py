@@ -1,25 +1,98 @@
+import json
 import logging
-from typing import Dict, List, Any, Optional
+import re
+import tempfile
+import uuid
+from collections import defaultdict, deque
+from itertools import islice
+from typing import Dict, List, Any, Optional, Tuple
 from datetime import datetime, timedelta
+from pathlib import Path
+import numpy as np
+from src.utils.memory_store import MemoryStore
+
+try:
+    import orjson
+except ImportError:  # optional; export_json falls back to the standard library
+    orjson = None
 
 logger = logging.getLogger(__name__)
 
+# Longest question and response kept in memory; longer responses are spilled to disk in full
+MAX_QUERY_CHARS = 1024
+MAX_RESPONSE_CHARS = 8192
+
+# Stored interactions fetched by full-text search before the keyword overlap filter
+RELATED_SEARCH_LIMIT = 20
+
+# Token vocabulary is rebuilt from the live tokens once it grows past this multiple of them
+VOCAB_REBUILD_FACTOR = 2
+
+# Rough per-entry overhead (timestamp and bookkeeping) counted in the memory usage estimate
+ENTRY_OVERHEAD_BYTES = 64
+
+# Common science topics, reported when they appear in the student's questions
+SCIENCE_TOPICS = [
+    "photosynthesis", "cell", "force", "motion", "light", "sound",
+    "electricity", "magnet", "chemical", "reaction", "acid", "base",
+    "animal", "plant", "reproduction", "food", "nutrition",
+    "respiration", "excretion", "weeds", "crop", "fertilizer"
+]
+# Matches a topic at the start of a word, so plurals like "cells" still count
+_TOPIC_RE = re.compile(r"\b(" + "|".join(map(re.escape, SCIENCE_TOPICS)) + r")", re.IGNORECASE)
+
+
+def _preview(text: str, limit: int) -> str:
+    """Truncate text to limit characters, marking the cut with an ellipsis"""
+    return text[:limit] + "..." if len(text) > limit else text
+
 
 class MemoryManager:
     """Memory management for conversation history and context"""
 
-    def __init__(self, max_history: int = 10, max_age_hours: int = 24):
+    def __init__(
+            self,
+            max_history: int = 10,
+            max_age_hours: int = 24,
+            max_summary_queries: int = 20,
+            store: Optional[MemoryStore] = None,
+            session_id: str = "default",
+            spill_dir: Optional[str] = None
+    ):
         """
         Initialize memory manager
 
         Args:
             max_history: Maximum number of interactions to keep
             max_age_hours: Maximum age of interactions in hours
+            max_summary_queries: Maximum number of older questions kept in the conversation summary
+            store: Optional SQLite store the interactions are written through to
+            session_id: Key of this conversation in the store
+            spill_dir: Directory for full responses longer than MAX_RESPONSE_CHARS (defaults to a temp directory)
         """
         self.max_history = max_history
         self.max_age_hours = max_age_hours
-        self.conversations: List[Dict[str, Any]] = []
+        self.max_summary_queries = max_summary_queries
+        # Appending at capacity drops the oldest interaction
+        self.conversations: deque = deque(maxlen=max_history)
         self.user_context: Dict[str, Any] = {}
+        # Questions of interactions that fell out of the history window, oldest first
+        self.summary_queries: List[str] = []
+        # Inverted index of query/response tokens to the ids of interactions containing them
+        self._index: Dict[str, set] = defaultdict(set)
+        self._interactions_by_id: Dict[int, Dict[str, Any]] = {}
+        self._next_id = 0
+        # Bit position of every token, for the packed token bitmaps of interactions
+        self._vocab: Dict[str, int] = {}
+        # Running memory usage estimates, kept up to date on every change
+        self._bytes_conversations = 0
+        self._bytes_user_context = 0
+        self.store = store
+        self.session_id = session_id
+        self.spill_dir = Path(spill_dir) if spill_dir else Path(tempfile.gettempdir()) / "helpbuddy_memory"
+        self._sweep_spill_dir()
+        if self.store is not None:
+            self._restore_from_store()
 
     def add_interaction(
             self,
@@ -35,24 +108,45 @@ class MemoryManager:
             bot_response: Bot's response
             metadata: Additional metadata
         """
-        try:
-            interaction = {
-                "timestamp": datetime.now(),
-                "user_query": user_query,
-                "bot_response": bot_response,
-                "metadata": metadata or {}
-            }
+        self.add_interactions_bulk([(user_query, bot_response, metadata)])
 
-            self.conversations.append(interaction)
+    def add_interactions_bulk(
+            self,
+            interactions: List[Tuple[str, str, Optional[Dict[str, Any]]]]
+    ):
+        """
+        Add several interactions to memory, cleaning up old ones once
+
+        Args:
+            interactions: (user_query, bot_response, metadata) tuples, oldest first
+        """
+        try:
+            if not interactions:
+                return
 
             # Clean up old interactions
             self._cleanup_old_interactions()
 
-            # Limit history size
-            if len(self.conversations) > self.max_history:
-                self.conversations = self.conversations[-self.max_history:]
+            timestamp = datetime.now()
+            new_interactions = [
+                self._build_interaction(user_query, bot_response, metadata, timestamp)
+                for user_query, bot_response, metadata in interactions
+            ]
+            for conv in new_interactions:
+                self._append_interaction(conv)
+
+            if self.store is not None:
+                # Keep the full text of long responses too, so exports survive a restart
+                rows = [
+                    dict(conv, full_response=bot_response) if len(bot_response) > MAX_RESPONSE_CHARS else conv
+                    for conv, (_, bot_response, _) in zip(new_interactions, interactions)
+                ]
+                try:
+                    self.store.add(self.session_id, rows)
+                except Exception as e:
+                    logger.error(f"Error writing interactions to memory store: {str(e)}")
             
-            logger.info(f"Added interaction to memory. Total: {len(self.conversations)}")
+            logger.info(f"Added {len(interactions)} interaction(s) to memory. Total: {len(self.conversations)}")
 
         except Exception as e:
             logger.error(f"Error adding interaction to memory: {str(e)}")
@@ -72,19 +166,19 @@ class MemoryManager:
                 return "No previous conversation histroy"
             
             # Get recent interactions
-            recent_conversations = self.conversations[-last_n:]
+            recent_conversations = islice(self.conversations, max(len(self.conversations) - last_n, 0), None)
 
             context_parts = ["Previous conversation context:"]
 
+            summary = self.get_summary_text()
+            if summary:
+                context_parts.append(summary)
+
             for i, conv in enumerate(recent_conversations, 1):
                 context_parts.append(
                     f"\n{i}. User: {conv['user_query']}"
                 )
-                context_parts.append(
-                    f"  Assistant: {conv['bot_response'][:200]}..."
-                    if len(conv['bot_response']) > 200
-                    else f" Assistant: {conv['bot_response']}"
-                )
+                context_parts.append(f"  Assistant: {conv['_preview_200']}")
 
             return "\n".join(context_parts)
         
@@ -106,58 +200,52 @@ class MemoryManager:
             if not self.conversations:
                 return ""
             
-            query_lower = current_query.lower()
-            related_interactions = []
-
             # FInd related interactions based on keyword overlap
-            for conv in self.conversations:
-                prev_query = conv['user_query'].lower()
-                prev_response = conv['bot_response'].lower()
-
-                # Simple keyword matching
-                query_words = set(query_lower.split())
-                prev_words = set(prev_query.split())
-                response_words = set(prev_response.split())
-
-                # Calculate overlap
-                query_overlap = len(query_words & prev_words) / max(len(query_words), 1)
-                response_overlap = len(query_words & response_words) / max(len(query_words), 1)
-
-                if query_overlap > 0.3 or response_overlap > 0.2:
-                    related_interactions.append({
-                        "interaction": conv,
-                        "relevance": max(query_overlap, response_overlap)
-                    })
-            
-            if not related_interactions:
-                return ""
-            
-            # Sort by relevance
-            related_interactions.sort(
-                key=lambda x: x["relevance"],
-                reverse=True
-            )
+            related_interactions = self._find_related_interactions(frozenset(current_query.lower().split()))
+            return self._format_related_context(related_interactions)
+        
+        except Exception as e:
+            logger.error(f"Error getting related context: {str(e)}")
+            return ""
+    
+    def fetch_bundle(self, current_query: str, last_n: int = 5) -> Tuple[str, str]:
+        """
+        Get recent and related conversation context in a single pass over the history
 
-            # Format related context
-            context_parts = ["Related previous discussions:"]
+        Equivalent to ``(get_conversation_context(last_n), get_related_context(current_query))``.
 
-            for item in related_interactions[:3]:
-                conv = item["interaction"]
-                context_parts.append(
-                    f"\n- Previously asked: {conv['user_query']}"
-                )
+        Args:
+            current_query: current user query
+            last_n: Number of recent interactions to include
+
+        Returns:
+            Tuple of formatted conversation context and related conversation context
+        """
+        try:
+            if not self.conversations:
+                return "No previous conversation histroy", ""
+
+            query_words = frozenset(current_query.lower().split())
+            recent_start = max(len(self.conversations) - last_n, 0)
+            context_parts = ["Previous conversation context:"]
+            summary = self.get_summary_text()
+            if summary:
+                context_parts.append(summary)
+
+            for index, conv in enumerate(islice(self.conversations, recent_start, None), 1):
                 context_parts.append(
-                    f"  Response: {conv['bot_response'][:150]}..."
-                    if len(conv['bot_response']) > 150
-                    else f" Response: {conv['bot_response']}"
+                    f"\n{index}. User: {conv['user_query']}"
                 )
+                context_parts.append(f"  Assistant: {conv['_preview_200']}")
+
+            related_interactions = self._find_related_interactions(query_words)
+
+            return "\n".join(context_parts), self._format_related_context(related_interactions)
 
-            return "\n".join(context_parts)
-        
         except Exception as e:
-            logger.error(f"Error getting related context: {str(e)}")
-            return ""
-    
+            logger.error(f"Error fetching conversation context bundle: {str(e)}")
+            return "Error retreiving conversation context.", ""
+
     def get_conversation_history_info(self, query: str) -> str:
         """
         Get specific information about conversation history based on query
@@ -181,7 +269,7 @@ class MemoryManager:
                     return f"Your first question was: '{first_conv['user_query']}'"
                 elif "response" in query_lower or "answer" in query_lower:
                     first_conv = self.conversations[0]
-                    return f"My first response was: '{first_conv['bot_response'][:200]}...'"
+                    return f"My first response was: '{first_conv['_preview_200']}'"
             
             elif any(word in query_lower for word in ["last", "recent", "previous", "before"]):
                 if "question" in query_lower or "ask" in query_lower:
@@ -189,24 +277,14 @@ class MemoryManager:
                     return f"Your last question was: '{last_conv['user_query']}'"
                 elif "response" in query_lower or "answer" in query_lower:
                     last_conv = self.conversations[-1]
-                    return f"My last response was: '{last_conv['bot_response'][:200]}...'"
+                    return f"My last response was: '{last_conv['_preview_200']}'"
             
             elif "how many" in query_lower and ("question" in query_lower or "ask" in query_lower):
                 return f"You have asked {len(self.conversations)} questions so far."
             
             elif "what" in query_lower and "discuss" in query_lower:
                 # Get all unique topics discussed
-                all_queries = " ".join([conv['user_query'] for conv in self.conversations])
-                topics = []
-                science_topics = [
-                    "photosynthesis", "cell", "force", "motion", "light", "sound", 
-                    "electricity", "magnet", "chemical", "reaction", "acid", "base", 
-                    "animal", "plant", "reproduction", "food", "nutrition", 
-                    "respiration", "excretion", "weeds", "crop", "fertilizer"
-                ]
-                for topic in science_topics:
-                    if topic in all_queries.lower():
-                        topics.append(topic)
+                topics = self._topics_discussed()
                 
                 if topics:
                     return f"We have discussed: {', '.join(topics)}"
@@ -227,6 +305,17 @@ class MemoryManager:
             logger.error(f"Error getting conversation history info: {str(e)}")
             return "Error retrieving conversation history information."
         
+    def get_summary_text(self) -> str:
+        """
+        Get the compressed summary of interactions older than the history window
+
+        Returns:
+            One-line summary of earlier questions, or an empty string
+        """
+        if not self.summary_queries:
+            return ""
+        return "Earlier in this conversation the student asked: " + "; ".join(self.summary_queries)
+
     def update_user_context(self, key: str, value: Any):
         """
         Update user context information
@@ -236,10 +325,17 @@ class MemoryManager:
             value: Context value
         """
         try:
+            previous = self.user_context.get(key)
+            if previous is not None:
+                self._bytes_user_context -= previous["_bytes"]
+
+            entry_bytes = len(str(key)) + len(str(value)) + ENTRY_OVERHEAD_BYTES
             self.user_context[key] = {
                 "value": value,
-                "timestamp": datetime.now()
+                "timestamp": datetime.now(),
+                "_bytes": entry_bytes
             }
+            self._bytes_user_context += entry_bytes
 
             logger.info(f"Updated user context: {key}")
         
@@ -282,22 +378,7 @@ class MemoryManager:
                 }
             
             # Extract topics (simple keyword extraction)
-            all_queries = " ".join([
-                conv["user_query"] for conv in self.conversations
-            ])
-
-            # Common science topics
-            science__topics = [
-                "photosynthesis", "cell", "force", "motion", "light",
-                "sound", "electricity", "magnet", "chemical", "reaction",
-                "acid", "base", "animal", "plant", "reproduction",
-                "food", "nutrition", "respiration", "excretion"
-            ]
-
-            topics_discussed = [
-                topic for topic in science__topics
-                if topic in all_queries.lower()
-            ]
+            topics_discussed = self._topics_discussed()
 
             return {
                 "total_interactions": len(self.conversations),
@@ -310,16 +391,322 @@ class MemoryManager:
             logger.error(f"Error getting conversation summary: {str(e)}")
             return {"error": str(e)}
         
+    def _topics_discussed(self) -> List[str]:
+        """Science topics found in the stored questions, in SCIENCE_TOPICS order"""
+        found = set().union(*(conv["_topics"] for conv in self.conversations))
+        return [topic for topic in SCIENCE_TOPICS if topic in found]
+
+    def _build_interaction(
+            self,
+            user_query: str,
+            bot_response: str,
+            metadata: Optional[Dict[str, Any]],
+            timestamp: datetime,
+            spill: bool = True
+    ) -> Dict[str, Any]:
+        """Create an interaction record with its precomputed lookup fields
+
+        With ``spill`` False a long response is only truncated, e.g. for transient search results.
+        """
+        # Bound the in-memory text; the full response stays readable for exports
+        spill_path = None
+        if len(bot_response) > MAX_RESPONSE_CHARS:
+            if spill:
+                spill_path = self._spill(bot_response)
+            bot_response = bot_response[:MAX_RESPONSE_CHARS]
+        user_query = user_query[:MAX_QUERY_CHARS]
+
+        return {
+            "timestamp": timestamp,
+            "user_query": user_query,
+            "bot_response": bot_response,
+            "metadata": metadata or {},
+            "_ts_iso": timestamp.isoformat(),
+            # Tokenized once here instead of on every related-context lookup
+            "_query_tokens": frozenset(user_query.lower().split()),
+            "_response_tokens": frozenset(bot_response.lower().split()),
+            "_topics": frozenset(topic.lower() for topic in _TOPIC_RE.findall(user_query)),
+            # Truncated responses for the context prompts, cut once instead of on every render
+            "_preview_200": _preview(bot_response, 200),
+            "_preview_150": _preview(bot_response, 150),
+            "_spill_path": spill_path
+        }
+
+    def _spill(self, text: str) -> Optional[Path]:
+        """Write text to a new file in the spill directory"""
+        try:
+            self.spill_dir.mkdir(parents=True, exist_ok=True)
+            path = self.spill_dir / f"{uuid.uuid4().hex}.txt"
+            path.write_text(text, encoding="utf-8")
+            return path
+        except Exception as e:
+            logger.error(f"Error spilling long response to disk: {str(e)}")
+            return None
+
+    def _full_response(self, conv: Dict[str, Any]) -> str:
+        """Get the complete response of an interaction, reading it back from disk if it was spilled"""
+        if conv["_spill_path"] is not None:
+            try:
+                return conv["_spill_path"].read_text(encoding="utf-8")
+            except Exception as e:
+                logger.error(f"Error reading spilled response: {str(e)}")
+        return conv["bot_response"]
+
+    def _sweep_spill_dir(self):
+        """Delete spill files older than max_age_hours, e.g. left by discarded managers or a previous run"""
+        try:
+            if not self.spill_dir.is_dir():
+                return
+            cutoff = (datetime.now() - timedelta(hours=self.max_age_hours)).timestamp()
+            for path in self.spill_dir.glob("*.txt"):
+                if path.stat().st_mtime < cutoff:
+                    path.unlink(missing_ok=True)
+        except Exception as e:
+            logger.error(f"Error sweeping spilled responses: {str(e)}")
+
+    def _remove_spill(self, conv: Dict[str, Any]):
+        if conv["_spill_path"] is not None:
+            conv["_spill_path"].unlink(missing_ok=True)
+
+    def _append_interaction(self, conv: Dict[str, Any]):
+        """Append an interaction to the history window"""
+        # Limit history size, folding the interaction the deque is about to drop into the summary
+        if self.conversations and len(self.conversations) == self.conversations.maxlen:
+            evicted = [self.conversations[0]]
+            self._fold_into_summary(evicted)
+            self._forget_interactions(evicted)
+
+        self._register_interaction(conv)
+        self.conversations.append(conv)
+
+    def _restore_from_store(self):
+        """Reload the recent history of this session from the store"""
+        try:
+            cutoff_time = datetime.now() - timedelta(hours=self.max_age_hours)
+            self.store.delete_older_than(cutoff_time)
+            for stored in self.store.load(self.session_id, since=cutoff_time, limit=self.max_history):
+                self._append_interaction(self._build_interaction(
+                    stored["user_query"],
+                    stored["bot_response"],
+                    stored["metadata"],
+                    stored["timestamp"]
+                ))
+            if self.conversations:
+                logger.info(f"Restored {len(self.conversations)} interaction(s) from memory store")
+        except Exception as e:
+            logger.error(f"Error restoring memory from store: {str(e)}")
+
+    def _find_related_interactions(self, query_words: frozenset) -> List[Dict[str, Any]]:
+        """
+        Score the interactions sharing at least one token with the query
+
+        Args:
+            query_words: Tokens of the current query
+
+        Returns:
+            Related interactions with their relevance
+        """
+        if self.store is not None:
+            try:
+                return self._search_related_interactions(query_words)
+            except Exception as e:
+                logger.error(f"Error searching memory store, using in-memory history: {str(e)}")
+
+        candidate_ids = set().union(*(self._index.get(word, ()) for word in query_words))
+        if not candidate_ids:
+            return []
+        candidates = [self._interactions_by_id[interaction_id] for interaction_id in sorted(candidate_ids)]
+
+        # Overlap counts for all candidates at once: AND the packed token bitmaps and count the set bits
+        width = self._bitmap_width()
+        query_bits = self._token_bits(query_words, width, add_tokens=False)
+        query_hits = self._popcount(self._stack_bitmaps(candidates, "_query_bits", width) & query_bits)
+        response_hits = self._popcount(self._stack_bitmaps(candidates, "_response_bits", width) & query_bits)
+
+        query_overlap = query_hits / max(len(query_words), 1)
+        response_overlap = response_hits / max(len(query_words), 1)
+        is_related = (query_overlap > 0.3) | (response_overlap > 0.2)
+        relevance = np.maximum(query_overlap, response_overlap)
+
+        return [
+            {"interaction": conv, "relevance": float(relevance[i])}
+            for i, conv in enumerate(candidates)
+            if is_related[i]
+        ]
+
+    def _bitmap_width(self) -> int:
+        """Number of uint64 words needed for a bitmap over the current vocabulary"""
+        return len(self._vocab) // 64 + 1
+
+    def _token_bits(self, tokens: frozenset, width: Optional[int] = None, add_tokens: bool = True) -> np.ndarray:
+        """
+        Pack a token set into a bitmap over the vocabulary
+
+        Args:
+            tokens: Tokens to set
+            width: Bitmap width in uint64 words (defaults to the width of the vocabulary after adding tokens)
+            add_tokens: Whether unknown tokens are added to the vocabulary or ignored
+
+        Returns:
+            uint64 bitmap
+        """
+        if add_tokens:
+            positions = [self._vocab.setdefault(token, len(self._vocab)) for token in tokens]
+        else:
+            positions = [self._vocab[token] for token in tokens if token in self._vocab]
+
+        bits = np.zeros(width or self._bitmap_width(), dtype=np.uint64)
+        if positions:
+            positions = np.asarray(positions, dtype=np.uint64)
+            np.bitwise_or.at(bits, (positions // 64).astype(np.intp), np.left_shift(np.uint64(1), positions % 64))
+        return bits
+
+    @staticmethod
+    def _stack_bitmaps(interactions: List[Dict[str, Any]], field: str, width: int) -> np.ndarray:
+        """Stack the bitmaps of interactions into a matrix, zero-padding older, narrower ones"""
+        matrix = np.zeros((len(interactions), width), dtype=np.uint64)
+        for row, conv in enumerate(interactions):
+            bits = conv[field]
+            matrix[row, :len(bits)] = bits
+        return matrix
+
+    @staticmethod
+    def _popcount(matrix: np.ndarray) -> np.ndarray:
+        """Count the set bits of every row"""
+        return np.unpackbits(np.ascontiguousarray(matrix).view(np.uint8), axis=1).sum(axis=1)
+
+    def _rebuild_vocab(self):
+        """Drop tokens of forgotten interactions from the vocabulary and repack the bitmaps"""
+        self._vocab = {token: position for position, token in enumerate(self._index)}
+        width = self._bitmap_width()
+        for conv in self._interactions_by_id.values():
+            conv["_query_bits"] = self._token_bits(conv["_query_tokens"], width, add_tokens=False)
+            conv["_response_bits"] = self._token_bits(conv["_response_tokens"], width, add_tokens=False)
+
+    def _search_related_interactions(self, query_words: frozenset) -> List[Dict[str, Any]]:
+        """Score the stored interactions of this session ranked highest by full-text search"""
+        cutoff_time = datetime.now() - timedelta(hours=self.max_age_hours)
+        related_interactions = []
+        for stored in self.store.search(self.session_id, query_words, since=cutoff_time, limit=RELATED_SEARCH_LIMIT):
+            conv = self._build_interaction(
+                stored["user_query"],
+                stored["bot_response"],
+                stored["metadata"],
+                stored["timestamp"],
+                spill=False
+            )
+            relevance = self._keyword_relevance(query_words, conv)
+            if relevance is not None:
+                related_interactions.append({
+                    "interaction": conv,
+                    "relevance": relevance
+                })
+        return related_interactions
+
+    def _register_interaction(self, conv: Dict[str, Any]):
+        """Assign an id to an interaction, add its tokens to the inverted index and count its size"""
+        conv["_id"] = self._next_id
+        self._next_id += 1
+        conv["_bytes"] = len(conv["user_query"]) + len(conv["bot_response"]) + ENTRY_OVERHEAD_BYTES
+        self._bytes_conversations += conv["_bytes"]
+        self._interactions_by_id[conv["_id"]] = conv
+        for token in conv["_query_tokens"] | conv["_response_tokens"]:
+            self._index[token].add(conv["_id"])
+        conv["_query_bits"] = self._token_bits(conv["_query_tokens"])
+        conv["_response_bits"] = self._token_bits(conv["_response_tokens"])
+
+    def _forget_interactions(self, interactions: List[Dict[str, Any]]):
+        """Remove interactions leaving memory from the inverted index and the size estimate"""
+        for conv in interactions:
+            if self._interactions_by_id.pop(conv["_id"], None) is not None:
+                self._bytes_conversations -= conv["_bytes"]
+                self._remove_spill(conv)
+            for token in conv["_query_tokens"] | conv["_response_tokens"]:
+                postings = self._index.get(token)
+                if postings is not None:
+                    postings.discard(conv["_id"])
+                    if not postings:
+                        del self._index[token]
+
+        if len(self._vocab) > VOCAB_REBUILD_FACTOR * len(self._index) + 64:
+            self._rebuild_vocab()
+
+    def _keyword_relevance(self, query_words: frozenset, conv: Dict[str, Any]) -> Optional[float]:
+        """
+        Score an interaction by keyword overlap with the current query
+
+        Args:
+            query_words: Tokens of the current query
+            conv: Stored interaction
+
+        Returns:
+            Relevance score or None if the interaction is not related
+        """
+        query_hits = len(query_words & conv["_query_tokens"])
+        response_hits = len(query_words & conv["_response_tokens"])
+        if not query_hits and not response_hits:
+            return None
+
+        query_overlap = query_hits / max(len(query_words), 1)
+        response_overlap = response_hits / max(len(query_words), 1)
+        if query_overlap > 0.3 or response_overlap > 0.2:
+            return max(query_overlap, response_overlap)
+        return None
+
+    def _format_related_context(self, related_interactions: List[Dict[str, Any]]) -> str:
+        """Format the three most relevant related interactions"""
+        if not related_interactions:
+            return ""
+
+        # Sort by relevance
+        related_interactions.sort(
+            key=lambda x: x["relevance"],
+            reverse=True
+        )
+
+        # Format related context
+        context_parts = ["Related previous discussions:"]
+
+        for item in related_interactions[:3]:
+            conv = item["interaction"]
+            context_parts.append(
+                f"\n- Previously asked: {conv['user_query']}"
+            )
+            context_parts.append(f"  Response: {conv['_preview_150']}")
+
+        return "\n".join(context_parts)
+
+    def add_summary_queries(self, queries: List[str]):
+        """
+        Add questions asked before the history window to the conversation summary
+
+        Args:
+            queries: Questions in the order they were asked
+        """
+        for query in queries:
+            self.summary_queries.append(query[:100] + "..." if len(query) > 100 else query)
+        if len(self.summary_queries) > self.max_summary_queries:
+            self.summary_queries = self.summary_queries[-self.max_summary_queries:]
+
+    def _fold_into_summary(self, interactions: List[Dict[str, Any]]):
+        """Keep only the (shortened) questions of interactions leaving the history window"""
+        self.add_summary_queries([conv["user_query"] for conv in interactions])
+
     def _cleanup_old_interactions(self):
         """Remove interactions older than max_age_hours"""
         try:
             cutoff_time = datetime.now() - timedelta(hours=self.max_age_hours)
 
             # Filter out old interactions
-            self.conversations = [
-                conv for conv in self.conversations
-                if conv["timestamp"] > cutoff_time
-            ]
+            expired = [conv for conv in self.conversations if conv["timestamp"] <= cutoff_time]
+            if expired:
+                self._forget_interactions(expired)
+                if self.store is not None:
+                    self.store.delete_older_than(cutoff_time)
+                self.conversations = deque(
+                    (conv for conv in self.conversations if conv["timestamp"] > cutoff_time),
+                    maxlen=self.max_history
+                )
 
         except Exception as e:
             logger.error(f"Error cleaning up old interactions: {str(e)}")
@@ -327,8 +714,18 @@ class MemoryManager:
     def clear_memory(self):
         """Clear all memory"""
         try:
+            for conv in self.conversations:
+                self._remove_spill(conv)
             self.conversations.clear()
             self.user_context.clear()
+            self.summary_queries.clear()
+            self._index.clear()
+            self._interactions_by_id.clear()
+            self._vocab.clear()
+            self._bytes_conversations = 0
+            self._bytes_user_context = 0
+            if self.store is not None:
+                self.store.clear(self.session_id)
             logger.info("Memory Cleared")
 
         except Exception as e:
@@ -344,13 +741,8 @@ class MemoryManager:
         try:
             total_size = len(self.conversations) + len(self.user_context)
 
-            # Calculate memory usage (approximate)
-            memory_usage = 0
-            for conv in self.conversations:
-                memory_usage += len(str(conv))
-            
-            for key, value in self.user_context.items():
-                memory_usage += len(str(key)) + len(str(value))
+            # Memory usage (approximate), maintained as interactions and context change
+            memory_usage = self._bytes_conversations + self._bytes_user_context
 
             return {
                 "size": total_size,
@@ -374,18 +766,28 @@ class MemoryManager:
             List of conversation interactions
         """
         try:
-            exported_conversations = []
-
-            for conv in self.conversations:
-                exported_conversations.append({
-                    "timestamp": conv["timestamp"].isoformat(),
+            return [
+                {
+                    "timestamp": conv["_ts_iso"],
                     "user_query": conv["user_query"],
-                    "bot_response": conv["bot_response"],
-                    "metadata": conv.get("metadata", {})
-                })
-
-            return exported_conversations
+                    "bot_response": self._full_response(conv),
+                    "metadata": conv["metadata"]
+                }
+                for conv in self.conversations
+            ]
         
         except Exception as e:
             logger.error(f"Error exporting conversations: {str(e)}")
             return []
+
+    def export_json(self) -> bytes:
+        """
+        Export conversation history as JSON
+
+        Returns:
+            UTF-8 encoded JSON array of conversation interactions
+        """
+        exported_conversations = self.export_conversation()
+        if orjson is not None:
+            return orjson.dumps(exported_conversations, default=str)
+        return json.dumps(exported_conversations, default=str, ensure_ascii=False).encode("utf-8")
@@ -0,0 +1,145 @@
+import json
+import logging
+import sqlite3
+import threading
+from datetime import datetime
+from typing import Any, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+
+class MemoryStore:
+    """SQLite log of conversation interactions with full-text search over questions and answers"""
+
+    def __init__(self, db_path: str):
+        """
+        Open (or create) the store
+
+        Args:
+            db_path: Path to the SQLite database file
+        """
+        self.db_path = db_path
+        # Autocommit; writes from several sessions are serialized by the lock
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE VIRTUAL TABLE IF NOT EXISTS conversations USING fts5("
+            "session_id UNINDEXED, user_query, bot_response, ts UNINDEXED, meta UNINDEXED)"
+        )
+
+    def add(self, session_id: str, interactions: Iterable[Dict[str, Any]]):
+        """
+        Append interactions in a single transaction
+
+        Args:
+            session_id: Session the interactions belong to
+            interactions: Interactions with timestamp, user_query, bot_response and metadata,
+                plus full_response when bot_response is a truncation of it
+        """
+        rows = [
+            (
+                session_id,
+                conv["user_query"],
+                conv["bot_response"],
+                conv["timestamp"].isoformat(),
+                self._meta_json(conv)
+            )
+            for conv in interactions
+        ]
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT INTO conversations VALUES (?, ?, ?, ?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def load(self, session_id: str, since: datetime, limit: int) -> List[Dict[str, Any]]:
+        """
+        Get the most recent interactions of a session
+
+        Args:
+            session_id: Session to load
+            since: Oldest timestamp to include
+            limit: Maximum number of interactions
+
+        Returns:
+            Interactions, oldest first
+        """
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_query, bot_response, ts, meta FROM conversations "
+                "WHERE session_id = ? AND ts >= ? ORDER BY rowid DESC LIMIT ?",
+                (session_id, since.isoformat(), limit)
+            ).fetchall()
+        return [self._row_to_interaction(row) for row in reversed(rows)]
+
+    def search(self, session_id: str, query_words: Iterable[str], since: datetime, limit: int) -> List[Dict[str, Any]]:
+        """
+        Find the interactions of a session that best match the query words
+
+        Args:
+            session_id: Session to search
+            query_words: Words of the current query, matched with OR
+            since: Oldest timestamp to include
+            limit: Maximum number of interactions
+
+        Returns:
+            Interactions ranked by BM25, best first
+        """
+        # Quote every word so punctuation and FTS5 operators in the query are matched literally
+        match = " OR ".join('"' + word.replace('"', '""') + '"' for word in query_words)
+        if not match:
+            return []
+
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT user_query, bot_response, ts, meta FROM conversations "
+                "WHERE conversations MATCH ? AND session_id = ? AND ts >= ? "
+                "ORDER BY bm25(conversations) LIMIT ?",
+                (match, session_id, since.isoformat(), limit)
+            ).fetchall()
+        return [self._row_to_interaction(row) for row in rows]
+
+    def delete_older_than(self, cutoff: datetime):
+        """
+        Delete interactions of every session older than cutoff
+
+        Args:
+            cutoff: Oldest timestamp to keep
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE ts < ?", (cutoff.isoformat(),))
+
+    def clear(self, session_id: str):
+        """
+        Delete all interactions of a session
+
+        Args:
+            session_id: Session to clear
+        """
+        with self._lock:
+            self._conn.execute("DELETE FROM conversations WHERE session_id = ?", (session_id,))
+
+    @staticmethod
+    def _meta_json(conv: Dict[str, Any]) -> str:
+        """Serialize metadata; the full text of a truncated response rides along under a reserved key"""
+        meta = dict(conv.get("metadata", {}))
+        if conv.get("full_response") is not None:
+            meta["_full_response"] = conv["full_response"]
+        return json.dumps(meta, default=str)
+
+    @staticmethod
+    def _row_to_interaction(row: tuple) -> Dict[str, Any]:
+        user_query, bot_response, ts, meta = row
+        metadata = json.loads(meta) if meta else {}
+        return {
+            "timestamp": datetime.fromisoformat(ts),
+            "user_query": user_query,
+            # Only the truncated text is full-text indexed; restore the complete response
+            "bot_response": metadata.pop("_full_response", None) or bot_response,
+            "metadata": metadata
+        }
@@ -0,0 +1,116 @@
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from src.utils.vector_utils import int8_inner_product, l2_normalize, quantize_int8
+
+
+class SemanticCache:
+    """Thread-safe cache of answers looked up by cosine similarity of query embeddings"""
+
+    def __init__(self, threshold: float = 0.92, max_entries: int = 512, ttl_seconds: float = 3600):
+        """
+        Initialize cache
+
+        Args:
+            threshold: Minimum cosine similarity for a cached answer to be reused
+            max_entries: Maximum number of entries kept (oldest are evicted)
+            ttl_seconds: Lifetime of an entry in seconds
+        """
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        # Unit-length query embeddings stored as int8 codes with per-row scales,
+        # one row per entry, parallel to _queries/_responses/_expires_at
+        self._matrix: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._queries: List[str] = []
+        self._responses: List[str] = []
+        self._expires_at: List[float] = []
+        self._lock = threading.Lock()
+
+    def lookup(self, embedding: Sequence[float], threshold: Optional[float] = None) -> Optional[str]:
+        """
+        Find the answer of the most similar cached query
+
+        Args:
+            embedding: Query embedding
+            threshold: Override of the default similarity threshold
+
+        Returns:
+            Cached response or None if no live entry is similar enough
+        """
+        threshold = self.threshold if threshold is None else threshold
+        match = self.search(embedding)
+        if match is None or match[0] < threshold:
+            return None
+        return match[1]
+
+    def search(self, embedding: Sequence[float]) -> Optional[Tuple[float, str]]:
+        """
+        Find the most similar live cached query, however similar it is
+
+        Args:
+            embedding: Query embedding
+
+        Returns:
+            Tuple of cosine similarity and cached response, or None if the cache has no live entry
+        """
+        query = l2_normalize(embedding)
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != query.shape[0]:
+                return None
+
+            similarities = int8_inner_product(self._matrix, self._scales, query)
+            # Expired entries can't match; they are evicted as new entries push them out
+            similarities[np.asarray(self._expires_at) < time.monotonic()] = -np.inf
+            best = int(np.argmax(similarities))
+            if not np.isfinite(similarities[best]):
+                return None
+            return float(similarities[best]), self._responses[best]
+
+    def add(self, embedding: Sequence[float], query: str, response: str):
+        """
+        Store an answer
+
+        Args:
+            embedding: Query embedding
+            query: Query text
+            response: Response to reuse for similar queries
+        """
+        codes, scales = quantize_int8(l2_normalize(embedding)[np.newaxis, :])
+        with self._lock:
+            if self._matrix is None or self._matrix.shape[1] != codes.shape[1]:
+                self._clear_locked()
+                self._matrix, self._scales = codes, scales
+            else:
+                self._matrix = np.vstack([self._matrix, codes])
+                self._scales = np.concatenate([self._scales, scales])
+            self._queries.append(query)
+            self._responses.append(response)
+            self._expires_at.append(time.monotonic() + self.ttl_seconds)
+
+            overflow = len(self._queries) - self.max_entries
+            if overflow > 0:
+                self._matrix = self._matrix[overflow:]
+                self._scales = self._scales[overflow:]
+                del self._queries[:overflow]
+                del self._responses[:overflow]
+                del self._expires_at[:overflow]
+
+    def clear(self):
+        """Remove all entries"""
+        with self._lock:
+            self._clear_locked()
+
+    def _clear_locked(self):
+        self._matrix = None
+        self._scales = None
+        self._queries.clear()
+        self._responses.clear()
+        self._expires_at.clear()
+
+    def __len__(self) -> int:
+        return len(self._queries)
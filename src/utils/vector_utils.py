@@ -0,0 +1,119 @@
+from typing import Hashable, List, Sequence, Tuple
+
+import numpy as np
+
+
+def l2_normalize(vectors: np.ndarray) -> np.ndarray:
+    """
+    Scale vectors to unit length so inner product equals cosine similarity
+
+    Args:
+        vectors: A single vector or a (n, d) matrix
+
+    Returns:
+        float32 array of the same shape with unit-length rows
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.maximum(norms, 1e-12)
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Quantize vectors to int8 with one scale per vector
+
+    Args:
+        vectors: A single vector or a (n, d) matrix
+
+    Returns:
+        Tuple of int8 codes (same shape) and float32 scales (max absolute value of each vector)
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    scales = np.maximum(np.max(np.abs(vectors), axis=-1, keepdims=True), 1e-12)
+    codes = np.round(vectors / scales * 127).astype(np.int8)
+    return codes, scales[..., 0]
+
+
+def int8_inner_product(codes: np.ndarray, scales: np.ndarray, query: np.ndarray) -> np.ndarray:
+    """
+    Approximate inner products between int8-quantized rows and a float query
+
+    The query is quantized too and the dot products are accumulated in int32,
+    so the stored matrix is never expanded back to float32.
+
+    Args:
+        codes: (n, d) int8 codes from quantize_int8
+        scales: (n,) scales from quantize_int8
+        query: Query vector of shape (d,)
+
+    Returns:
+        float32 array of n approximate inner products
+    """
+    query_codes, query_scale = quantize_int8(query)
+    dots = codes.astype(np.int32) @ query_codes.astype(np.int32)
+    return dots.astype(np.float32) * (scales * (query_scale / (127 * 127)))
+
+
+def maximal_marginal_relevance(
+        query: np.ndarray,
+        candidates: np.ndarray,
+        k: int,
+        lambda_mult: float = 0.5
+) -> List[int]:
+    """
+    Select diverse, relevant candidates by maximal marginal relevance
+
+    All similarities are computed up front with two matrix products; each
+    selection step is then a masked argmax over precomputed rows.
+
+    Args:
+        query: Query vector of shape (d,)
+        candidates: Candidate matrix of shape (n, d)
+        k: Number of candidates to select
+        lambda_mult: Trade-off between relevance (1.0) and diversity (0.0)
+
+    Returns:
+        Indices of the selected candidates, in selection order
+    """
+    candidates = l2_normalize(candidates)
+    if candidates.shape[0] == 0 or k <= 0:
+        return []
+
+    sim_query = candidates @ l2_normalize(query)
+    sim_pairwise = candidates @ candidates.T
+
+    selected = [int(np.argmax(sim_query))]
+    available = np.ones(candidates.shape[0], dtype=bool)
+    available[selected[0]] = False
+    # Highest similarity of each candidate to anything selected so far
+    redundancy = sim_pairwise[selected[0]].copy()
+
+    while len(selected) < min(k, candidates.shape[0]):
+        scores = lambda_mult * sim_query - (1 - lambda_mult) * redundancy
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(redundancy, sim_pairwise[best], out=redundancy)
+
+    return selected
+
+
+def reciprocal_rank_fusion(rankings: Sequence[Sequence[Hashable]], k: int = 60) -> List[Hashable]:
+    """
+    Fuse several rankings with Reciprocal Rank Fusion
+
+    Each item scores ``sum(1 / (k + rank))`` over the rankings it appears in.
+
+    Args:
+        rankings: Ranked item ids, best first, one sequence per retriever
+        k: Damping constant; larger values flatten the contribution of top ranks
+
+    Returns:
+        Item ids ordered by fused score, best first
+    """
+    scores = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            scores[item] = scores.get(item, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
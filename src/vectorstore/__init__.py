@@ -1 +1,5 @@
 # Vector Store Package
+import logging
+
+# Stay silent when embedded in an application that doesn't configure logging
+logging.getLogger(__name__).addHandler(logging.NullHandler())
@@ -1,46 +1,194 @@
+import asyncio
 import os
+import re
+import threading
+import time
+import uuid
 import warnings
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import lru_cache
+import numpy as np
 import chromadb
 from chromadb.config import Settings as ChromaSettings
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
-from langchain_community.document_loaders import PyPDFLoader
 from langchain_community.vectorstores import Chroma
-from typing import List, Dict, Any
+from rank_bm25 import BM25Okapi
+from typing import List, Dict, Any, NamedTuple, Optional, Tuple
 import logging
-from src.config import Settings
+from src.config import settings
+from src.utils.vector_utils import maximal_marginal_relevance, reciprocal_rank_fusion
+from src.vectorstore.embeddings import ReducedDimEmbeddings
+from src.vectorstore.embedding_cache import EmbeddingCache
+from src.vectorstore.pdf_loader import load_and_split_pdf
 
 # Suppress deprecation warnings for Chroma
 warnings.filterwarnings("ignore", category=DeprecationWarning, module="langchain_community.vectorstores")
 
 logger = logging.getLogger(__name__)
 
+_TOKEN_RE = re.compile(r"\w+")
+
+# Concurrent embedding requests while indexing
+EMBED_WORKERS = 8
+# Pause before retrying a rate-limited batch on its own
+RATE_LIMIT_BACKOFF_SECONDS = 2.0
+# SQLite settings while chunks are added: no fsync per commit, in-memory temp tables, 256 MB cache
+BULK_INGEST_PRAGMAS = (
+    ("journal_mode", "WAL"),
+    ("synchronous", "NORMAL"),
+    ("temp_store", "MEMORY"),
+    ("cache_size", "-262144")
+)
+
+# Single background indexing worker shared by every store, so the PDF is never indexed twice at once
+_INDEX_EXECUTOR = ThreadPoolExecutor(max_workers=1, thread_name_prefix="kb-index")
+
+
+class Hit(NamedTuple):
+    """A retrieved chunk"""
+    id: str
+    content: str
+    metadata: Dict[str, Any]
+    # Distance of a dense hit, lower is closer
+    similarity_score: Optional[float] = None
+    # Score of a keyword hit, higher is better
+    bm25_score: Optional[float] = None
+
+
+def _tokenize(text: str) -> List[str]:
+    """Lowercased word tokens for BM25"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+@lru_cache(maxsize=256)
+def _format_context(chunks: Tuple[Tuple[str, str], ...]) -> str:
+    """
+    Format retrieved chunks as the context block of a prompt
+
+    Keyed by the chunks themselves rather than their ids, so a reindex can't
+    return stale text.
+
+    Args:
+        chunks: Pairs of page label and chunk text, best first
+
+    Returns:
+        Formatted context string
+    """
+    return "\n\n".join(
+        f"[Context {i} - Page {page}]\n{content}" for i, (page, content) in enumerate(chunks, 1)
+    )
+
+
+def job_status(job: Future) -> str:
+    """
+    Describe the state of a background indexing job
+
+    Args:
+        job: Future returned by ``index_pdf_async``
+
+    Returns:
+        "queued", "running", "done" or "failed"
+    """
+    if not job.done():
+        return "running" if job.running() else "queued"
+    if job.cancelled() or job.exception() is not None or not job.result():
+        return "failed"
+    return "done"
+
+
+def _is_rate_limited(error: Exception) -> bool:
+    """Check if an embedding error is a quota / HTTP 429 response"""
+    message = str(error)
+    return "429" in message or "ResourceExhausted" in type(error).__name__ or "quota" in message.lower()
+
+
+@lru_cache(maxsize=1)
+def _get_embeddings(model: str, api_key: str) -> GoogleGenerativeAIEmbeddings:
+    """
+    Get the process-wide Gemini embeddings client
+
+    Args:
+        model: Embedding model name
+        api_key: Google API key
+
+    Returns:
+        Embeddings client shared by every store
+    """
+    return GoogleGenerativeAIEmbeddings(model=model, google_api_key=api_key)
+
+
+@lru_cache(maxsize=1)
+def _get_chroma_client(path: str):
+    """
+    Get the process-wide ChromaDB client
+
+    Args:
+        path: Persistence directory
+
+    Returns:
+        Persistent client shared by every store
+    """
+    return chromadb.PersistentClient(
+        path=path,
+        settings=ChromaSettings(
+            anonymized_telemetry=False,
+            allow_reset=True
+        )
+    )
+
 
 class ChromaStore:
     """ChromaDB vector store for NCERT Science Class 8 content"""
 
-    def  __init__(self):
-        """Initialize ChromaDB store"""
-        self.settings = Settings()
-        self.embeddings = GoogleGenerativeAIEmbeddings(
-            model=self.settings.EMBEDDING_MODEL,
-            google_api_key=self.settings.GOOGLE_API_KEY
-        )
+    def  __init__(self, embed_dim: Optional[int] = None):
+        """
+        Initialize ChromaDB store
 
-        # Initialize ChromaDB client
-        self.client =  chromadb.PersistentClient(
-            path=self.settings.CHROMA_PERSIST_DIR,
-            settings=ChromaSettings(
-                anonymized_telemetry=False,
-                allow_reset=True
-            )
+        Args:
+            embed_dim: Embedding dimensionality to store (defaults to EMBED_DIM setting)
+        """
+        self.settings = settings
+        self.embed_dim = embed_dim or self.settings.EMBED_DIM
+        self.embeddings = ReducedDimEmbeddings(
+            _get_embeddings(self.settings.EMBEDDING_MODEL, self.settings.GOOGLE_API_KEY),
+            dimensions=self.embed_dim
         )
 
+        # Shared ChromaDB client
+        self.client = _get_chroma_client(self.settings.CHROMA_PERSIST_DIR)
+
+        self.embedding_cache = self._open_embedding_cache()
+
         self.collection_name = "ncert_science_class8"
         self.vectorstore = None
+        # Collection handle, looked up once instead of on every call
+        self._collection = None
+
+        # BM25 index over the stored chunks, built on first keyword search
+        self._bm25_index: Optional[Dict[str, Any]] = None
+        self._bm25_lock = threading.Lock()
 
         # Initialize or load existing vectorstore
         self._initialize_vectorstore()
 
+    def _open_embedding_cache(self) -> Optional[EmbeddingCache]:
+        """Open the embedding cache stored next to the Chroma directory"""
+        persist_dir = os.path.abspath(self.settings.CHROMA_PERSIST_DIR)
+        db_path = os.path.join(os.path.dirname(persist_dir), "embedding_cache.sqlite3")
+        try:
+            return EmbeddingCache(db_path, namespace=f"{self.settings.EMBEDDING_MODEL}:{self.embed_dim}")
+        except Exception as e:
+            logger.error("Error opening embedding cache, embeddings won't be cached: %s", e)
+            return None
+
+    @property
+    def collection(self):
+        """Chroma collection handle, fetched on first use after a reset"""
+        if self._collection is None:
+            self._collection = self.client.get_collection(self.collection_name)
+        return self._collection
+
     def _initialize_vectorstore(self):
         """Initialize or load existing vectorstore"""
         try:
@@ -52,12 +200,14 @@ class ChromaStore:
 
             if collection_exists:
                 logger.info("Loading existing vector store...")
+                self._collection = self.client.get_collection(self.collection_name)
                 self.vectorstore = Chroma(
                     client=self.client,
                     collection_name= self.collection_name,
                     embedding_function=self.embeddings
                 )
                 logger.info("Vector store loaded successfully")
+                threading.Thread(target=self._warm_up, name="chroma-warmup", daemon=True).start()
             else:
                 logger.info(
                     "No existing vector store found. Ready to index PDF."
@@ -65,9 +215,19 @@ class ChromaStore:
                 self.vectorstore = None
 
         except Exception as e:
-            logger.error(f"Error initializing vector store: {str(e)}")
+            logger.error("Error initializing vector store: %s", e)
             self.vectorstore = None
             
+    def _warm_up(self):
+        """Run one query so the HNSW index is loaded from disk before the first real search"""
+        try:
+            # Any unit vector will do; this doesn't call the embedding API
+            probe = [1.0] + [0.0] * (self.embed_dim - 1)
+            self.collection.query(query_embeddings=[probe], n_results=1, include=["distances"])
+            logger.info("Vector store warmed up")
+        except Exception as e:
+            logger.warning("Vector store warm-up failed: %s", e)
+
     def is_initialized(self) -> bool:
         """Check if vector store is initialized with data"""
         try:
@@ -75,12 +235,10 @@ class ChromaStore:
                 return False
                 
             # Try to get collection info to verify it exists and has documents
-            collection = self.client.get_collection(self.collection_name)
-            count = collection.count()
-            return count > 0
+            return self.collection.count() > 0
             
         except Exception as e:
-            logger.error(f"Error checking vector store initialization: {str(e)}")
+            logger.error("Error checking vector store initialization: %s", e)
             return False
     
     def index_pdf(self, pdf_path: str = None) -> bool:
@@ -94,61 +252,262 @@ class ChromaStore:
             bool: Success status
         """
         try:
-            if pdf_path is None:
-                pdf_path = self.settings.PDF_PATH
-                logger.info(f"Using default PDF path: {pdf_path}")
-            
-            if not os.path.exists(pdf_path):
-                logger.error(f"PDF file not found: {pdf_path}")
-                return False
-                
-            logger.info(f"Loading PDF from {pdf_path}")
-            # Load PDF and split into pages
-            loader = PyPDFLoader(pdf_path)
-            pages = loader.load_and_split()
-            
+            pages = self._load_pdf_pages(pdf_path)
             if not pages:
-                logger.error("No pages extracted from PDF")
                 return False
-                
-            logger.info(f"Successfully loaded {len(pages)} pages from PDF")
+
             logger.info("Initializing Chroma vector store with extracted content")
             
             # Create new collection and add texts
-            self.vectorstore = Chroma.from_documents(
-                documents=pages,
-                embedding=self.embeddings,
+            self._bm25_index = None
+            texts = [page.page_content for page in pages]
+            metadatas = [page.metadata for page in pages]
+            vectors = self._embed_documents_batched(texts)
+
+            self._collection = collection = self.client.get_or_create_collection(self.collection_name)
+            batch_size = self.settings.EMBED_BATCH_SIZE
+            with self._bulk_ingest_pragmas():
+                for start in range(0, len(texts), batch_size):
+                    end = start + batch_size
+                    collection.add(
+                        ids=[str(uuid.uuid4()) for _ in texts[start:end]],
+                        # Chroma takes lists; the matrix is only converted here, batch by batch
+                        embeddings=vectors[start:end].tolist(),
+                        documents=texts[start:end],
+                        metadatas=metadatas[start:end]
+                    )
+
+            self.vectorstore = Chroma(
+                client=self.client,
                 collection_name=self.collection_name,
-                client=self.client
+                embedding_function=self.embeddings
             )
-            
-            if not self.vectorstore:
-                logger.error("Vector store initialization failed")
-                return False
-                
-            collection = self.client.get_collection(self.collection_name)
-            count = collection.count()
-            logger.info(f"Vector store initialized with {count} documents")
+            logger.info("Vector store initialized with %d documents", collection.count())
             return True
             
         except Exception as e:
-            logger.error(f"Error indexing PDF: {str(e)}")
+            logger.error("Error indexing PDF: %s", e)
             logger.exception("Detailed error trace:")
             return False
     
+    def index_pdf_async(self, pdf_path: str = None) -> Future:
+        """
+        Index the PDF on the background indexing worker
+
+        Args:
+            pdf_path: Path to PDF file
+
+        Returns:
+            Future resolving to the success status of ``index_pdf``; see ``job_status``
+        """
+        return _INDEX_EXECUTOR.submit(self.index_pdf, pdf_path)
+
+    @contextmanager
+    def _bulk_ingest_pragmas(self):
+        """
+        Relax SQLite durability on Chroma's connection while chunks are added
+
+        Commits stop waiting for fsync, so a crash mid-ingest can leave a partial
+        collection; re-run index_pdf in that case. Chroma keeps one connection per
+        thread, so these settings only apply to adds made from the calling thread.
+        """
+        # Previous value of every pragma that was changed, restored in reverse order afterwards
+        changed: List[Tuple[str, Any]] = []
+        conn = None
+        try:
+            from chromadb.db.impl.sqlite import SqliteDB
+
+            conn = self.client._system.instance(SqliteDB)._conn_pool.connect()
+            for name, value in BULK_INGEST_PRAGMAS:
+                previous = conn.execute(f"PRAGMA {name}").fetchone()[0]
+                conn.execute(f"PRAGMA {name}={value}")
+                changed.append((name, previous))
+        except Exception as e:
+            # Chroma internals differ between versions; ingest at default speed
+            logger.warning("Could not tune SQLite for bulk ingest: %s", e)
+
+        try:
+            yield
+        finally:
+            for name, previous in reversed(changed):
+                try:
+                    conn.execute(f"PRAGMA {name}={previous}")
+                except Exception as e:
+                    logger.warning("Could not restore PRAGMA %s after bulk ingest: %s", name, e)
+
+    def _load_pdf_pages(self, pdf_path: Optional[str] = None) -> List[Any]:
+        """
+        Load the PDF and split it into chunks
+
+        Args:
+            pdf_path: Path to PDF file (defaults to PDF_PATH setting)
+
+        Returns:
+            Chunks as LangChain documents with stripped text and a string page label,
+            empty if the PDF is missing or has no text
+        """
+        if pdf_path is None:
+            pdf_path = self.settings.PDF_PATH
+            logger.info("Using default PDF path: %s", pdf_path)
+
+        if not os.path.exists(pdf_path):
+            logger.error("PDF file not found: %s", pdf_path)
+            return []
+
+        logger.info("Loading PDF from %s", pdf_path)
+        # Load PDF and split its pages into chunks
+        pages = load_and_split_pdf(
+            pdf_path,
+            chunk_size=self.settings.CHUNK_SIZE,
+            chunk_overlap=self.settings.CHUNK_OVERLAP
+        )
+
+        if not pages:
+            logger.error("No pages extracted from PDF")
+            return []
+
+        # Done once here so retrieval can use the stored text and page label as-is
+        for page in pages:
+            page.page_content = page.page_content.strip()
+            page.metadata["page"] = str(page.metadata.get("page", "Unknown"))
+
+        logger.info("Successfully loaded %d pages from PDF", len(pages))
+        return pages
+
+    def _embed_documents_batched(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed texts in batches of EMBED_BATCH_SIZE, several batches at a time
+
+        Texts already in the embedding cache are not sent again. Rate-limited
+        batches are retried one at a time after the concurrent pass.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            float32 matrix with one row per text, in the order of texts
+        """
+        vectors = np.empty((len(texts), self.embed_dim), dtype=np.float32)
+        if self.embedding_cache is None:
+            self._embed_documents_into(texts, vectors)
+            return vectors
+
+        keys = [self.embedding_cache.key(text) for text in texts]
+        cached = self.embedding_cache.get_many(keys)
+        misses = []
+        for i, key in enumerate(keys):
+            if key in cached:
+                vectors[i] = cached[key]
+            else:
+                misses.append(i)
+        if cached:
+            logger.info("Reusing %d of %d cached embeddings", len(texts) - len(misses), len(texts))
+
+        if misses:
+            fresh = np.empty((len(misses), self.embed_dim), dtype=np.float32)
+            self._embed_documents_into([texts[i] for i in misses], fresh)
+            vectors[misses] = fresh
+            self.embedding_cache.put_many(zip((keys[i] for i in misses), fresh))
+        return vectors
+
+    def _embed_documents_into(self, texts: List[str], out: np.ndarray):
+        """Embed texts through the API in concurrent batches, each batch writing its rows of ``out``"""
+        if not texts:
+            return
+        batch_size = self.settings.EMBED_BATCH_SIZE
+        batches: List[Tuple[int, List[str]]] = [
+            (start, texts[start:start + batch_size]) for start in range(0, len(texts), batch_size)
+        ]
+        rate_limited: List[Tuple[int, List[str]]] = []
+
+        def embed_batch(start: int, batch: List[str]):
+            out[start:start + len(batch)] = self.embeddings.embed_documents_array(batch)
+
+        with ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed") as pool:
+            futures = [(start, batch, pool.submit(embed_batch, start, batch)) for start, batch in batches]
+            for start, batch, future in futures:
+                try:
+                    future.result()
+                except Exception as e:
+                    if not _is_rate_limited(e):
+                        raise
+                    rate_limited.append((start, batch))
+
+        if rate_limited:
+            logger.warning("%d embedding batches were rate limited, retrying serially", len(rate_limited))
+            for start, batch in rate_limited:
+                time.sleep(RATE_LIMIT_BACKOFF_SECONDS)
+                embed_batch(start, batch)
+
+        logger.info("Embedded %d chunks in %d batches", len(texts), len(batches))
+
+    def embed_query(self, query: str) -> List[float]:
+        """
+        Embed a query with the store's embedding model
+
+        Args:
+            query: Search query
+
+        Returns:
+            Query embedding
+        """
+        if self.embedding_cache is None:
+            return self.embeddings.embed_query(query)
+
+        key = self.embedding_cache.key(query, kind="query")
+        cached = self.embedding_cache.get_many([key])
+        if key in cached:
+            return cached[key].tolist()
+        vector = self.embeddings.embed_query(query)
+        self.embedding_cache.put_many([(key, vector)])
+        return vector
+
+    def embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed several queries, sending the ones not cached in a single request
+
+        Args:
+            queries: Search queries
+
+        Returns:
+            Query embeddings in the order of queries
+        """
+        if self.embedding_cache is None:
+            return self.embeddings.embed_queries(queries) if queries else []
+
+        keys = [self.embedding_cache.key(query, kind="query") for query in queries]
+        cached = self.embedding_cache.get_many(keys)
+        misses = [i for i, key in enumerate(keys) if key not in cached]
+        if misses:
+            vectors = self.embeddings.embed_queries([queries[i] for i in misses])
+            new_items = [(keys[i], vector) for i, vector in zip(misses, vectors)]
+            self.embedding_cache.put_many(new_items)
+            cached.update(new_items)
+        return [np.asarray(cached[key], dtype=np.float32).tolist() for key in keys]
+
     def similarity_search(
             self,
             query: str,
             k: int = 5,
             filter_dict: Dict[str, Any] = None,
-    ) -> List[Dict[str, Any]]:
+            query_embedding: Optional[List[float]] = None,
+            mmr: bool = False,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5
+    ) -> List[Hit]:
         """
         Perform similarity search in vector store
 
+        Queries the Chroma collection directly with the query embedding.
+
         Args:
             query: Search query
             k: Number of results to return
             filter_dict: Optional filters
+            query_embedding: Precomputed embedding of the query, skips embedding it again
+            mmr: Re-rank ``fetch_k`` candidates by maximal marginal relevance for diversity
+            fetch_k: Number of candidates fetched for MMR re-ranking
+            lambda_mult: MMR trade-off between relevance (1.0) and diversity (0.0)
 
         Returns:
             List of relevant documents with metadata
@@ -158,33 +517,208 @@ class ChromaStore:
                 logger.warning("Vector store not initialized")
                 return []
             
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
+
             # Perform similarity search
-            docs = self.vectorstore.similarity_search_with_score(
-                query=query,
-                k=k,
-                filter=filter_dict
+            include = ["documents", "metadatas", "distances"]
+            if mmr:
+                include.append("embeddings")
+            response = self.collection.query(
+                query_embeddings=[query_embedding],
+                n_results=max(fetch_k, k) if mmr else k,
+                where=filter_dict or None,
+                include=include
             )
+            documents = response["documents"][0]
+            metadatas = response["metadatas"][0]
+            distances = response["distances"][0]
+
+            order = range(len(documents))
+            if mmr and documents:
+                order = maximal_marginal_relevance(
+                    np.asarray(query_embedding, dtype=np.float32),
+                    np.asarray(response["embeddings"][0], dtype=np.float32),
+                    k=k,
+                    lambda_mult=lambda_mult
+                )
 
             # Format results - no relevance scoring
-            results = []
-            for doc, score in docs:
-                results.append({
-                    "content": doc.page_content,
-                    "metadata": doc.metadata,
-                    "similarity_score": score
-                })
-
-            logger.info(f"Found {len(results)} documents")
+            ids = response["ids"][0]
+            results = [Hit(ids[i], documents[i], metadatas[i] or {}, distances[i]) for i in order]
+
+            logger.info("Found %d documents", len(results))
             return results
         
         except Exception as e:
-            logger.error(f"Error in similarity search: {str(e)}")
+            logger.error("Error in similarity search: %s", e)
             return []
         
+    async def asimilarity_search(
+            self,
+            query: str,
+            k: int = 5,
+            filter_dict: Dict[str, Any] = None,
+            query_embedding: Optional[List[float]] = None,
+            mmr: bool = False,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5
+    ) -> List[Hit]:
+        """
+        Perform similarity search without blocking the event loop
+
+        Embedding and the collection query run in a worker thread, so concurrent
+        searches overlap their embedding API calls.
+
+        Args:
+            query: Search query
+            k: Number of results to return
+            filter_dict: Optional filters
+            query_embedding: Precomputed embedding of the query, skips embedding it again
+            mmr: Re-rank ``fetch_k`` candidates by maximal marginal relevance for diversity
+            fetch_k: Number of candidates fetched for MMR re-ranking
+            lambda_mult: MMR trade-off between relevance (1.0) and diversity (0.0)
+
+        Returns:
+            List of relevant documents with metadata
+        """
+        return await asyncio.to_thread(
+            self.similarity_search, query, k, filter_dict, query_embedding, mmr, fetch_k, lambda_mult
+        )
+
+    def similarity_search_batch(
+            self,
+            queries: List[str],
+            k: int = 5,
+            filter_dict: Dict[str, Any] = None,
+            query_embeddings: Optional[List[List[float]]] = None
+    ) -> List[List[Hit]]:
+        """
+        Perform similarity search for several queries with one collection query
+
+        Args:
+            queries: Search queries
+            k: Number of results to return per query
+            filter_dict: Optional filters, applied to every query
+            query_embeddings: Precomputed embeddings of the queries
+
+        Returns:
+            One list of relevant documents per query, in the order of queries
+        """
+        try:
+            if self.vectorstore is None:
+                logger.warning("Vector store not initialized")
+                return [[] for _ in queries]
+            if not queries:
+                return []
+
+            if query_embeddings is None:
+                query_embeddings = self.embed_queries(queries)
+
+            response = self.collection.query(
+                query_embeddings=query_embeddings,
+                n_results=k,
+                where=filter_dict or None,
+                include=["documents", "metadatas", "distances"]
+            )
+            results = [
+                [
+                    Hit(doc_id, document, metadata or {}, distance)
+                    for doc_id, document, metadata, distance in zip(ids, documents, metadatas, distances)
+                ]
+                for ids, documents, metadatas, distances in zip(
+                    response["ids"], response["documents"], response["metadatas"], response["distances"]
+                )
+            ]
+
+            logger.info("Found documents for %d queries", len(results))
+            return results
+
+        except Exception as e:
+            logger.error("Error in batch similarity search: %s", e)
+            return [[] for _ in queries]
+
+    def keyword_search(self, query: str, k: int = 10) -> List[Hit]:
+        """
+        Perform BM25 keyword search over the stored chunks
+
+        Args:
+            query: Search query
+            k: Number of results to return
+
+        Returns:
+            List of matching documents with metadata, best first
+        """
+        try:
+            index = self._get_bm25_index()
+            if index is None:
+                return []
+
+            scores = index["bm25"].get_scores(_tokenize(query))
+            top = np.argsort(scores)[::-1][:k]
+
+            return [
+                Hit(index["ids"][i], index["documents"][i], index["metadatas"][i] or {}, bm25_score=float(scores[i]))
+                for i in top if scores[i] > 0
+            ]
+
+        except Exception as e:
+            logger.error("Error in keyword search: %s", e)
+            return []
+
+    def hybrid_search(
+            self,
+            query: str,
+            k: int = 5,
+            query_embedding: Optional[List[float]] = None,
+            candidates: int = 10
+    ) -> List[Hit]:
+        """
+        Combine dense and BM25 results with Reciprocal Rank Fusion
+
+        Args:
+            query: Search query
+            k: Number of results to return
+            query_embedding: Precomputed embedding of the query
+            candidates: Number of results taken from each retriever
+
+        Returns:
+            List of relevant documents with metadata, best first
+        """
+        dense = self.similarity_search(query, k=candidates, query_embedding=query_embedding)
+        sparse = self.keyword_search(query, k=candidates)
+
+        by_id = {hit.id: hit for hit in sparse}
+        by_id.update({hit.id: hit for hit in dense})
+        fused = reciprocal_rank_fusion(
+            [[hit.id for hit in dense], [hit.id for hit in sparse]],
+            k=60
+        )
+
+        logger.info("Hybrid search fused %d dense and %d keyword results", len(dense), len(sparse))
+        return [by_id[doc_id] for doc_id in fused[:k]]
+
+    def _get_bm25_index(self) -> Optional[Dict[str, Any]]:
+        """Build the BM25 index from the collection once; None while the store is empty"""
+        with self._bm25_lock:
+            if self._bm25_index is None and self.vectorstore is not None:
+                data = self.collection.get(include=["documents", "metadatas"])
+                if data["ids"]:
+                    self._bm25_index = {
+                        "bm25": BM25Okapi([_tokenize(doc or "") for doc in data["documents"]]),
+                        "ids": data["ids"],
+                        "documents": data["documents"],
+                        "metadatas": data["metadatas"]
+                    }
+                    logger.info("Built BM25 index over %d chunks", len(data['ids']))
+            return self._bm25_index
+
     def get_relevant_context(
             self,
             query: str,
-            max_chunks: int = 5
+            max_chunks: int = 5,
+            query_embedding: Optional[List[float]] = None,
+            mmr: bool = False
     ) -> str:
         """
         Get relevant context for a query
@@ -192,38 +726,31 @@ class ChromaStore:
         Args:
             query: Search query
             max_chunks: Maximum number of chunks to return
+            query_embedding: Precomputed embedding of the query
+            mmr: Diversify the chunks by maximal marginal relevance
         
         Returns:
             Formatted context string
         """
         try:
-            logger.info(f"Searching vector store for: '{query}'")
+            logger.info("Searching vector store for: '%s'", query)
             
             # Search for documents - no relevance filtering
-            results = self.similarity_search(query, k=max_chunks)
+            if self.settings.HYBRID_SEARCH and not mmr:
+                results = self.hybrid_search(query, k=max_chunks, query_embedding=query_embedding)
+            else:
+                results = self.similarity_search(query, k=max_chunks, query_embedding=query_embedding, mmr=mmr)
 
             if not results:
                 logger.info("No documents found in vector store")
                 return "No information found in NCERT Science Class 8."
             
-            logger.info(f"Found {len(results)} documents in vector store")
-            
-            # Format context
-            context_parts = []
-            for i, result in enumerate(results, 1):
-                content = result["content"].strip()
-                page = result["metadata"].get("page", "Unknown")
-
-                context_parts.append(
-                    f"[Context {i} - Page {page}]\n{content}"
-                )
-            
-            final_context = "\n\n".join(context_parts)
+            logger.info("Found %d documents in vector store", len(results))
             
-            return final_context
+            return _format_context(tuple((hit.metadata["page"], hit.content) for hit in results))
         
         except Exception as e:
-            logger.error(f"Error in vector store search: {str(e)}")
+            logger.error("Error in vector store search: %s", e)
             return "No information found in NCERT Science Class 8."
         
     def get_collection_info(self) -> Dict[str, Any]:
@@ -236,8 +763,7 @@ class ChromaStore:
                     "status": "Not initialized"
                 }
             
-            collection = self.client.get_collection(self.collection_name)
-            count = collection.count()
+            count = self.collection.count()
 
             return {
                 "exists": True,
@@ -247,7 +773,7 @@ class ChromaStore:
             }
         
         except Exception as e:
-            logger.error(f"Error getting collection info: {str(e)}")
+            logger.error("Error getting collection info: %s", e)
             return {
                 "exists": False,
                 "count": 0,
@@ -262,10 +788,12 @@ class ChromaStore:
                 logger.info("Collection reset successfully")
             
             self.vectorstore = None
+            self._collection = None
+            self._bm25_index = None
             return True
     
         except Exception as e:
-            logger.error(f"Error resetting collection: {str(e)}")
+            logger.error("Error resetting collection: %s", e)
             return False
 
     def debug_vector_store_content(self, query: str = None) -> Dict[str, Any]:
@@ -275,8 +803,7 @@ class ChromaStore:
                 return {"error": "Vector store not initialized"}
             
             # Get collection info
-            collection = self.client.get_collection(self.collection_name)
-            count = collection.count()
+            count = self.collection.count()
             
             result = {
                 "total_documents": count,
@@ -286,19 +813,22 @@ class ChromaStore:
             
             if query:
                 # Test search with the query
-                search_results = self.similarity_search(query, k=5)
-                result["search_results"] = []
-                for i, res in enumerate(search_results):
-                    result["search_results"].append({
-                        "rank": i + 1,
-                        "relevance": res["relevance"],
-                        "similarity_score": res["similarity_score"],
-                        "content_preview": res["content"][:200] + "..." if len(res["content"]) > 200 else res["content"],
-                        "page": res["metadata"].get("page", "Unknown")
-                    })
+                result["search_results"] = self._debug_search_results(query)
             
             return result
             
         except Exception as e:
-            logger.error(f"Error debugging vector store: {str(e)}")
+            logger.error("Error debugging vector store: %s", e)
             return {"error": str(e)}
+
+    def _debug_search_results(self, query: str, k: int = 5) -> List[Dict[str, Any]]:
+        """Summarize the top hits of a test search for debug_vector_store_content"""
+        return [
+            {
+                "rank": rank,
+                "similarity_score": hit.similarity_score,
+                "content_preview": hit.content[:200] + ("..." if len(hit.content) > 200 else ""),
+                "page": hit.metadata.get("page", "Unknown")
+            }
+            for rank, hit in enumerate(self.similarity_search(query, k=k), 1)
+        ]
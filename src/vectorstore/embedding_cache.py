@@ -0,0 +1,92 @@
+import hashlib
+import logging
+import sqlite3
+import threading
+from typing import Dict, Iterable, Sequence, Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# SQLite's default limit on host parameters per statement is 999
+_MAX_PARAMS = 900
+
+
+class EmbeddingCache:
+    """SQLite cache of embeddings keyed by a hash of the embedded text"""
+
+    def __init__(self, db_path: str, namespace: str = ""):
+        """
+        Open (or create) the cache
+
+        Args:
+            db_path: Path to the SQLite database file
+            namespace: Prefix hashed with every text, e.g. model name and dimensionality,
+                so vectors from a different model are never returned
+        """
+        self.db_path = db_path
+        self.namespace = namespace
+        self._conn = sqlite3.connect(db_path, check_same_thread=False, isolation_level=None)
+        self._lock = threading.Lock()
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS embeddings (hash BLOB PRIMARY KEY, vec BLOB)")
+
+    def key(self, text: str, kind: str = "document") -> bytes:
+        """
+        Hash a text
+
+        Args:
+            text: Text to hash (surrounding whitespace is ignored)
+            kind: "document" or "query"; the model embeds them differently
+
+        Returns:
+            16-byte BLAKE2b digest
+        """
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{self.namespace}:{kind}".encode())
+        digest.update(b"\0")
+        digest.update(text.strip().encode())
+        return digest.digest()
+
+    def get_many(self, keys: Sequence[bytes]) -> Dict[bytes, np.ndarray]:
+        """
+        Look up cached embeddings
+
+        Args:
+            keys: Text hashes
+
+        Returns:
+            Mapping of the hashes found to their embeddings (read-only float32 views)
+        """
+        found: Dict[bytes, np.ndarray] = {}
+        unique = list(dict.fromkeys(keys))
+        with self._lock:
+            for start in range(0, len(unique), _MAX_PARAMS):
+                chunk = unique[start:start + _MAX_PARAMS]
+                rows = self._conn.execute(
+                    f"SELECT hash, vec FROM embeddings WHERE hash IN ({', '.join('?' * len(chunk))})",
+                    chunk
+                ).fetchall()
+                for key, vec in rows:
+                    found[key] = np.frombuffer(vec, dtype=np.float32)
+        return found
+
+    def put_many(self, items: Iterable[Tuple[bytes, Sequence[float]]]):
+        """
+        Store embeddings, keeping any already cached for the same hash
+
+        Args:
+            items: Pairs of text hash and embedding
+        """
+        rows = [(key, np.asarray(vec, dtype=np.float32).tobytes()) for key, vec in items]
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany("INSERT OR IGNORE INTO embeddings VALUES (?, ?)", rows)
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
@@ -0,0 +1,47 @@
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from src.utils.vector_utils import l2_normalize
+
+
+class ReducedDimEmbeddings(Embeddings):
+    """Embeddings requested at a reduced (Matryoshka) dimensionality and re-normalized"""
+
+    def __init__(self, base: Embeddings, dimensions: int):
+        """
+        Wrap an embedding model
+
+        Args:
+            base: Embedding model accepting ``output_dimensionality``
+            dimensions: Number of dimensions to keep
+        """
+        self.base = base
+        self.dimensions = dimensions
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed documents at the reduced dimensionality"""
+        return self.embed_documents_array(texts).tolist()
+
+    def embed_documents_array(self, texts: List[str]) -> np.ndarray:
+        """Embed documents at the reduced dimensionality as a float32 matrix"""
+        vectors = self.base.embed_documents(texts, output_dimensionality=self.dimensions)
+        return self._truncate(vectors)
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a query at the reduced dimensionality"""
+        vector = self.base.embed_query(text, output_dimensionality=self.dimensions)
+        return self._truncate(vector).tolist()
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries in one request at the reduced dimensionality"""
+        vectors = self.base.embed_documents(
+            texts, task_type="retrieval_query", output_dimensionality=self.dimensions
+        )
+        return self._truncate(vectors).tolist()
+
+    def _truncate(self, vectors) -> np.ndarray:
+        """Keep the leading dimensions and restore unit length"""
+        vectors = np.asarray(vectors, dtype=np.float32)
+        return l2_normalize(vectors[..., :self.dimensions])
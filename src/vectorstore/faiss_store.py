@@ -0,0 +1,388 @@
+import json
+import math
+import os
+import sqlite3
+import threading
+from typing import List, Dict, Any, Optional
+
+import faiss
+import numpy as np
+from rank_bm25 import BM25Okapi
+
+import logging
+
+from src.config import settings
+from src.vectorstore.chroma_store import ChromaStore, Hit, _get_embeddings, _tokenize
+from src.vectorstore.embeddings import ReducedDimEmbeddings
+from src.utils.vector_utils import maximal_marginal_relevance
+
+logger = logging.getLogger(__name__)
+
+# Below this many chunks inverted lists don't pay off
+MIN_IVF_VECTORS = 1024
+# PQ codebooks of 256 centroids need 39 x 256 = 9984 training points to train reliably
+MIN_IVF_PQ_VECTORS = 10_000
+# FAISS k-means wants at least this many training points per inverted list
+MIN_POINTS_PER_LIST = 39
+# Inverted lists scanned per query
+FAISS_NPROBE = 16
+
+
+def _index_description(n_vectors: int, dim: int, quantizer: str = "pq") -> str:
+    """
+    Choose the FAISS index factory string for a corpus
+
+    Args:
+        n_vectors: Number of vectors to index
+        dim: Vector dimensionality
+        quantizer: "pq" for product quantization (smallest), "sq8" for 8-bit
+            scalar quantization (4x smaller than float32, near-exact recall)
+
+    Returns:
+        ``IVF{nlist},PQ{M}x8`` or ``IVF{nlist},SQ8`` for large corpora; ``SQ8`` or
+        ``Flat`` for small ones
+    """
+    # About 4 * sqrt(n) lists, but never fewer training points per list than k-means needs
+    nlist = max(1, min(int(4 * math.sqrt(n_vectors)), n_vectors // MIN_POINTS_PER_LIST))
+    if quantizer == "sq8":
+        if n_vectors < MIN_IVF_VECTORS:
+            return "SQ8"
+        return f"IVF{nlist},SQ8"
+
+    if n_vectors < MIN_IVF_PQ_VECTORS or dim % 8:
+        return "Flat"
+    return f"IVF{nlist},PQ{dim // 8}x8"
+
+
+class FaissStore(ChromaStore):
+    """
+    FAISS vector store for NCERT Science Class 8 content, with chunk text kept in a SQLite sidecar
+
+    Embedding, keyword, hybrid and context retrieval are inherited from ChromaStore;
+    only storage and dense search are replaced.
+    """
+
+    def __init__(self, embed_dim: Optional[int] = None):
+        """
+        Initialize FAISS store
+
+        Args:
+            embed_dim: Embedding dimensionality to store (defaults to EMBED_DIM setting)
+        """
+        self.settings = settings
+        self.embed_dim = embed_dim or self.settings.EMBED_DIM
+        self.embeddings = ReducedDimEmbeddings(
+            _get_embeddings(self.settings.EMBEDDING_MODEL, self.settings.GOOGLE_API_KEY),
+            dimensions=self.embed_dim
+        )
+        # Embeddings are backend independent, so the cache is shared with the Chroma backend
+        self.embedding_cache = self._open_embedding_cache()
+
+        self.collection_name = "ncert_science_class8"
+        self.index_dir = self.settings.FAISS_INDEX_DIR
+        os.makedirs(self.index_dir, exist_ok=True)
+        self.index_path = os.path.join(self.index_dir, f"{self.collection_name}.faiss")
+
+        # Chunk text and metadata, keyed by the FAISS row id
+        self._conn = sqlite3.connect(
+            os.path.join(self.index_dir, f"{self.collection_name}.sqlite3"),
+            check_same_thread=False
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS chunks (id INTEGER PRIMARY KEY, content TEXT, metadata TEXT)"
+        )
+        self._db_lock = threading.Lock()
+
+        # Set to the FAISS index once it holds data
+        self.vectorstore = None
+
+        # BM25 index over the stored chunks, built on first keyword search
+        self._bm25_index: Optional[Dict[str, Any]] = None
+        self._bm25_lock = threading.Lock()
+
+        self._initialize_vectorstore()
+
+    def _initialize_vectorstore(self):
+        """Load an existing index from disk"""
+        try:
+            if os.path.exists(self.index_path):
+                logger.info("Loading existing FAISS index...")
+                # Memory-map the index so vectors are paged in on demand instead of read up front
+                index = faiss.read_index(self.index_path, faiss.IO_FLAG_MMAP | faiss.IO_FLAG_READ_ONLY)
+                self.vectorstore = self._prepare_index(index)
+                logger.info("FAISS index loaded with %d vectors", self.vectorstore.ntotal)
+            else:
+                logger.info("No existing FAISS index found. Ready to index PDF.")
+                self.vectorstore = None
+
+        except Exception as e:
+            logger.error("Error initializing FAISS index: %s", e)
+            self.vectorstore = None
+
+    @staticmethod
+    def _prepare_index(index):
+        """Set search parameters and allow stored vectors to be reconstructed for MMR"""
+        try:
+            ivf = faiss.extract_index_ivf(index)
+        except RuntimeError:
+            # Flat index: nothing to tune
+            return index
+        ivf.nprobe = min(FAISS_NPROBE, ivf.nlist)
+        ivf.make_direct_map()
+        return index
+
+    def is_initialized(self) -> bool:
+        """Check if vector store is initialized with data"""
+        return self.vectorstore is not None and self.vectorstore.ntotal > 0
+
+    def index_pdf(self, pdf_path: str = None) -> bool:
+        """
+        Index NCERT Science Class 8 PDF into a FAISS index
+
+        Args:
+            pdf_path: Path to PDF file
+
+        Returns:
+            bool: Success status
+        """
+        try:
+            pages = self._load_pdf_pages(pdf_path)
+            if not pages:
+                return False
+
+            texts = [page.page_content for page in pages]
+            # Contiguous float32 already, so FAISS reads it without a copy
+            vectors = self._embed_documents_batched(texts)
+            # Inner product of unit vectors is cosine similarity
+            faiss.normalize_L2(vectors)
+
+            description = _index_description(len(vectors), vectors.shape[1], self.settings.FAISS_QUANTIZER)
+            logger.info("Building FAISS index %s over %d chunks", description, len(vectors))
+            index = faiss.index_factory(vectors.shape[1], description, faiss.METRIC_INNER_PRODUCT)
+            if not index.is_trained:
+                index.train(vectors)
+            index.add(vectors)
+            # Write beside the old file and swap it in, so a memory-mapped index stays valid
+            tmp_path = f"{self.index_path}.tmp"
+            faiss.write_index(index, tmp_path)
+            os.replace(tmp_path, self.index_path)
+
+            with self._db_lock:
+                with self._conn:
+                    self._conn.execute("DELETE FROM chunks")
+                    self._conn.executemany(
+                        "INSERT INTO chunks VALUES (?, ?, ?)",
+                        [
+                            (i, page.page_content, json.dumps(page.metadata, default=str))
+                            for i, page in enumerate(pages)
+                        ]
+                    )
+
+            self._bm25_index = None
+            self.vectorstore = self._prepare_index(index)
+            logger.info("Vector store initialized with %d documents", index.ntotal)
+            return True
+
+        except Exception as e:
+            logger.error("Error indexing PDF: %s", e)
+            logger.exception("Detailed error trace:")
+            return False
+
+    def _fetch_chunks(self, ids: List[int]) -> Dict[int, Dict[str, Any]]:
+        """Get the text and metadata of chunks by row id"""
+        if not ids:
+            return {}
+        with self._db_lock:
+            rows = self._conn.execute(
+                f"SELECT id, content, metadata FROM chunks WHERE id IN ({', '.join('?' * len(ids))})",
+                ids
+            ).fetchall()
+        return {
+            row_id: {"content": content, "metadata": json.loads(metadata) if metadata else {}}
+            for row_id, content, metadata in rows
+        }
+
+    def similarity_search(
+            self,
+            query: str,
+            k: int = 5,
+            filter_dict: Dict[str, Any] = None,
+            query_embedding: Optional[List[float]] = None,
+            mmr: bool = False,
+            fetch_k: int = 20,
+            lambda_mult: float = 0.5
+    ) -> List[Hit]:
+        """
+        Perform similarity search in the FAISS index
+
+        Args:
+            query: Search query
+            k: Number of results to return
+            filter_dict: Optional metadata equality filters, applied to the fetched candidates
+            query_embedding: Precomputed embedding of the query, skips embedding it again
+            mmr: Re-rank ``fetch_k`` candidates by maximal marginal relevance for diversity
+            fetch_k: Number of candidates fetched for MMR re-ranking or filtering
+            lambda_mult: MMR trade-off between relevance (1.0) and diversity (0.0)
+
+        Returns:
+            List of relevant documents with metadata
+        """
+        try:
+            if self.vectorstore is None:
+                logger.warning("Vector store not initialized")
+                return []
+
+            if query_embedding is None:
+                query_embedding = self.embed_query(query)
+
+            query_vector = np.asarray([query_embedding], dtype=np.float32)
+            faiss.normalize_L2(query_vector)
+            n_results = max(fetch_k, k) if (mmr or filter_dict) else k
+            scores, ids = self.vectorstore.search(query_vector, n_results)
+            hits = [(int(i), float(s)) for i, s in zip(ids[0], scores[0]) if i >= 0]
+
+            chunks = self._fetch_chunks([i for i, _ in hits])
+            if filter_dict:
+                hits = [
+                    (i, s) for i, s in hits
+                    if i in chunks and all(chunks[i]["metadata"].get(key) == value for key, value in filter_dict.items())
+                ]
+
+            if mmr and hits:
+                candidates = np.vstack([self.vectorstore.reconstruct(i) for i, _ in hits])
+                order = maximal_marginal_relevance(query_vector[0], candidates, k=k, lambda_mult=lambda_mult)
+                hits = [hits[i] for i in order]
+            else:
+                hits = hits[:k]
+
+            # Cosine distance, so lower is closer as with the Chroma backend
+            results = [
+                Hit(str(i), chunks[i]["content"], chunks[i]["metadata"], 1.0 - score)
+                for i, score in hits if i in chunks
+            ]
+
+            logger.info("Found %d documents", len(results))
+            return results
+
+        except Exception as e:
+            logger.error("Error in similarity search: %s", e)
+            return []
+
+    def similarity_search_batch(
+            self,
+            queries: List[str],
+            k: int = 5,
+            filter_dict: Dict[str, Any] = None,
+            query_embeddings: Optional[List[List[float]]] = None
+    ) -> List[List[Hit]]:
+        """
+        Perform similarity search for several queries with one matrix search
+
+        Args:
+            queries: Search queries
+            k: Number of results to return per query
+            filter_dict: Optional metadata equality filters, applied to the fetched candidates
+            query_embeddings: Precomputed embeddings of the queries
+
+        Returns:
+            One list of relevant documents per query, in the order of queries
+        """
+        try:
+            if self.vectorstore is None:
+                logger.warning("Vector store not initialized")
+                return [[] for _ in queries]
+            if not queries:
+                return []
+
+            if query_embeddings is None:
+                query_embeddings = self.embed_queries(queries)
+
+            query_vectors = np.asarray(query_embeddings, dtype=np.float32)
+            faiss.normalize_L2(query_vectors)
+            scores, ids = self.vectorstore.search(query_vectors, max(20, k) if filter_dict else k)
+            chunks = self._fetch_chunks(sorted({int(i) for i in ids.ravel() if i >= 0}))
+
+            results = []
+            for row_ids, row_scores in zip(ids, scores):
+                hits = [
+                    Hit(str(i), chunks[i]["content"], chunks[i]["metadata"], 1.0 - float(score))
+                    for i, score in zip(row_ids.tolist(), row_scores.tolist()) if i in chunks
+                ]
+                if filter_dict:
+                    hits = [
+                        hit for hit in hits
+                        if all(hit.metadata.get(key) == value for key, value in filter_dict.items())
+                    ]
+                results.append(hits[:k])
+
+            logger.info("Found documents for %d queries", len(results))
+            return results
+
+        except Exception as e:
+            logger.error("Error in batch similarity search: %s", e)
+            return [[] for _ in queries]
+
+    def _get_bm25_index(self) -> Optional[Dict[str, Any]]:
+        """Build the BM25 index from the sidecar once; None while the store is empty"""
+        with self._bm25_lock:
+            if self._bm25_index is None and self.vectorstore is not None:
+                with self._db_lock:
+                    rows = self._conn.execute("SELECT id, content, metadata FROM chunks ORDER BY id").fetchall()
+                if rows:
+                    self._bm25_index = {
+                        "bm25": BM25Okapi([_tokenize(content or "") for _, content, _ in rows]),
+                        "ids": [str(row_id) for row_id, _, _ in rows],
+                        "documents": [content for _, content, _ in rows],
+                        "metadatas": [json.loads(metadata) if metadata else {} for _, _, metadata in rows]
+                    }
+                    logger.info("Built BM25 index over %d chunks", len(rows))
+            return self._bm25_index
+
+    def get_collection_info(self) -> Dict[str, Any]:
+        """Get information about the index"""
+        if self.vectorstore is None:
+            return {
+                "exists": False,
+                "count": 0,
+                "status": "Not initialized"
+            }
+
+        return {
+            "exists": True,
+            "count": self.vectorstore.ntotal,
+            "status": "Ready",
+            "collection_name": self.collection_name
+        }
+
+    def reset_collection(self) -> bool:
+        """Reset the index (delete all data)"""
+        try:
+            if os.path.exists(self.index_path):
+                os.remove(self.index_path)
+            with self._db_lock:
+                with self._conn:
+                    self._conn.execute("DELETE FROM chunks")
+            logger.info("Collection reset successfully")
+
+            self.vectorstore = None
+            self._bm25_index = None
+            return True
+
+        except Exception as e:
+            logger.error("Error resetting collection: %s", e)
+            return False
+
+    def debug_vector_store_content(self, query: str = None) -> Dict[str, Any]:
+        """Debug method to check vector store content"""
+        if self.vectorstore is None:
+            return {"error": "Vector store not initialized"}
+
+        result = {
+            "total_documents": self.vectorstore.ntotal,
+            "collection_name": self.collection_name,
+            "vectorstore_initialized": True
+        }
+        if query:
+            result["search_results"] = self._debug_search_results(query)
+        return result
@@ -0,0 +1,95 @@
+import logging
+import os
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+from typing import List, Optional, Tuple
+
+import pymupdf
+from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+logger = logging.getLogger(__name__)
+
+# Below this many pages starting worker processes costs more than it saves
+MIN_PAGES_PER_WORKER = 16
+
+
+def _extract_page_range(pdf_path: str, start: int, stop: int) -> List[Tuple[int, str]]:
+    """
+    Extract the text of a range of pages (runs in a worker process)
+
+    Args:
+        pdf_path: Path to PDF file
+        start: First page number
+        stop: Page number after the last one
+
+    Returns:
+        Pairs of page number and page text
+    """
+    with pymupdf.open(pdf_path) as doc:
+        return [(i, doc[i].get_text("text")) for i in range(start, stop)]
+
+
+def load_pdf(pdf_path: str, workers: Optional[int] = None) -> List[Document]:
+    """
+    Extract the pages of a PDF with PyMuPDF, spread over worker processes
+
+    Args:
+        pdf_path: Path to PDF file
+        workers: Number of worker processes (defaults to the CPU count)
+
+    Returns:
+        One document per page, in page order, with ``source`` and ``page`` metadata
+    """
+    with pymupdf.open(pdf_path) as doc:
+        page_count = doc.page_count
+
+    workers = max(1, min(workers or os.cpu_count() or 1, page_count // MIN_PAGES_PER_WORKER))
+    if workers == 1:
+        pages = _extract_page_range(pdf_path, 0, page_count)
+    else:
+        step = -(-page_count // workers)
+        bounds = [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            ranges = pool.map(
+                _extract_page_range,
+                [pdf_path] * len(bounds),
+                [start for start, _ in bounds],
+                [stop for _, stop in bounds]
+            )
+            pages = [page for page_range in ranges for page in page_range]
+
+    logger.info("Extracted %d pages with %d worker(s)", page_count, workers)
+    return [Document(page_content=text, metadata={"source": pdf_path, "page": i}) for i, text in pages]
+
+
+@lru_cache(maxsize=None)
+def _token_splitter(chunk_size: int, chunk_overlap: int) -> RecursiveCharacterTextSplitter:
+    """Splitter measuring chunks in cl100k_base tokens"""
+    return RecursiveCharacterTextSplitter.from_tiktoken_encoder(
+        encoding_name="cl100k_base",
+        chunk_size=chunk_size,
+        chunk_overlap=chunk_overlap
+    )
+
+
+def load_and_split_pdf(
+        pdf_path: str,
+        chunk_size: int = 160,
+        chunk_overlap: int = 20,
+        workers: Optional[int] = None
+) -> List[Document]:
+    """
+    Extract a PDF and split its pages into token-bounded chunks
+
+    Args:
+        pdf_path: Path to PDF file
+        chunk_size: Maximum chunk length in tokens
+        chunk_overlap: Tokens shared by consecutive chunks of a page
+        workers: Number of worker processes for extraction
+
+    Returns:
+        Chunks in page order, each carrying its page's metadata; pages without text produce none
+    """
+    splitter = _token_splitter(chunk_size, chunk_overlap)
+    return splitter.split_documents(load_pdf(pdf_path, workers))